@@ -0,0 +1,151 @@
+"""
+Cross-request caches.
+
+ProductCache entries are detached copies of Product aggregates tagged with the
+version_number they were loaded at, so a repository only reuses one after
+checking it against the database's current version - one indexed single-column
+read instead of loading the whole aggregate.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from src.allocation.domain import model
+
+
+def detached_copy(product: model.Product) -> model.Product:
+    """
+    Copies a loaded product with no unflushed changes, and its batches and
+    allocations, out of its session without running any SQL
+    """
+
+    snapshot_session = Session()
+    snapshot = snapshot_session.merge(product, load=False)
+    snapshot_session.expunge_all()
+    return snapshot
+
+
+class ProductCache:
+    def __init__(self, max_size: int = 128):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries: OrderedDict[str, tuple[int, model.Product]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sku: str, version_number: int) -> Optional[model.Product]:
+        """
+        The cached copy of the product, if it is at ``version_number``
+        """
+
+        with self._lock:
+            entry = self._entries.get(sku)
+            if entry is None or entry[0] != version_number:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(sku)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, snapshot: model.Product) -> None:
+        """
+        Caches ``snapshot``, a detached copy made with ``detached_copy``
+        """
+
+        with self._lock:
+            self._entries[snapshot.sku] = (snapshot.version_number, snapshot)
+            self._entries.move_to_end(snapshot.sku)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, sku: str) -> None:
+        with self._lock:
+            if self._entries.pop(sku, None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                size=len(self._entries),
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                invalidations=self.invalidations,
+            )
+
+
+class AllocationCache:
+    """
+    Which batch recently allocated (orderid, sku, qty) lines went to, so a
+    repeated allocate request can be answered without touching the database.
+
+    Kept in step with allocations committed through this process's units of
+    work. Entries expire after ``ttl`` seconds, which bounds how long one can
+    outlive a deallocation made by another process - repeats come within seconds
+    of the original, so a short ttl loses little.
+    """
+
+    def __init__(self, max_size: int = 10_000, ttl: float = 30.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries: OrderedDict[tuple[str, str, int], tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, line: model.OrderLine) -> Optional[str]:
+        key = (line.orderid, line.sku, line.qty)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def put(self, line: model.OrderLine, batchref: str) -> None:
+        key = (line.orderid, line.sku, line.qty)
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, batchref)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, line: model.OrderLine) -> None:
+        with self._lock:
+            if self._entries.pop((line.orderid, line.sku, line.qty), None) is not None:
+                self.invalidations += 1
+
+    def invalidate_batches(self, batchrefs: list[str]) -> None:
+        """
+        Drops every entry pointing at one of ``batchrefs``, for deleted batches
+        """
+
+        deleted = set(batchrefs)
+        with self._lock:
+            stale = [key for key, (_, batchref) in self._entries.items() if batchref in deleted]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                size=len(self._entries),
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                invalidations=self.invalidations,
+            )
@@ -0,0 +1,174 @@
+"""
+Process-wide SQLAlchemy engines. Every unit of work talking to the same
+database shares one engine, and so one connection pool.
+
+A process forked from one that has used its engines (a pre-forked server worker,
+say) gets fresh, empty pools: the parent's connections are dropped, not closed, so
+the parent can go on using them.
+"""
+import os
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from src.allocation import config, metrics
+
+
+class PoolStats:
+    """
+    How long checkouts wait for a connection, and how close the pool gets to full
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.peak_checked_out = 0
+        self._lock = threading.Lock()
+
+    def record_checkout(self, wait: float, checked_out: int) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.peak_checked_out = max(self.peak_checked_out, checked_out)
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return dict(
+                capacity=self.capacity,
+                checkouts=self.checkouts,
+                timeouts=self.timeouts,
+                mean_wait=self.total_wait / self.checkouts if self.checkouts else 0.0,
+                max_wait=self.max_wait,
+                peak_checked_out=self.peak_checked_out,
+                peak_saturation=self.peak_checked_out / self.capacity if self.capacity else 0.0,
+            )
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool that records checkout wait time and saturation in ``stats``
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats(capacity=self.size() + max(self._max_overflow, 0))
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.record_timeout()
+            raise
+        self.stats.record_checkout(time.perf_counter() - started, self.checkedout())
+        return connection
+
+
+_engines: dict[str, Engine] = {}
+_session_factories: dict[str, sessionmaker] = {}
+_async_engines: dict[str, AsyncEngine] = {}
+_async_session_factories: dict[str, sessionmaker] = {}
+_lock = threading.Lock()
+
+
+def _create_engine(uri: str) -> Engine:
+    if uri.startswith("sqlite"):
+        # SQLite engines pick their own pool; QueuePool options don't apply
+        return create_engine(uri)
+    return create_engine(uri, poolclass=InstrumentedQueuePool, **config.get_engine_options())
+
+
+def get_engine(uri: Optional[str] = None) -> Engine:
+    uri = uri or config.get_database_uri()
+    with _lock:
+        if uri not in _engines:
+            _engines[uri] = _create_engine(uri)
+        return _engines[uri]
+
+
+def get_session_factory(uri: Optional[str] = None) -> sessionmaker:
+    uri = uri or config.get_database_uri()
+    engine = get_engine(uri)
+    with _lock:
+        if uri not in _session_factories:
+            _session_factories[uri] = sessionmaker(bind=engine)
+        return _session_factories[uri]
+
+
+def get_async_engine(uri: Optional[str] = None) -> AsyncEngine:
+    uri = uri or config.get_async_database_uri()
+    with _lock:
+        if uri not in _async_engines:
+            options = {} if uri.startswith("sqlite") else config.get_engine_options()
+            _async_engines[uri] = create_async_engine(uri, **options)
+        return _async_engines[uri]
+
+
+def get_async_session_factory(uri: Optional[str] = None) -> sessionmaker:
+    uri = uri or config.get_async_database_uri()
+    engine = get_async_engine(uri)
+    with _lock:
+        if uri not in _async_session_factories:
+            # Expired attributes would need lazy loads, which asyncio sessions can't do
+            _async_session_factories[uri] = sessionmaker(
+                bind=engine, class_=AsyncSession, expire_on_commit=False
+            )
+        return _async_session_factories[uri]
+
+
+def _after_fork_in_child() -> None:
+    """
+    Replaces every engine's pool. The inherited connections share their sockets
+    with the parent, so the child must neither use nor close them.
+    """
+
+    global _lock
+    # Another of the parent's threads may have held the lock when it forked
+    _lock = threading.Lock()
+    for engine in _engines.values():
+        engine.dispose(close=False)
+    for async_engine in _async_engines.values():
+        async_engine.sync_engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def pool_stats() -> dict[str, dict]:
+    """
+    Pool statistics for every engine with an instrumented pool, keyed by database URL
+    (password hidden)
+    """
+
+    with _lock:
+        engines = list(_engines.values())
+    return {
+        repr(engine.url): engine.pool.stats.as_dict()
+        for engine in engines
+        if isinstance(engine.pool, InstrumentedQueuePool)
+    }
+
+
+def _pool_samples():
+    for url, stats in pool_stats().items():
+        for stat, value in stats.items():
+            yield {"database": url, "stat": stat}, value
+
+
+metrics.REGISTRY.register(metrics.GaugeCallback(
+    "allocation_db_pool", "Connection pool statistics per database", _pool_samples
+))
@@ -0,0 +1,151 @@
+"""
+Append-only, fsync'd journal of JSON records, split into segment files so the
+part already covered by a snapshot can be dropped.
+
+Appends are group committed: whichever thread finds no write in progress writes
+and fsyncs everything queued so far, and every thread whose record that covered
+returns together, so concurrent committers share one fsync.
+"""
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Iterator
+
+SEGMENT_GLOB = "journal-*.log"
+
+
+class JournalFailed(Exception):
+    """
+    A write or fsync failed. The journal stops accepting records, as it can no
+    longer tell which of the queued ones made it to disk.
+    """
+
+
+def _segment_start(path: Path) -> int:
+    return int(path.stem.split("-")[1])
+
+
+def segments(directory: Path) -> list[Path]:
+    return sorted(directory.glob(SEGMENT_GLOB), key=_segment_start)
+
+
+def read(directory: Path) -> Iterator[dict]:
+    """
+    Every record in the journal, oldest first.
+
+    A record torn by a crash mid-write can only be the end of the last segment
+    without its newline; it was never acknowledged, so it is cut off the file, so
+    that the next append starts on a line of its own.
+    """
+
+    paths = segments(directory)
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            if path != paths[-1]:
+                raise JournalFailed(f"{path} ends in a torn record but isn't the last segment")
+            with open(path, "r+b") as f:
+                f.truncate(complete)
+                os.fsync(f.fileno())
+        for line in data[:complete].splitlines():
+            yield json.loads(line)
+
+
+class Journal:
+    def __init__(self, directory: Path, last_seq: int = 0):
+        self.directory = directory
+        self._last_seq = last_seq
+        self._durable_seq = last_seq
+        self._pending: list[str] = []
+        self._writing = False
+        self._failure: Exception | None = None
+        self._condition = threading.Condition()
+        self._file = self._open_segment(last_seq + 1)
+
+    def _open_segment(self, start_seq: int):
+        path = self.directory / f"journal-{start_seq:012d}.log"
+        f = open(path, "a")
+        self._fsync_directory()
+        return f
+
+    def _fsync_directory(self) -> None:
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    @property
+    def last_seq(self) -> int:
+        return self._last_seq
+
+    def append(self, record: dict) -> int:
+        """
+        Writes ``record`` with the next sequence number, returning that number once
+        the record is on disk
+        """
+
+        with self._condition:
+            self._raise_if_failed()
+            self._last_seq += 1
+            seq = self._last_seq
+            self._pending.append(json.dumps(dict(record, seq=seq), separators=(",", ":")))
+            while self._durable_seq < seq:
+                self._raise_if_failed()
+                if self._writing:
+                    self._condition.wait()
+                else:
+                    self._write_pending()
+        return seq
+
+    def _raise_if_failed(self) -> None:
+        if self._failure is not None:
+            raise JournalFailed(str(self._failure)) from self._failure
+
+    def _write_pending(self) -> None:
+        """
+        Writes and fsyncs every queued record. Called holding the condition, which
+        is released during the write so other threads can queue behind it.
+        """
+
+        self._writing = True
+        lines, self._pending = self._pending, []
+        covered = self._last_seq
+        self._condition.release()
+        try:
+            self._file.write("".join(line + "\n" for line in lines))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except Exception as e:
+            self._failure = e
+            raise
+        finally:
+            self._condition.acquire()
+            self._writing = False
+            self._condition.notify_all()
+        self._durable_seq = covered
+
+    def rotate(self) -> list[Path]:
+        """
+        Starts a new segment for records after the current last one, returning
+        the older segments
+        """
+
+        with self._condition:
+            self._raise_if_failed()
+            while self._writing or self._pending:
+                if self._writing:
+                    self._condition.wait()
+                else:
+                    self._write_pending()
+            self._file.close()
+            self._file = self._open_segment(self._last_seq + 1)
+            current = Path(self._file.name)
+        return [path for path in segments(self.directory) if path != current]
+
+    def close(self) -> None:
+        with self._condition:
+            self._file.close()
@@ -0,0 +1,408 @@
+"""
+Product aggregates kept resident in memory, for SKUs too busy for a database
+round trip per allocation.
+
+A unit of work locks each SKU it reads until it exits, so changes to one
+product are serialised while different products proceed in parallel. Changes
+are recorded as they happen by wrapping each product's batch list and each
+batch's allocations in tracking collections (much as the ORM instruments
+them), which lets a commit journal just what changed and a rollback undo it.
+
+Committed changes are durable once ``commit`` returns: they go to an fsync'd,
+group-committed journal (see adapters.journal). Every ``snapshot_every``
+commits the store writes a snapshot and drops the journal segments it covers,
+so a restart loads the latest snapshot and replays the journal tail.
+"""
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from datetime import date
+from pathlib import Path
+from typing import Optional, Sequence
+
+from src.allocation.adapters import journal, repository
+from src.allocation.domain import model
+
+SNAPSHOT_FILE = "snapshot.json"
+
+
+# Serialisation
+
+def _batch_to_dict(batch: model.Batch) -> dict:
+    return dict(
+        ref=batch.reference,
+        sku=batch.sku,
+        qty=batch._purchased_quantity,
+        eta=batch.eta.isoformat() if batch.eta else None,
+        lines=sorted([line.orderid, line.qty] for line in batch._allocations),
+    )
+
+
+def _batch_from_dict(data: dict) -> model.Batch:
+    eta = date.fromisoformat(data["eta"]) if data["eta"] else None
+    batch = model.Batch(data["ref"], data["sku"], data["qty"], eta)
+    batch._allocations.update(
+        model.OrderLine(orderid, data["sku"], qty) for orderid, qty in data["lines"]
+    )
+    batch._allocated_quantity = None
+    return batch
+
+
+def _product_to_dict(product: model.Product) -> dict:
+    return dict(
+        sku=product.sku,
+        version=product.version_number,
+        batches=[_batch_to_dict(b) for b in product.batches],
+    )
+
+
+def _product_from_dict(data: dict) -> model.Product:
+    return model.Product(
+        data["sku"], [_batch_from_dict(b) for b in data["batches"]], version_number=data["version"]
+    )
+
+
+def _replay(products: dict[str, model.Product], change: dict) -> None:
+    sku = change["sku"]
+    for op, *args in change["ops"]:
+        if op == "create":
+            products[sku] = _product_from_dict(args[0])
+        elif op == "delete":
+            products.pop(sku, None)
+        elif op == "add_batch":
+            products[sku].batches.append(_batch_from_dict(args[0]))
+        elif op == "remove_batch":
+            product = products[sku]
+            product.batches.remove(next(b for b in product.batches if b.reference == args[0]))
+        elif op in ("allocate", "deallocate"):
+            ref, orderid, qty = args
+            batch = next(b for b in products[sku].batches if b.reference == ref)
+            line = model.OrderLine(orderid, sku, qty)
+            batch._allocations.add(line) if op == "allocate" else batch._allocations.remove(line)
+            batch._allocated_quantity = None
+    if sku in products:
+        products[sku].version_number = change["version"]
+        products[sku]._index = None
+
+
+# Change tracking
+
+class _TrackedAllocations(set):
+    def __init__(self, lines, batch: model.Batch, log: list):
+        super().__init__(lines)
+        self.batch = batch
+        self.log = log
+
+    def add(self, line: model.OrderLine) -> None:
+        if line not in self:
+            super().add(line)
+            self.log.append(("allocate", self.batch, line))
+
+    def remove(self, line: model.OrderLine) -> None:
+        super().remove(line)
+        self.log.append(("deallocate", self.batch, line))
+
+    def discard(self, line: model.OrderLine) -> None:
+        if line in self:
+            self.remove(line)
+
+    def clear(self) -> None:
+        for line in list(self):
+            self.remove(line)
+
+
+class _TrackedBatches(list):
+    def __init__(self, batches, log: list):
+        super().__init__(batches)
+        self.log = log
+        for batch in self:
+            _track_batch(batch, log)
+
+    def append(self, batch: model.Batch) -> None:
+        _track_batch(batch, self.log)
+        super().append(batch)
+        # Journalled as it is now; later changes to it are logged as they happen
+        self.log.append(("add_batch", batch, _batch_to_dict(batch)))
+
+    def remove(self, batch: model.Batch) -> None:
+        position = self.index(batch)
+        del self[position]
+        self.log.append(("remove_batch", batch, position))
+
+
+def _track_batch(batch: model.Batch, log: list) -> None:
+    batch._allocations = _TrackedAllocations(batch._allocations, batch, log)
+
+
+def _undo(product: model.Product, log: list) -> None:
+    for op, batch, *args in reversed(log):
+        if op == "allocate":
+            set.remove(batch._allocations, args[0])
+        elif op == "deallocate":
+            set.add(batch._allocations, args[0])
+        elif op == "add_batch":
+            list.remove(product.batches, batch)
+        elif op == "remove_batch":
+            list.insert(product.batches, args[0], batch)
+        batch._allocated_quantity = None
+    product._index = None
+
+
+def _journal_ops(log: list) -> list:
+    ops = []
+    for op, batch, *args in log:
+        if op in ("allocate", "deallocate"):
+            ops.append([op, batch.reference, args[0].orderid, args[0].qty])
+        elif op == "add_batch":
+            ops.append([op, args[0]])
+        elif op == "remove_batch":
+            ops.append([op, batch.reference])
+    return ops
+
+
+@dataclass
+class _Resident:
+    product: model.Product
+    seq: int = 0  # journal record that last changed the product
+    log: list = field(default_factory=list)
+
+    def track(self) -> None:
+        self.product.batches = _TrackedBatches(self.product.batches, self.log)
+        if not isinstance(self.product.batches, _TrackedBatches):
+            # Mapped classes swap any collection assigned to them for their own
+            raise RuntimeError("ProductStore can't track products while the ORM mappers are started")
+
+
+class ProductStore:
+    def __init__(self, directory, snapshot_every: int = 10_000):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.snapshot_every = snapshot_every
+        self._products: dict[str, _Resident] = {}
+        self._locks: dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        self._commits_since_snapshot = 0
+        self._snapshot_lock = threading.Lock()
+        self.journal = journal.Journal(self.directory, self._recover())
+
+    def _recover(self) -> int:
+        """
+        Loads the snapshot and replays the journal after it, returning the last
+        journal sequence number seen
+        """
+
+        products: dict[str, model.Product] = {}
+        seqs: dict[str, int] = {}
+        last_seq = 0
+        snapshot_path = self.directory / SNAPSHOT_FILE
+        if snapshot_path.exists():
+            snapshot = json.loads(snapshot_path.read_text())
+            last_seq = snapshot["seq"]
+            for data in snapshot["products"]:
+                products[data["sku"]] = _product_from_dict(data)
+                seqs[data["sku"]] = data["seq"]
+
+        snapshot_seq = last_seq
+        for record in journal.read(self.directory):
+            if record["seq"] <= snapshot_seq:
+                continue  # in a segment the snapshot covers that wasn't deleted yet
+            last_seq = record["seq"]
+            for change in record["changes"]:
+                # The snapshot may already include changes journalled while it was taken
+                if record["seq"] > seqs.get(change["sku"], 0):
+                    _replay(products, change)
+                    seqs[change["sku"]] = record["seq"]
+
+        for sku, product in products.items():
+            resident = _Resident(product, seqs[sku])
+            resident.track()
+            self._products[sku] = resident
+        return last_seq
+
+    def lock(self, sku: str) -> threading.Lock:
+        with self._locks_lock:
+            if sku not in self._locks:
+                self._locks[sku] = threading.Lock()
+            return self._locks[sku]
+
+    def resident(self, sku: str) -> Optional[_Resident]:
+        """
+        Call holding ``lock(sku)``
+        """
+        return self._products.get(sku)
+
+    def skus(self) -> list[str]:
+        return sorted(self._products)
+
+    def commit(self, changes: list[dict], residents: dict[str, Optional[_Resident]]) -> None:
+        """
+        Journals ``changes`` and then makes ``residents`` (None for deleted
+        products) current. Call holding the lock of every SKU involved.
+        """
+
+        seq = self.journal.append({"changes": changes})
+        for sku, resident in residents.items():
+            if resident is None:
+                self._products.pop(sku, None)
+            else:
+                resident.seq = seq
+                self._products[sku] = resident
+        with self._locks_lock:
+            self._commits_since_snapshot += 1
+
+    def snapshot_due(self) -> bool:
+        return self._commits_since_snapshot >= self.snapshot_every
+
+    def snapshot(self) -> None:
+        """
+        Writes a snapshot of every product and drops the journal segments it
+        covers. Takes each SKU's lock in turn, so commits carry on meanwhile; call
+        it holding none of them.
+        """
+
+        if not self._snapshot_lock.acquire(blocking=False):
+            return  # another thread is already taking one
+        try:
+            with self._locks_lock:
+                self._commits_since_snapshot = 0
+            covered_segments = self.journal.rotate()
+            seq = self.journal.last_seq
+            products = []
+            for sku in self.skus():
+                with self.lock(sku):
+                    resident = self._products.get(sku)
+                    if resident is not None:
+                        products.append(dict(_product_to_dict(resident.product), seq=resident.seq))
+
+            path = self.directory / SNAPSHOT_FILE
+            temporary = path.with_suffix(".tmp")
+            with open(temporary, "w") as f:
+                json.dump({"seq": seq, "products": products}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, path)
+            self.journal._fsync_directory()
+            for segment in covered_segments:
+                segment.unlink()
+        finally:
+            self._snapshot_lock.release()
+
+    def close(self) -> None:
+        self.journal.close()
+
+
+class InMemoryRepository(repository.AbstractProductRepository):
+    """
+    Repository over a ProductStore, used by InMemoryUnitOfWork. Holds the lock of
+    every SKU it has touched until ``release`` is called.
+    """
+
+    def __init__(self, store: ProductStore):
+        self.store = store
+        self._locked: dict[str, threading.Lock] = {}
+        self._residents: dict[str, Optional[_Resident]] = {}  # touched this transaction
+        self._originals: dict[str, int] = {}  # version numbers to roll back to
+
+    def _acquire(self, sku: str) -> None:
+        if sku not in self._locked:
+            lock = self.store.lock(sku)
+            lock.acquire()
+            self._locked[sku] = lock
+
+    def add(self, product: model.Product) -> None:
+        self._acquire(product.sku)
+        self._residents[product.sku] = _Resident(product)
+
+    def delete(self, product: model.Product) -> None:
+        self._acquire(product.sku)
+        self._residents[product.sku] = None
+
+    def get(self, sku: str) -> model.Product | None:
+        self._acquire(sku)
+        if sku in self._residents:
+            resident = self._residents[sku]
+        else:
+            resident = self.store.resident(sku)
+            if resident is not None:
+                self._residents[sku] = resident
+                self._originals[sku] = resident.product.version_number
+        return None if resident is None else resident.product
+
+    def get_many(self, skus: list[str]) -> list[model.Product]:
+        return [product for sku in sorted(set(skus)) if (product := self.get(sku)) is not None]
+
+    def list(self) -> list[model.Product]:
+        return self.get_many(self.store.skus())
+
+    def get_allocation(self, orderid: str, sku: str) -> Optional[tuple[model.OrderLine, str]]:
+        product = self.get(sku)
+        for batch in product.batches if product else []:
+            for line in batch._allocations:
+                if line.orderid == orderid:
+                    return line, batch.reference
+        return None
+
+    def get_batchrefs(self, lines: Sequence[model.OrderLine]) -> dict[model.OrderLine, str]:
+        batchrefs = {}
+        for line in lines:
+            product = self.get(line.sku)
+            for batch in product.batches if product else []:
+                if batch.is_allocated(line):
+                    batchrefs[line] = batch.reference
+        return batchrefs
+
+    def commit(self) -> None:
+        changes, residents = [], {}
+        for sku, resident in self._residents.items():
+            if resident is None:
+                changes.append(dict(sku=sku, version=0, ops=[["delete"]]))
+            elif sku not in self._originals:
+                # New this transaction: written out whole, then tracked from here on
+                changes.append(dict(
+                    sku=sku, version=resident.product.version_number,
+                    ops=[["create", _product_to_dict(resident.product)]],
+                ))
+                resident.track()
+            elif resident.log:
+                changes.append(dict(
+                    sku=sku, version=resident.product.version_number, ops=_journal_ops(resident.log)
+                ))
+            else:
+                continue
+            residents[sku] = resident
+
+        if changes:
+            self.store.commit(changes, residents)
+        for sku, resident in self._residents.items():
+            if resident is not None:
+                resident.log.clear()
+                self._originals[sku] = resident.product.version_number
+        self._residents = {sku: r for sku, r in self._residents.items() if sku in self._originals}
+
+    def rollback(self) -> bool:
+        """
+        Undoes uncommitted changes, returning whether there were any
+        """
+
+        pending = any(
+            resident is None or resident.log or sku not in self._originals
+            or resident.product.version_number != self._originals[sku]
+            for sku, resident in self._residents.items()
+        )
+        for sku, version_number in self._originals.items():
+            resident = self.store.resident(sku)
+            if resident is None:
+                continue
+            if resident.log:
+                _undo(resident.product, resident.log)
+                resident.log.clear()
+            resident.product.version_number = version_number
+        self._residents = {}
+        self._originals = {}
+        return pending
+
+    def release(self) -> None:
+        for lock in self._locked.values():
+            lock.release()
+        self._locked = {}
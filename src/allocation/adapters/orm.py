@@ -1,35 +1,60 @@
 import logging
+import sys
+import threading
 
-from sqlalchemy import MetaData, Column, Table, Integer, String, Date, ForeignKey
-from sqlalchemy.orm import mapper, relationship
+from sqlalchemy import (
+    MetaData, Column, Table, Integer, String, Date, ForeignKey, Index, TypeDecorator, bindparam,
+    event, func, inspect, select
+)
+from sqlalchemy.orm import Session, attributes, column_property, mapper, relationship
 
 from src.allocation.domain import model
 
 logger = logging.getLogger(__name__)
 
+_mapping_lock = threading.Lock()
+
 metadata = MetaData()
 
+
+class InternedString(TypeDecorator):
+    """
+    String whose loaded values are interned, so the many lines and batches of a
+    loaded product share one copy of its SKU instead of one per row. (Mapped
+    classes can't use __slots__ - the ORM keeps its state in the instance
+    __dict__ and needs weak references to instances.)
+    """
+
+    impl = String
+    cache_ok = True
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else sys.intern(value)
+
+
 orderline_table = Table(
     "order_lines",
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
-    Column("sku", String(255)),
+    Column("sku", InternedString(255)),
     Column("qty", Integer, nullable=False),
     Column("orderid", String(255)),
+    Index("ix_order_lines_orderid_sku", "orderid", "sku"),
 )
 
 products_table = Table(
     "products",
     metadata,
-    Column("sku", String(255), primary_key=True),
+    Column("sku", InternedString(255), primary_key=True),
+    Column("version_number", Integer, nullable=False, server_default="0"),
 )
 
 batch_table = Table(
     "batches",
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
-    Column("reference", String(255)),
-    Column("sku", ForeignKey("products.sku")),
+    Column("reference", String(255), unique=True),
+    Column("sku", ForeignKey("products.sku"), index=True),
     Column("_purchased_quantity", Integer),
     Column("eta", Date)
 )
@@ -38,12 +63,93 @@ allocations_table = Table(
     "allocations",
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
-    Column("orderline_id", ForeignKey("order_lines.id")),
-    Column("batch_id", ForeignKey("batches.id"))
+    # A line is allocated to at most one batch
+    Column("orderline_id", ForeignKey("order_lines.id"), unique=True),
+    Column("batch_id", ForeignKey("batches.id"), index=True),
 )
 
+# Denormalised read model for "where did my order go" lookups, kept in step with
+# the aggregate on every flush (see _update_allocations_view). Also how allocate
+# recognises a repeated request: a line is allocated at most once.
+allocations_view = Table(
+    "allocations_view",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("orderid", String(255), nullable=False),
+    Column("sku", String(255), nullable=False),
+    Column("qty", Integer, nullable=False),
+    Column("batchref", String(255), nullable=False),
+    Index("ix_allocations_view_orderid_sku_qty", "orderid", "sku", "qty", unique=True),
+)
+
+# Key in Session.info under which each flush's view changes are collected, so the
+# unit of work can apply them to its AllocationCache once they are committed
+VIEW_CHANGES = "allocations_view_changes"
+
+
+class ViewChanges:
+    def __init__(self):
+        self.added: list[dict] = []
+        self.removed: list[dict] = []
+        self.removed_batchrefs: list[str] = []
+
+
+def _view_row(line: model.OrderLine, batch: model.Batch) -> dict:
+    return dict(orderid=line.orderid, sku=line.sku, qty=line.qty, batchref=batch.reference)
+
+
+def _update_allocations_view(session: Session, flush_context, instances) -> None:
+    """
+    Mirrors the allocations about to be flushed into ``allocations_view``, in the
+    same transaction
+    """
+
+    added, removed, removed_batchrefs = [], [], []
+    for obj in session.new | session.dirty:
+        if isinstance(obj, model.Batch):
+            history = attributes.get_history(obj, "_allocations")
+            added += [_view_row(line, obj) for line in history.added]
+            removed += [_view_row(line, obj) for line in history.deleted]
+        elif isinstance(obj, model.Product):
+            removed_batchrefs += [b.reference for b in attributes.get_history(obj, "batches").deleted]
+    removed_batchrefs += [obj.reference for obj in session.deleted if isinstance(obj, model.Batch)]
+
+    changes = session.info.setdefault(VIEW_CHANGES, ViewChanges())
+    changes.added += added
+    changes.removed += removed
+    changes.removed_batchrefs += removed_batchrefs
+
+    # Rows of deleted batches go in one statement below
+    removed = [row for row in removed if row["batchref"] not in removed_batchrefs]
+
+    view = allocations_view.c
+    if removed:
+        session.execute(
+            allocations_view.delete().where(
+                view.orderid == bindparam("orderid"),
+                view.sku == bindparam("sku"),
+                view.qty == bindparam("qty"),
+                view.batchref == bindparam("batchref"),
+            ),
+            removed,
+        )
+    if removed_batchrefs:
+        session.execute(allocations_view.delete().where(view.batchref.in_(removed_batchrefs)))
+    if added:
+        session.execute(allocations_view.insert(), added)
+
 
 def start_mappers():
+    """
+    Maps the domain model onto the tables. Safe to call more than once.
+    """
+
+    with _mapping_lock:
+        if inspect(model.Product, raiseerr=False) is None:
+            _start_mappers()
+
+
+def _start_mappers():
     logger.info("Starting mappers")
 
     lines_mapper = mapper(model.OrderLine, orderline_table)
@@ -57,8 +163,29 @@ def start_mappers():
                 collection_class=set,
                 cascade="all, delete",
             ),
+            # Summed in SQL, so a batch's availability is known without loading its
+            # lines. Read-only: the domain keeps it up to date in memory, and it is
+            # re-read after a commit or rollback expires it.
+            "_allocated_quantity": column_property(
+                select(func.coalesce(func.sum(orderline_table.c.qty), 0))
+                .select_from(allocations_table.join(orderline_table))
+                .where(allocations_table.c.batch_id == batch_table.c.id)
+                .scalar_subquery()
+            ),
         }
     )
+    if not event.contains(Session, "before_flush", _update_allocations_view):
+        event.listen(Session, "before_flush", _update_allocations_view)
     mapper(
-        model.Product, products_table, properties={"batches": relationship(batches_mapper)}
+        model.Product,
+        products_table,
+        properties={
+            # Batches removed from a product are deleted, not left behind without a sku
+            "batches": relationship(
+                batches_mapper, order_by=batch_table.c.id, cascade="all, delete-orphan"
+            ),
+        },
+        # Product bumps its own version on every change; a stale one fails the UPDATE
+        version_id_col=products_table.c.version_number,
+        version_id_generator=False,
     )
@@ -1,7 +1,12 @@
 import abc
+from typing import Optional, Sequence
 
-from sqlalchemy.orm import Session
+from sqlalchemy import func, insert, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload, selectinload
 
+from src.allocation.adapters import orm
+from src.allocation.adapters.cache import AllocationCache, ProductCache, detached_copy
 from src.allocation.domain import model
 
 
@@ -18,23 +23,417 @@ class AbstractProductRepository(abc.ABC):
     def get(self, sku: str) -> model.Product | None:
         raise NotImplementedError
 
+    def get_summary(self, sku: str) -> model.Product | None:
+        """
+        The product for changes to a few of its batches: repositories that can
+        leave batches' lines unloaded until they are read override this
+        """
+        return self.get(sku)
+
+    @abc.abstractmethod
+    def get_many(self, skus: list[str]) -> list[model.Product]:
+        """
+        The products that exist out of ``skus``, in SKU order. Whatever a backend
+        locks, it locks in that order, so concurrent callers with overlapping SKUs
+        queue up rather than deadlock.
+        """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def list(self) -> list[model.Product]:
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def get_allocation(self, orderid: str, sku: str) -> Optional[tuple[model.OrderLine, str]]:
+        """
+        The order's allocated line for ``sku`` and the reference of its batch, if it has one
+        """
+        raise NotImplementedError
+
+    def get_batchref(self, line: model.OrderLine) -> Optional[str]:
+        """
+        The reference of the batch ``line`` is allocated to, if it is
+        """
+        return self.get_batchrefs([line]).get(line)
+
+    @abc.abstractmethod
+    def get_batchrefs(self, lines: Sequence[model.OrderLine]) -> dict[model.OrderLine, str]:
+        """
+        The batches those of ``lines`` that are allocated are allocated to
+        """
+        raise NotImplementedError
+
+    def allocate_line(self, line: model.OrderLine) -> Optional[str]:
+        """
+        Allocates ``line`` as Product.allocate would, returning the batch's
+        reference, or None if there is no such product. Repositories that can
+        choose and fill the batch without loading the product override this.
+
+        :raises model.OutOfStock
+        """
+        product = self.get(line.sku)
+        if product is None:
+            return None
+        return product.allocate(line)
+
+
+def _batchrefs_query(lines: Sequence[model.OrderLine]):
+    """
+    Read through allocations_view's unique (orderid, sku, qty) index, without
+    loading the aggregate. Matches a superset of ``lines`` when they span
+    several orders; see _matching_batchrefs.
+    """
+
+    view = orm.allocations_view.c
+    return select(view.orderid, view.sku, view.qty, view.batchref).where(
+        view.orderid.in_({line.orderid for line in lines}),
+        view.sku.in_({line.sku for line in lines}),
+        view.qty.in_({line.qty for line in lines}),
+    )
+
+
+def _matching_batchrefs(rows, lines: Sequence[model.OrderLine]) -> dict[model.OrderLine, str]:
+    wanted = set(lines)
+    found = {model.OrderLine(orderid, sku, qty): batchref for orderid, sku, qty, batchref in rows}
+    return {line: batchref for line, batchref in found.items() if line in wanted}
+
+
+def _allocated_quantity(batch_id):
+    lines, allocations = orm.orderline_table, orm.allocations_table
+    return (
+        select(func.coalesce(func.sum(lines.c.qty), 0))
+        .select_from(allocations.join(lines, allocations.c.orderline_id == lines.c.id))
+        .where(allocations.c.batch_id == batch_id)
+        .scalar_subquery()
+    )
+
+
+def _candidate_batch_query(line: model.OrderLine):
+    """
+    The batch Product.allocate would pick for ``line``: the first with room for it,
+    warehouse stock (no ETA) first, then by ETA, then in the order added
+    """
+
+    batches = orm.batch_table
+    return (
+        select(batches.c.id, batches.c.reference)
+        .where(
+            batches.c.sku == line.sku,
+            batches.c._purchased_quantity - _allocated_quantity(batches.c.id) >= line.qty,
+        )
+        .order_by(batches.c.eta.asc().nullsfirst(), batches.c.id)
+        .limit(1)
+    )
+
+
+def _allocate_in_one_statement(line: model.OrderLine):
+    """
+    Postgres: locks the candidate batch, skipping any another transaction holds
+    (one being deleted, say), and inserts the line, its allocation and its
+    allocations_view row, returning the batch's reference - or nothing if no
+    batch has room
+    """
+
+    candidate = _candidate_batch_query(line).with_for_update(skip_locked=True).cte("candidate")
+    new_line = (
+        insert(orm.orderline_table)
+        .from_select(
+            ["orderid", "sku", "qty"],
+            select(literal(line.orderid), literal(line.sku), literal(line.qty)).select_from(candidate),
+        )
+        .returning(orm.orderline_table.c.id)
+        .cte("new_line")
+    )
+    new_allocation = insert(orm.allocations_table).from_select(
+        ["orderline_id", "batch_id"], select(new_line.c.id, candidate.c.id)
+    ).cte("new_allocation")
+    new_view_row = insert(orm.allocations_view).from_select(
+        ["orderid", "sku", "qty", "batchref"],
+        select(literal(line.orderid), literal(line.sku), literal(line.qty), candidate.c.reference),
+    ).cte("new_view_row")
+    return select(candidate.c.reference).add_cte(new_allocation).add_cte(new_view_row)
+
+
+def _allocation_query(orderid: str, sku: str):
+    """
+    Qty of an allocated order line and the reference of its batch, found through
+    the order_lines (orderid, sku) and allocations (orderline_id) indexes and the
+    batches primary key, without loading the aggregate
+    """
+
+    lines, allocations, batches = orm.orderline_table, orm.allocations_table, orm.batch_table
+    return (
+        select(lines.c.qty, batches.c.reference)
+        .select_from(
+            lines.join(allocations, allocations.c.orderline_id == lines.c.id)
+            .join(batches, batches.c.id == allocations.c.batch_id)
+        )
+        .where(lines.c.orderid == orderid, lines.c.sku == sku)
+        .limit(1)
+    )
+
+
+def _aggregate_loader_options(strategy: str) -> list:
+    """
+    Loader options that bring in a product's batches (and, except for "summary",
+    their allocations) with the product itself, instead of lazy loading them one
+    batch at a time
+    """
+
+    if strategy == "selectin":
+        return [selectinload(model.Product.batches).selectinload(model.Batch._allocations)]
+    if strategy == "summary":
+        # Batches come with their allocated quantity summed in SQL; a batch's lines
+        # are only loaded if something reads them (allocating loads the chosen
+        # batch's, to check the line isn't already there)
+        return [selectinload(model.Product.batches)]
+    if strategy == "joined":
+        return [joinedload(model.Product.batches).joinedload(model.Batch._allocations)]
+    if strategy == "lazy":
+        return []
+    raise ValueError(f"Unknown load strategy {strategy}")
+
 
 class SqlAlchemyRepository(AbstractProductRepository):
-    def __init__(self, session: Session):
+    def __init__(
+        self,
+        session: Session,
+        load_strategy: str = "selectin",
+        cache: Optional[ProductCache] = None,
+        allocation_cache: Optional[AllocationCache] = None,
+    ):
         self.session = session
+        self.loader_options = _aggregate_loader_options(load_strategy)
+        self.summary_loader_options = _aggregate_loader_options("summary")
+        self.cache = cache
+        self.allocation_cache = allocation_cache
+        self.seen: set[model.Product] = set()
 
     def add(self, product: model.Product):
+        self.seen.add(product)
         self.session.add(product)
 
     def delete(self, product: model.Product):
+        self.seen.add(product)
         self.session.delete(product)
 
     def get(self, sku: str) -> model.Product | None:
-        return self.session.query(model.Product).filter_by(sku=sku).first()
+        if self.cache is None:
+            return self._track(self._load(sku))
+
+        version_number = self.session.execute(
+            select(orm.products_table.c.version_number).where(orm.products_table.c.sku == sku)
+        ).scalar()
+        if version_number is None:
+            return None
+
+        cached = self.cache.get(sku, version_number)
+        if cached is not None:
+            return self._track(self.session.merge(cached, load=False))
+
+        product = self._load(sku)
+        if product is not None:
+            self.cache.put(detached_copy(product))
+        return self._track(product)
+
+    def get_summary(self, sku: str) -> model.Product | None:
+        # Batches come with their allocated quantities, and only the lines that get
+        # read are loaded. Those loads would otherwise each flush the changes made
+        # so far, so the session stops autoflushing; the commit flushes them all at
+        # once. Not cached: the cache holds whole aggregates.
+        self.session.autoflush = False
+        return self._track(
+            self.session.query(model.Product)
+            .options(*self.summary_loader_options)
+            .filter_by(sku=sku)
+            .first()
+        )
+
+    def _track(self, product: model.Product | None) -> model.Product | None:
+        if product is not None:
+            self.seen.add(product)
+        return product
+
+    def _load(self, sku: str) -> model.Product | None:
+        return (
+            self.session.query(model.Product)
+            .options(*self.loader_options)
+            .filter_by(sku=sku)
+            .first()
+        )
+
+    def get_many(self, skus: list[str]) -> list[model.Product]:
+        # One query for the products (plus the loader options' one or two for their
+        # batches and lines), bypassing the cache: the rows are locked FOR UPDATE
+        # (on backends that support it) until commit, in SKU order
+        products = (
+            self.session.query(model.Product)
+            .options(*self.loader_options)
+            .filter(orm.products_table.c.sku.in_(skus))
+            .order_by(model.Product.sku)
+            .with_for_update(of=model.Product)
+            .all()
+        )
+        self.seen.update(products)
+        return products
 
     def list(self) -> list[model.Product]:
-        return self.session.query(model.Product).all()
+        return self.session.query(model.Product).options(*self.loader_options).all()
+
+    def allocate_line(self, line: model.OrderLine) -> Optional[str]:
+        """
+        Chooses and fills the batch in the database, without loading the product.
+
+        The product's version is bumped first. That serialises this with every
+        other change to the product, including the optimistic commits of units of
+        work that loaded it, which then fail their version check and retry. It
+        also means that what is read next already includes their allocations.
+        """
+
+        products = orm.products_table
+        bumped = self.session.execute(
+            update(products)
+            .where(products.c.sku == line.sku)
+            .values(version_number=products.c.version_number + 1)
+        )
+        if bumped.rowcount == 0:
+            return None
+
+        # Checked again under the lock, for a repeat of this request racing it
+        batchref = _matching_batchrefs(self.session.execute(_batchrefs_query([line])), [line]).get(line)
+        if batchref is not None:
+            return batchref
+
+        if self.session.bind.dialect.name == "postgresql":
+            batchref = self.session.execute(_allocate_in_one_statement(line)).scalar()
+        else:
+            batchref = self._allocate_statement_by_statement(line)
+        if batchref is None:
+            raise model.OutOfStock(f"Out of stock for sku {line.sku}")
+
+        # For the unit of work to pass on to the AllocationCache, as flushes do
+        changes = self.session.info.setdefault(orm.VIEW_CHANGES, orm.ViewChanges())
+        changes.added.append(dict(orderid=line.orderid, sku=line.sku, qty=line.qty, batchref=batchref))
+        return batchref
+
+    def _allocate_statement_by_statement(self, line: model.OrderLine) -> Optional[str]:
+        """
+        allocate_line for databases without locking reads or data-modifying CTEs.
+        SQLite takes its one write lock at the version bump, so nothing can change
+        underneath.
+        """
+
+        candidate = self.session.execute(_candidate_batch_query(line)).first()
+        if candidate is None:
+            return None
+        orderline_id = self.session.execute(
+            insert(orm.orderline_table).values(orderid=line.orderid, sku=line.sku, qty=line.qty)
+        ).inserted_primary_key[0]
+        self.session.execute(
+            insert(orm.allocations_table).values(orderline_id=orderline_id, batch_id=candidate.id)
+        )
+        self.session.execute(
+            insert(orm.allocations_view).values(
+                orderid=line.orderid, sku=line.sku, qty=line.qty, batchref=candidate.reference
+            )
+        )
+        return candidate.reference
+
+    def get_allocation(self, orderid: str, sku: str) -> Optional[tuple[model.OrderLine, str]]:
+        row = self.session.execute(_allocation_query(orderid, sku)).first()
+        return None if row is None else (model.OrderLine(orderid, sku, row.qty), row.reference)
+
+    def get_batchrefs(self, lines: Sequence[model.OrderLine]) -> dict[model.OrderLine, str]:
+        batchrefs: dict[model.OrderLine, str] = {}
+        if self.allocation_cache is not None:
+            for line in lines:
+                if (batchref := self.allocation_cache.get(line)) is not None:
+                    batchrefs[line] = batchref
+        missing = [line for line in lines if line not in batchrefs]
+        if not missing:
+            return batchrefs
+
+        found = _matching_batchrefs(self.session.execute(_batchrefs_query(missing)), missing)
+        if self.allocation_cache is not None:
+            for line, batchref in found.items():
+                self.allocation_cache.put(line, batchref)
+        return {**batchrefs, **found}
+
+
+class AbstractAsyncProductRepository(abc.ABC):
+    @abc.abstractmethod
+    def add(self, product: model.Product) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def delete(self, product: model.Product) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def get(self, sku: str) -> model.Product | None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def get_many(self, skus: list[str]) -> list[model.Product]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def list(self) -> list[model.Product]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def get_allocation(self, orderid: str, sku: str) -> Optional[tuple[model.OrderLine, str]]:
+        raise NotImplementedError
+
+    async def get_batchref(self, line: model.OrderLine) -> Optional[str]:
+        return (await self.get_batchrefs([line])).get(line)
+
+    @abc.abstractmethod
+    async def get_batchrefs(self, lines: Sequence[model.OrderLine]) -> dict[model.OrderLine, str]:
+        raise NotImplementedError
+
+
+class AsyncSqlAlchemyRepository(AbstractAsyncProductRepository):
+    """
+    asyncio counterpart of SqlAlchemyRepository. Aggregates are always loaded whole,
+    as lazy loads can't happen under asyncio.
+    """
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.loader_options = _aggregate_loader_options("selectin")
+
+    def add(self, product: model.Product):
+        self.session.add(product)
+
+    async def delete(self, product: model.Product):
+        await self.session.delete(product)
+
+    async def get(self, sku: str) -> model.Product | None:
+        result = await self.session.execute(
+            select(model.Product).options(*self.loader_options).filter_by(sku=sku)
+        )
+        return result.scalars().first()
+
+    async def get_many(self, skus: list[str]) -> list[model.Product]:
+        result = await self.session.execute(
+            select(model.Product)
+            .options(*self.loader_options)
+            .where(orm.products_table.c.sku.in_(skus))
+            .order_by(model.Product.sku)
+            .with_for_update(of=model.Product)
+        )
+        return list(result.scalars().all())
+
+    async def list(self) -> list[model.Product]:
+        result = await self.session.execute(select(model.Product).options(*self.loader_options))
+        return list(result.scalars().all())
+
+    async def get_allocation(self, orderid: str, sku: str) -> Optional[tuple[model.OrderLine, str]]:
+        row = (await self.session.execute(_allocation_query(orderid, sku))).first()
+        return None if row is None else (model.OrderLine(orderid, sku, row.qty), row.reference)
+
+    async def get_batchrefs(self, lines: Sequence[model.OrderLine]) -> dict[model.OrderLine, str]:
+        if not lines:
+            return {}
+        return _matching_batchrefs(await self.session.execute(_batchrefs_query(lines)), lines)
@@ -0,0 +1,26 @@
+from sqlalchemy.orm import sessionmaker
+
+from src.allocation import metrics
+from src.allocation.adapters import database, orm
+
+
+def bootstrap() -> sessionmaker:
+    """
+    Maps the domain model and returns the default session factory, creating its
+    engine if need be. Idempotent, so it can be called eagerly at process start or
+    left to the first unit of work.
+    """
+
+    orm.start_mappers()
+    metrics.instrument_sqlalchemy()
+    return database.get_session_factory()
+
+
+def bootstrap_async() -> sessionmaker:
+    """
+    bootstrap() for the asyncio stack: returns the default AsyncSession factory
+    """
+
+    orm.start_mappers()
+    metrics.instrument_sqlalchemy()
+    return database.get_async_session_factory()
@@ -10,6 +10,98 @@ def get_postgres_uri():
     return f"postgresql://{user}:{password}@{host}:{port}/{db_name}"
 
 
+def get_database_uri():
+    return os.environ.get("DB_URI") or get_postgres_uri()
+
+
+def get_async_database_uri():
+    """
+    get_database_uri with an asyncio driver (asyncpg for Postgres, aiosqlite for SQLite)
+    """
+    uri = get_database_uri()
+    async_schemes = {"postgresql://": "postgresql+asyncpg://", "sqlite://": "sqlite+aiosqlite://"}
+    for sync_scheme, async_scheme in async_schemes.items():
+        if uri.startswith(sync_scheme):
+            return async_scheme + uri[len(sync_scheme):]
+    return uri
+
+
+def get_engine_options():
+    return dict(
+        pool_size=int(os.environ.get("DB_POOL_SIZE", 5)),
+        max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+        pool_pre_ping=os.environ.get("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes"),
+        pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", -1)),
+    )
+
+
+def get_product_cache_size():
+    """
+    Number of Product aggregates to keep cached across requests; 0 disables the cache
+    """
+    return int(os.environ.get("PRODUCT_CACHE_SIZE", 0))
+
+
+def get_allocation_cache_size():
+    """
+    Number of recent allocations to remember in process, to answer repeated
+    allocate requests without a database read; 0 disables the cache
+    """
+    return int(os.environ.get("ALLOCATION_CACHE_SIZE", 0))
+
+
+def get_allocation_cache_ttl():
+    """
+    Seconds a remembered allocation is trusted for (other processes' deallocations
+    aren't seen until it expires)
+    """
+    return float(os.environ.get("ALLOCATION_CACHE_TTL", 30))
+
+
+def get_product_load_strategy():
+    """
+    How units of work load Product aggregates: "selectin" loads every batch's
+    allocated lines up front, "summary" only their SQL-summed allocated quantity
+    """
+    return os.environ.get("PRODUCT_LOAD_STRATEGY", "selectin")
+
+
+def get_allocation_path():
+    """
+    How POST /allocate allocates: "aggregate" loads the Product and runs
+    Product.allocate, "sql" has the database choose and fill the batch
+    """
+    return os.environ.get("ALLOCATION_PATH", "aggregate")
+
+
+def get_profile_dir():
+    """
+    Where profiles of sampled requests are written; the Flask app only profiles
+    requests when this is set
+    """
+    return os.environ.get("PROFILE_DIR")
+
+
+def get_profile_sample_rate():
+    """
+    Fraction of requests to profile at random, on top of those sent with the
+    profiling header
+    """
+    return float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+
+
+def get_profile_header():
+    return os.environ.get("PROFILE_HEADER", "X-Profile")
+
+
+def get_web_workers():
+    """
+    Worker processes for entrypoints/serve.py; one per CPU by default
+    """
+    return int(os.environ.get("WEB_WORKERS", os.cpu_count() or 1))
+
+
 def get_api_url():
     host = os.environ.get('API_HOST', '127.0.0.1')
     port = 5000
@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 from datetime import date
-from typing import Optional, Set, Self, Any
+from typing import Optional, Set, Self, Any, Tuple
 
 
 class OutOfStock(Exception):
@@ -15,12 +15,21 @@ class OrderLine:
 
 
 class Batch:
+    # Running total of allocated qty, so availability never needs the lines
+    # themselves. The ORM loads it summed in SQL; ``None`` means "not known yet",
+    # and the total is then rebuilt from the lines on first read.
+    _allocated_quantity: Optional[int] = None
+    # The product's availability index and this batch's position in it, kept up
+    # to date by every change to the allocations, however it is made
+    _indexed_at: Optional[tuple["AvailabilityIndex", int]] = None
+
     def __init__(self, ref: str, sku: str, qty: int, eta: Optional[date]):
         self.reference = ref
         self.sku = sku
         self.eta = eta
         self._purchased_quantity = qty
         self._allocations: Set[OrderLine] = set()
+        self._allocated_quantity = 0
 
     def __eq__(self, other: Any):
         if not isinstance(other, Batch):
@@ -28,19 +37,23 @@ class Batch:
         return other.reference == self.reference
 
     def __lt__(self, other: Self) -> bool:
-        if self.eta is None:
-            return True
-        if other.eta is None:
-            return False
-
-        return self.eta < other.eta
+        return self.allocation_order < other.allocation_order
 
     def __hash__(self):
         return hash(self.reference)
 
+    @property
+    def allocation_order(self) -> Tuple[bool, date]:
+        """
+        Sort key for allocation preference: warehouse stock (no ETA) first, then by ETA
+        """
+        return self.eta is not None, self.eta or date.min
+
     @property
     def allocated_quantity(self) -> int:
-        return sum(line.qty for line in self._allocations)
+        if self._allocated_quantity is None:
+            self._allocated_quantity = sum(line.qty for line in self._allocations)
+        return self._allocated_quantity
 
     @property
     def available_quantity(self) -> int:
@@ -52,12 +65,72 @@ class Batch:
         return is_same_sku and has_enough_quantity
 
     def allocate(self, line: OrderLine):
-        if self.can_allocate(line):
+        if self.can_allocate(line) and line not in self._allocations:
+            self._allocated_quantity = self.allocated_quantity + line.qty
             self._allocations.add(line)
+            self._update_index()
+
+    def is_allocated(self, line: OrderLine) -> bool:
+        return line in self._allocations
 
     def deallocate(self, line: OrderLine):
         if line in self._allocations:
+            self._allocated_quantity = self.allocated_quantity - line.qty
             self._allocations.remove(line)
+            self._update_index()
+
+    def deallocate_all(self) -> list[OrderLine]:
+        """
+        Empties the batch, returning the lines it held in order id order
+        """
+        lines = sorted(self._allocations, key=lambda line: line.orderid)
+        self._allocations.clear()
+        self._allocated_quantity = 0
+        self._update_index()
+        return lines
+
+    def _update_index(self) -> None:
+        if self._indexed_at is not None:
+            index, position = self._indexed_at
+            index.update(position, self.available_quantity)
+
+
+class AvailabilityIndex:
+    """
+    Max segment tree over available quantities, in allocation preference order.
+
+    Finds the first position that can take a given quantity, and updates a
+    position's quantity, in O(log n)
+    """
+
+    _EMPTY = -(2 ** 63)
+
+    def __init__(self, quantities: list[int]):
+        self._size = 1
+        while self._size < len(quantities):
+            self._size *= 2
+        self._tree = [self._EMPTY] * (2 * self._size)
+        self._tree[self._size:self._size + len(quantities)] = quantities
+        for i in range(self._size - 1, 0, -1):
+            self._tree[i] = max(self._tree[2 * i], self._tree[2 * i + 1])
+
+    def update(self, position: int, quantity: int) -> None:
+        i = position + self._size
+        self._tree[i] = quantity
+        i //= 2
+        while i:
+            self._tree[i] = max(self._tree[2 * i], self._tree[2 * i + 1])
+            i //= 2
+
+    def find_first(self, quantity: int) -> Optional[int]:
+        if self._tree[1] < quantity:
+            return None
+        i = 1
+        while i < self._size:
+            i *= 2
+            if self._tree[i] < quantity:
+                i += 1
+        return i - self._size
 
 
 class Product:
@@ -65,9 +138,20 @@ class Product:
     Aggregate root
     """
 
-    def __init__(self, sku: str, batches: list[Batch]):
+    # Allocation index over ``batches``, built lazily and rebuilt whenever the
+    # batch list is replaced or changes size. The batches keep it up to date as
+    # lines are allocated and deallocated, including directly rather than through
+    # the product. Class-level defaults cover instances hydrated by the ORM, which
+    # skip ``__init__``.
+    _index: Optional[AvailabilityIndex] = None
+    _indexed_batches: Optional[list[Batch]] = None
+    _indexed_count = 0
+    _ordered_batches: list[Batch] = []
+
+    def __init__(self, sku: str, batches: list[Batch], version_number: int = 0):
         self.sku = sku
         self.batches = batches
+        self.version_number = version_number
 
     def __eq__(self, other: Any):
         if not isinstance(other, Product):
@@ -77,12 +161,117 @@ class Product:
     def __hash__(self):
         return hash(self.sku)
 
+    def add_batch(self, batch: Batch) -> None:
+        self.batches.append(batch)
+        self._index = None
+        self.version_number += 1
+
+    def remove_batch(self, ref: str) -> Optional[Batch]:
+        batch = next((b for b in self.batches if b.reference == ref), None)
+        if batch is not None:
+            self.batches.remove(batch)
+            self._index = None
+            self.version_number += 1
+        return batch
+
+    def retire_batch(self, ref: str) -> Optional[list[OrderLine]]:
+        """
+        Removes the batch, returning the lines it held so they can be allocated
+        elsewhere, or None if there is no such batch
+        """
+        batch = next((b for b in self.batches if b.reference == ref), None)
+        if batch is None:
+            return None
+        # Emptied while still part of the product, so the removal can't be flushed
+        # before the lines are read
+        lines = batch.deallocate_all()
+        self.remove_batch(ref)
+        return lines
+
     def allocate(self, line: OrderLine) -> str:
-        try:
-            batch = next(
-                b for b in sorted(self.batches) if b.can_allocate(line)
-            )
-            batch.allocate(line)
-            return batch.reference
-        except StopIteration:
+        index = self._availability_index()
+        position = index.find_first(line.qty)
+        if position is None:
             raise OutOfStock(f"Out of stock for sku {line.sku}")
+
+        batch = self._ordered_batches[position]
+        if batch.available_quantity < line.qty:
+            # Its quantities were reloaded by the ORM, which the index doesn't see -
+            # rebuild and retry
+            self._index = None
+            return self.allocate(line)
+        if not batch.can_allocate(line):
+            raise OutOfStock(f"Out of stock for sku {line.sku}")
+
+        batch.allocate(line)
+        self.version_number += 1
+        return batch.reference
+
+    def deallocate(self, line: OrderLine, batchref: Optional[str] = None) -> Optional[str]:
+        """
+        Returns the reference of the batch ``line`` was allocated to, or None if it
+        wasn't allocated. Given the batch it is allocated to, only that one's lines
+        are looked at.
+        """
+        for batch in self.batches:
+            if batchref is not None and batch.reference != batchref:
+                continue
+            if batch.is_allocated(line):
+                batch.deallocate(line)
+                self.version_number += 1
+                return batch.reference
+        return None
+
+    def rebalance(self) -> list[tuple[OrderLine, str]]:
+        """
+        Moves allocated lines to batches that are now preferable - ones with an
+        earlier ETA, or warehouse stock - and have room for them, returning each
+        moved line with the reference of the batch it went to.
+
+        Lines in the latest batches are moved first, each to the most preferable
+        batch with room, as allocate would pick it. Lines that can't be improved on
+        stay put, and batches with nothing preferable that has room are skipped
+        without looking at their lines.
+        """
+        self._index = None
+        index = self._availability_index()
+        ordered = self._ordered_batches
+        moved: dict[OrderLine, str] = {}
+        # Lines leaving a batch make room there for the lines of later batches, so
+        # those are swept again; every move is to an earlier batch, so this ends
+        lowest = 0
+        while True:
+            freed = None
+            for position in reversed(range(lowest, len(ordered))):
+                batch = ordered[position]
+                with_room = index.find_first(1)
+                if with_room is None or ordered[with_room].allocation_order >= batch.allocation_order:
+                    break
+                for line in sorted(batch._allocations, key=lambda line: line.orderid):
+                    target = index.find_first(line.qty)
+                    if target is None or ordered[target].allocation_order >= batch.allocation_order:
+                        continue
+                    batch.deallocate(line)
+                    ordered[target].allocate(line)
+                    moved[line] = ordered[target].reference
+                    freed = position
+            if freed is None:
+                break
+            lowest = freed + 1
+        if moved:
+            self.version_number += 1
+        return list(moved.items())
+
+    def _availability_index(self) -> AvailabilityIndex:
+        if (
+            self._index is None
+            or self._indexed_batches is not self.batches
+            or self._indexed_count != len(self.batches)
+        ):
+            self._ordered_batches = sorted(self.batches, key=lambda b: b.allocation_order)
+            self._index = AvailabilityIndex([b.available_quantity for b in self._ordered_batches])
+            for position, batch in enumerate(self._ordered_batches):
+                batch._indexed_at = self._index, position
+            self._indexed_batches = self.batches
+            self._indexed_count = len(self.batches)
+        return self._index
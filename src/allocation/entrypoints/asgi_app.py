@@ -0,0 +1,183 @@
+"""
+ASGI entrypoint serving the same routes as flask_app on the asyncio stack, so a
+request waiting on the database doesn't hold a worker thread. Run it with any
+ASGI server, e.g. ``uvicorn src.allocation.entrypoints.asgi_app:app``.
+"""
+import json
+import re
+from datetime import datetime
+from http import HTTPStatus
+from typing import Any, Awaitable, Callable
+
+from src.allocation import metrics
+from src.allocation.domain import model
+from src.allocation.entrypoints.flask_app import results_json
+from src.allocation.service_layer import async_services, unit_of_work, views
+
+Response = tuple[HTTPStatus, Any]
+Handler = Callable[[dict, Any], Awaitable[Response]]
+
+
+async def allocate_endpoint(params: dict, body: Any) -> Response:
+    try:
+        batchref = await async_services.allocate(
+            orderid=body["orderid"],
+            sku=body["sku"],
+            qty=body["qty"],
+            uow=unit_of_work.AsyncSqlAlchemyUnitOfWork(),
+        )
+    except (model.OutOfStock, async_services.InvalidSku) as e:
+        return HTTPStatus.BAD_REQUEST, {"message": str(e)}
+
+    return HTTPStatus.CREATED, {"batchref": batchref}
+
+
+async def deallocate_endpoint(params: dict, body: Any) -> Response:
+    try:
+        batchref = await async_services.deallocate(
+            orderid=params["orderid"],
+            sku=params["sku"],
+            uow=unit_of_work.AsyncSqlAlchemyUnitOfWork(),
+        )
+    except async_services.NotAllocated as e:
+        return HTTPStatus.NOT_FOUND, {"message": str(e)}
+
+    return HTTPStatus.OK, {"batchref": batchref}
+
+
+async def allocate_bulk_endpoint(params: dict, body: Any) -> Response:
+    lines = [(line["orderid"], line["sku"], line["qty"]) for line in body["lines"]]
+
+    results = await async_services.allocate_many(
+        lines=lines, uow=unit_of_work.AsyncSqlAlchemyUnitOfWork()
+    )
+
+    return HTTPStatus.OK, {"results": results_json(results)}
+
+
+async def allocate_order_endpoint(params: dict, body: Any) -> Response:
+    lines = [(line["sku"], line["qty"]) for line in body["lines"]]
+
+    results = await async_services.allocate_order(
+        orderid=body["orderid"], lines=lines, uow=unit_of_work.AsyncSqlAlchemyUnitOfWork()
+    )
+
+    return HTTPStatus.OK, {"results": results_json(results)}
+
+
+async def add_batch(params: dict, body: Any) -> Response:
+    eta = None
+    if body["eta"] is not None:
+        eta = datetime.fromisoformat(body["eta"]).date()
+
+    await async_services.add_batch(
+        ref=body["ref"],
+        sku=body["sku"],
+        qty=body["qty"],
+        eta=eta,
+        uow=unit_of_work.AsyncSqlAlchemyUnitOfWork(),
+        rebalance=body.get("rebalance", False),
+    )
+
+    return HTTPStatus.CREATED, "OK"
+
+
+async def delete_batch(params: dict, body: Any) -> Response:
+    try:
+        results = await async_services.delete_batch(
+            ref=params["ref"],
+            sku=params["sku"],
+            uow=unit_of_work.AsyncSqlAlchemyUnitOfWork(),
+        )
+    except async_services.BatchNotFound:
+        return HTTPStatus.BAD_REQUEST, {"message": f"Batch {params['ref']} not found"}
+
+    return HTTPStatus.OK, {"reallocated": results_json(results)}
+
+
+async def allocations_view_endpoint(params: dict, body: Any) -> Response:
+    result = await views.allocations_async(params["orderid"], unit_of_work.AsyncSqlAlchemyUnitOfWork())
+    if not result:
+        return HTTPStatus.NOT_FOUND, {"message": "not found"}
+
+    return HTTPStatus.OK, result
+
+
+async def metrics_endpoint(params: dict, body: Any) -> Response:
+    return HTTPStatus.OK, metrics.REGISTRY.render()
+
+
+ROUTES: list[tuple[str, re.Pattern, Handler, bool]] = [
+    ("POST", re.compile(r"/allocate"), allocate_endpoint, True),
+    ("POST", re.compile(r"/allocate/bulk"), allocate_bulk_endpoint, True),
+    ("POST", re.compile(r"/allocate/order"), allocate_order_endpoint, True),
+    ("POST", re.compile(r"/add_batch"), add_batch, True),
+    ("DELETE", re.compile(r"/products/(?P<sku>[^/]+)/batches/(?P<ref>[^/]+)"), delete_batch, False),
+    ("GET", re.compile(r"/allocations/(?P<orderid>[^/]+)"), allocations_view_endpoint, False),
+    ("DELETE", re.compile(r"/allocations/(?P<orderid>[^/]+)/(?P<sku>[^/]+)"), deallocate_endpoint, False),
+    ("GET", re.compile(r"/metrics"), metrics_endpoint, False),
+]
+
+
+async def read_body(receive) -> bytes:
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+async def send_response(send, status: HTTPStatus, payload: Any) -> None:
+    if isinstance(payload, str):
+        content_type, body = b"text/plain; charset=utf-8", payload.encode()
+    else:
+        content_type, body = b"application/json", json.dumps(payload).encode()
+
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type)],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    for method, pattern, handler, expects_json in ROUTES:
+        match = pattern.fullmatch(scope["path"])
+        if match is None or scope["method"] != method:
+            continue
+
+        body = None
+        if expects_json:
+            raw_body = await read_body(receive)
+            try:
+                body = json.loads(raw_body) if raw_body else None
+            except ValueError:
+                body = None
+            if not body:
+                await send_response(send, HTTPStatus.BAD_REQUEST, {"message": "Invalid format"})
+                return
+
+        token = metrics.start_request(handler.__name__)
+        try:
+            status, payload = await handler(match.groupdict(), body)
+        except unit_of_work.ConcurrentModification as e:
+            # Still losing the race once the services' retries have run out
+            status, payload = HTTPStatus.CONFLICT, {"message": str(e)}
+        finally:
+            metrics.finish_request(token)
+        await send_response(send, status, payload)
+        return
+
+    await send_response(send, HTTPStatus.NOT_FOUND, {"message": "not found"})
@@ -1,18 +1,71 @@
 from datetime import datetime
 from http import HTTPStatus
+from typing import Callable, Optional
 
-from flask import Flask, jsonify, request
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from flask import Flask, g, jsonify, request
 
-from src.allocation import config
-from src.allocation.adapters import orm
+from src.allocation import config, metrics
+from src.allocation.adapters.cache import AllocationCache, ProductCache
 from src.allocation.domain import model
-from src.allocation.service_layer import services, unit_of_work
+from src.allocation.entrypoints.profiling import ProfilingMiddleware
+from src.allocation.service_layer import services, unit_of_work, views
 
-orm.start_mappers()
-get_session = sessionmaker(bind=create_engine(config.get_postgres_uri()))
 app = Flask(__name__)
+if config.get_profile_dir():
+    app.wsgi_app = ProfilingMiddleware(  # type: ignore[method-assign]
+        app.wsgi_app,
+        config.get_profile_dir(),
+        sample_rate=config.get_profile_sample_rate(),
+        header=config.get_profile_header(),
+    )
+
+
+def cache_stats(stats: Callable[[], dict[str, int]]) -> Callable[[], metrics.LabelledValues]:
+    return lambda: (({"stat": stat}, value) for stat, value in stats().items())
+
+
+product_cache: Optional[ProductCache] = None
+if config.get_product_cache_size():
+    product_cache = ProductCache(config.get_product_cache_size())
+    metrics.REGISTRY.register(metrics.GaugeCallback(
+        "allocation_product_cache", "Product cache statistics", cache_stats(product_cache.stats)
+    ))
+allocation_cache: Optional[AllocationCache] = None
+if config.get_allocation_cache_size():
+    allocation_cache = AllocationCache(
+        config.get_allocation_cache_size(), config.get_allocation_cache_ttl()
+    )
+    metrics.REGISTRY.register(metrics.GaugeCallback(
+        "allocation_allocation_cache", "Allocation dedupe cache statistics", cache_stats(allocation_cache.stats)
+    ))
+
+# config.get_allocation_path() chooses how POST /allocate allocates
+allocate_line = services.allocate_direct if config.get_allocation_path() == "sql" else services.allocate
+
+
+def results_json(results: list[services.AllocationResult]) -> list[dict]:
+    return [
+        {"orderid": r.orderid, "sku": r.sku, "batchref": r.batchref}
+        if r.error is None
+        else {"orderid": r.orderid, "sku": r.sku, "message": r.error}
+        for r in results
+    ]
+
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_token = metrics.start_request(request.endpoint or "unmatched")
+
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if "metrics_token" in g:
+        metrics.finish_request(g.pop("metrics_token"))
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return metrics.REGISTRY.render(), HTTPStatus.OK, {"Content-Type": "text/plain; version=0.0.4"}
 
 
 @app.route("/allocate", methods=["POST"])
@@ -25,11 +78,13 @@ def allocate_endpoint():
     qty = request.json["qty"]
 
     try:
-        batchref = services.allocate(
+        batchref = allocate_line(
             orderid=orderid,
             sku=sku,
             qty=qty,
-            uow=unit_of_work.SqlAlchemyUnitOfWork()
+            uow=unit_of_work.SqlAlchemyUnitOfWork(
+                product_cache=product_cache, allocation_cache=allocation_cache
+            ),
         )
     except (model.OutOfStock, services.InvalidSku) as e:
         return jsonify({"message": str(e)}), HTTPStatus.BAD_REQUEST
@@ -37,6 +92,57 @@ def allocate_endpoint():
     return jsonify({"batchref": batchref}), HTTPStatus.CREATED
 
 
+@app.route("/allocations/<orderid>/<sku>", methods=["DELETE"])
+def deallocate_endpoint(orderid: str, sku: str):
+    try:
+        batchref = services.deallocate(
+            orderid=orderid,
+            sku=sku,
+            uow=unit_of_work.SqlAlchemyUnitOfWork(
+                product_cache=product_cache, allocation_cache=allocation_cache
+            ),
+        )
+    except services.NotAllocated as e:
+        return jsonify({"message": str(e)}), HTTPStatus.NOT_FOUND
+
+    return jsonify({"batchref": batchref}), HTTPStatus.OK
+
+
+@app.route("/allocate/bulk", methods=["POST"])
+def allocate_bulk_endpoint():
+    if not request.json:
+        return jsonify({"message": "Invalid format"}), HTTPStatus.BAD_REQUEST
+
+    lines = [(line["orderid"], line["sku"], line["qty"]) for line in request.json["lines"]]
+
+    results = services.allocate_many(
+        lines=lines,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(
+            product_cache=product_cache, allocation_cache=allocation_cache
+        ),
+    )
+
+    return jsonify({"results": results_json(results)}), HTTPStatus.OK
+
+
+@app.route("/allocate/order", methods=["POST"])
+def allocate_order_endpoint():
+    if not request.json:
+        return jsonify({"message": "Invalid format"}), HTTPStatus.BAD_REQUEST
+
+    lines = [(line["sku"], line["qty"]) for line in request.json["lines"]]
+
+    results = services.allocate_order(
+        orderid=request.json["orderid"],
+        lines=lines,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(
+            product_cache=product_cache, allocation_cache=allocation_cache
+        ),
+    )
+
+    return jsonify({"results": results_json(results)}), HTTPStatus.OK
+
+
 @app.route("/add_batch", methods=["POST"])
 def add_batch():
     if not request.json:
@@ -55,7 +161,10 @@ def add_batch():
         sku=sku,
         qty=qty,
         eta=eta,
-        uow=unit_of_work.SqlAlchemyUnitOfWork()
+        uow=unit_of_work.SqlAlchemyUnitOfWork(
+            product_cache=product_cache, allocation_cache=allocation_cache
+        ),
+        rebalance=request.json.get("rebalance", False),
     )
 
     return 'OK', HTTPStatus.CREATED
@@ -64,12 +173,23 @@ def add_batch():
 @app.route("/products/<sku>/batches/<ref>", methods=["DELETE"])
 def delete_batch(sku: str, ref: str):
     try:
-        services.delete_batch(
+        results = services.delete_batch(
             ref=ref,
             sku=sku,
-            uow=unit_of_work.SqlAlchemyUnitOfWork()
+            uow=unit_of_work.SqlAlchemyUnitOfWork(
+                product_cache=product_cache, allocation_cache=allocation_cache
+            ),
         )
     except services.BatchNotFound:
         return jsonify({"message": f"Batch {ref} not found"}), HTTPStatus.BAD_REQUEST
 
-    return 'OK', HTTPStatus.OK
+    return jsonify({"reallocated": results_json(results)}), HTTPStatus.OK
+
+
+@app.route("/allocations/<orderid>", methods=["GET"])
+def allocations_view_endpoint(orderid: str):
+    result = views.allocations(orderid, unit_of_work.SqlAlchemyUnitOfWork())
+    if not result:
+        return jsonify({"message": "not found"}), HTTPStatus.NOT_FOUND
+
+    return jsonify(result), HTTPStatus.OK
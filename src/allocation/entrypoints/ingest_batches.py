@@ -0,0 +1,161 @@
+"""
+Bulk batch ingestion from the purchasing system's daily files, bypassing the
+one-batch-per-request /add_batch endpoint:
+
+    python -m src.allocation.entrypoints.ingest_batches batches.csv [--chunk-size 10000]
+
+Records (ref, sku, qty, eta) are streamed from CSV or JSONL and written a chunk at
+a time, each chunk in its own transaction: missing products are created in one
+statement, the touched products' versions are bumped (so in-flight units of work
+and cached aggregates see the change), and the batches are inserted with
+executemany, or COPY on Postgres. Memory stays flat however big the file, and a
+failure only rolls back the chunk it happened in.
+"""
+import argparse
+import csv
+import io
+import itertools
+import json
+import sys
+import time
+from datetime import date
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+
+from src.allocation import config
+from src.allocation.adapters import database, orm
+
+DEFAULT_CHUNK_SIZE = 10_000
+
+Progress = Callable[[int, float], None]
+
+
+def read_records(path: str) -> Iterator[dict]:
+    """
+    Batch rows from a .csv (with a ref,sku,qty,eta header) or .jsonl file, one at a time
+    """
+
+    with open(path, newline="") as f:
+        if Path(path).suffix == ".csv":
+            rows: Iterable[dict] = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            yield dict(
+                reference=row["ref"],
+                sku=row["sku"],
+                _purchased_quantity=int(row["qty"]),
+                eta=date.fromisoformat(row["eta"]) if row.get("eta") else None,
+            )
+
+
+def _insert_missing_products(conn: Connection, skus: list[str]) -> None:
+    rows = [{"sku": sku} for sku in skus]
+    if conn.dialect.name == "postgresql":
+        conn.execute(postgresql.insert(orm.products_table).on_conflict_do_nothing(), rows)
+    elif conn.dialect.name == "sqlite":
+        conn.execute(sqlite.insert(orm.products_table).on_conflict_do_nothing(), rows)
+    else:
+        sku_column = orm.products_table.c.sku
+        existing = set(conn.execute(select(sku_column).where(sku_column.in_(skus))).scalars())
+        missing = [row for row in rows if row["sku"] not in existing]
+        if missing:
+            conn.execute(orm.products_table.insert(), missing)
+
+
+def _bump_versions(conn: Connection, skus: list[str]) -> None:
+    products = orm.products_table
+    conn.execute(
+        products.update()
+        .where(products.c.sku.in_(skus))
+        .values(version_number=products.c.version_number + 1)
+    )
+
+
+def _copy_batches(conn: Connection, rows: list[dict]) -> None:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row["reference"], row["sku"], row["_purchased_quantity"], row["eta"] or ""])
+    buffer.seek(0)
+    cursor = conn.connection.cursor()
+    cursor.copy_expert(
+        "COPY batches (reference, sku, _purchased_quantity, eta) FROM STDIN WITH (FORMAT csv)",
+        buffer,
+    )
+
+
+def _write_chunk(conn: Connection, rows: list[dict]) -> None:
+    # Grouped by SKU so each product's batches land next to each other
+    rows.sort(key=lambda row: row["sku"])
+    skus = [sku for sku, _ in itertools.groupby(row["sku"] for row in rows)]
+    _insert_missing_products(conn, skus)
+    _bump_versions(conn, skus)
+    if conn.dialect.name == "postgresql" and conn.dialect.driver == "psycopg2":
+        _copy_batches(conn, rows)
+    else:
+        conn.execute(orm.batch_table.insert(), rows)
+
+
+def ingest(
+    records: Iterable[dict],
+    engine: Engine,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    progress: Optional[Progress] = None,
+) -> int:
+    """
+    Writes ``records`` (as produced by read_records) in transactions of
+    ``chunk_size`` rows, calling ``progress(rows_so_far, seconds_so_far)`` after
+    each commit. Returns the number of rows written.
+
+    If a chunk fails, the chunks before it stay committed.
+    """
+
+    started = time.perf_counter()
+    written = 0
+    records = iter(records)
+    while chunk := list(itertools.islice(records, chunk_size)):
+        with engine.begin() as conn:
+            _write_chunk(conn, chunk)
+        written += len(chunk)
+        if progress is not None:
+            progress(written, time.perf_counter() - started)
+    return written
+
+
+def report_progress(rows: int, seconds: float) -> None:
+    print(f"{rows:,} batches in {seconds:.1f}s ({rows / seconds:,.0f} rows/s)", file=sys.stderr)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load batches from CSV or JSONL files")
+    parser.add_argument("paths", nargs="+", help=".csv (ref,sku,qty,eta header) or .jsonl files")
+    parser.add_argument(
+        "--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows per transaction"
+    )
+    parser.add_argument("--db-uri", default=None, help="defaults to the app's database")
+    args = parser.parse_args(argv)
+
+    engine = database.get_engine(args.db_uri or config.get_database_uri())
+    records = itertools.chain.from_iterable(read_records(path) for path in args.paths)
+    committed = 0
+
+    def progress(rows: int, seconds: float) -> None:
+        nonlocal committed
+        committed = rows
+        report_progress(rows, seconds)
+
+    try:
+        ingest(records, engine, args.chunk_size, progress)
+    except Exception as e:
+        print(f"Stopped after {committed:,} committed batches: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
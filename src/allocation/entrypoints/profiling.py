@@ -0,0 +1,100 @@
+"""
+Opt-in, sampled profiling of Flask requests.
+
+flask_app wraps itself in ProfilingMiddleware when PROFILE_DIR is set. A request
+is profiled if it carries the PROFILE_HEADER header (any value), or at random with
+probability PROFILE_SAMPLE_RATE. It then runs under cProfile, which sees everything
+the request does on its thread - services, the ORM and the database driver - and
+leaves two files in PROFILE_DIR:
+
+    <id>.pstats  the raw profile, for ``python -m pstats`` or snakeviz
+    <id>.txt     the time spent in SQLAlchemy and the driver, and the slowest
+                 functions by cumulative and by own time
+
+The response carries the id in an X-Profile-Id header. A request that isn't
+profiled costs an environ lookup and, if sampling is on, a random number.
+"""
+import cProfile
+import itertools
+import logging
+import os
+import pstats
+import random
+import time
+from pathlib import Path
+from typing import Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+TOP_FUNCTIONS = 30
+# Profile entries from these (module paths, or C functions' descriptions) count as SQL time
+SQL_MARKERS = ("sqlalchemy", "sqlite3", "psycopg2")
+
+
+def sql_seconds(stats: pstats.Stats) -> float:
+    return sum(
+        own_time
+        for (filename, _, name), (_, _, own_time, _, _) in stats.stats.items()  # type: ignore[attr-defined]
+        if any(marker in filename or marker in name for marker in SQL_MARKERS)
+    )
+
+
+class ProfilingMiddleware:
+    def __init__(
+        self,
+        app: Callable,
+        output_dir,
+        sample_rate: float = 0.0,
+        header: str = "X-Profile",
+        sample: Callable[[], float] = random.random,
+    ):
+        self.app = app
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.sample_rate = sample_rate
+        self.environ_key = "HTTP_" + header.upper().replace("-", "_")
+        self.sample = sample
+        self._ids = itertools.count()
+
+    def __call__(self, environ: dict, start_response: Callable) -> Iterable[bytes]:
+        if self.environ_key in environ or (self.sample_rate and self.sample() < self.sample_rate):
+            return self._profile(environ, start_response)
+        return self.app(environ, start_response)
+
+    def _profile(self, environ: dict, start_response: Callable) -> list[bytes]:
+        profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{next(self._ids)}"
+
+        def start_response_with_id(status, headers, exc_info=None):
+            return start_response(status, headers + [("X-Profile-Id", profile_id)], exc_info)
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            # The body is drained and closed inside the profile too, as that is
+            # where lazily generated responses and request teardown do their work
+            response = self.app(environ, start_response_with_id)
+            try:
+                body = list(response)
+            finally:
+                if hasattr(response, "close"):
+                    response.close()
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - started
+            self._write(profile_id, profiler, environ, elapsed)
+        return body
+
+    def _write(self, profile_id: str, profiler: cProfile.Profile, environ: dict, elapsed: float) -> None:
+        request = f"{environ.get('REQUEST_METHOD')} {environ.get('PATH_INFO')}"
+        try:
+            profiler.dump_stats(self.output_dir / f"{profile_id}.pstats")
+            with open(self.output_dir / f"{profile_id}.txt", "w") as f:
+                stats = pstats.Stats(profiler, stream=f)
+                f.write(f"{request}: {elapsed * 1e3:.1f}ms\n")
+                f.write(f"SQLAlchemy and database driver: {sql_seconds(stats) * 1e3:.1f}ms\n")
+                stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+                stats.sort_stats(pstats.SortKey.TIME).print_stats(TOP_FUNCTIONS)
+        except OSError:
+            # Losing a profile mustn't fail the request it was taken of
+            logger.exception("Couldn't write profile %s of %s", profile_id, request)
@@ -0,0 +1,49 @@
+"""
+Background rebalancing, for batches added without /add_batch's "rebalance" option:
+
+    python -m src.allocation.entrypoints.rebalance [SKU ...] [--db-uri URI]
+
+Moves each product's allocated lines to preferable batches with room for them (see
+Product.rebalance), one product per transaction, so it can run alongside the API:
+a product allocated to meanwhile is retried. Without SKUs, every product is
+rebalanced.
+"""
+import argparse
+import sys
+from typing import Optional
+
+from sqlalchemy import select
+
+from src.allocation import bootstrap, config
+from src.allocation.adapters import database, orm
+from src.allocation.service_layer import services, unit_of_work
+
+
+def all_skus(db_uri: str) -> list[str]:
+    with database.get_engine(db_uri).connect() as conn:
+        return list(conn.execute(select(orm.products_table.c.sku).order_by(orm.products_table.c.sku)).scalars())
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Move allocated lines to preferable batches")
+    parser.add_argument("skus", nargs="*", help="defaults to every product")
+    parser.add_argument("--db-uri", default=None, help="defaults to the app's database")
+    args = parser.parse_args(argv)
+
+    db_uri = args.db_uri or config.get_database_uri()
+    bootstrap.bootstrap()
+    uow = unit_of_work.SqlAlchemyUnitOfWork(database.get_session_factory(db_uri))
+    failed = 0
+    for sku in args.skus or all_skus(db_uri):
+        try:
+            moved = services.rebalance(sku, uow)
+        except (services.InvalidSku, unit_of_work.ConcurrentModification) as e:
+            print(f"{sku}: {e}", file=sys.stderr)
+            failed += 1
+            continue
+        print(f"{sku}: moved {len(moved)} lines", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
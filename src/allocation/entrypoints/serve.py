@@ -0,0 +1,169 @@
+"""
+Pre-forking HTTP server for the Flask app:
+
+    python -m src.allocation.entrypoints.serve [--host 0.0.0.0] [--port 5000] [--workers 4]
+
+The parent imports and bootstraps the app, binds the listening socket, then forks
+the workers, which accept from that one socket, each serving requests on threads
+with werkzeug's WSGI server. Workers that die are replaced after a delay, unless
+they keep dying, in which case the server stops and exits non-zero. SIGTERM or
+SIGINT stop the workers and then the parent.
+
+Workers are forked after the app has been imported, so anything it set up is
+shared copy-on-write; database connections aren't, as database.py gives each
+forked process its own pools.
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+from collections import deque
+from typing import Callable, Iterable, Optional
+
+from werkzeug.serving import make_server
+
+from src.allocation import bootstrap, config
+
+BACKLOG = 1024
+RESTART_DELAY = 1.0  # seconds before a dead worker is replaced
+MAX_RESTARTS = 5  # replacements allowed within RESTART_WINDOW before giving up
+RESTART_WINDOW = 60.0  # seconds
+
+
+class WorkersKeepDying(Exception):
+    pass
+
+
+def _serve_worker(app: Callable, listener: socket.socket, threaded: bool) -> None:
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    host, port = listener.getsockname()[:2]
+    server = make_server(host, port, app, threaded=threaded, fd=listener.fileno())
+    server.serve_forever()
+
+
+def _fork_worker(app: Callable, listener: socket.socket, threaded: bool) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            _serve_worker(app, listener, threaded)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            # Never return into the parent's code
+            os._exit(1)
+    return pid
+
+
+def _terminate(pids: Iterable[int]) -> None:
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+def serve(
+    app: Callable,
+    host: str,
+    port: int,
+    workers: int,
+    threaded: bool = True,
+    ready: Optional[Callable[[int], None]] = None,
+    restart_delay: float = RESTART_DELAY,
+    max_restarts: int = MAX_RESTARTS,
+) -> None:
+    """
+    Serves ``app`` from ``workers`` forked processes until SIGTERM or SIGINT. ``ready``
+    is called with the bound port (useful when ``port`` is 0) once workers are started.
+
+    :raises WorkersKeepDying: once more than ``max_restarts`` workers have died within
+        RESTART_WINDOW, after stopping the rest
+    """
+
+    listener = socket.create_server((host, port), backlog=BACKLOG)
+    pids: set[int] = set()
+    restarts: deque[float] = deque()
+    stopping = False
+    gave_up = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        _terminate(list(pids))
+
+    previous_handlers = signal.signal(signal.SIGTERM, stop), signal.signal(signal.SIGINT, stop)
+    try:
+        for _ in range(workers):
+            pids.add(_fork_worker(app, listener, threaded))
+        if ready is not None:
+            ready(listener.getsockname()[1])
+
+        while pids:
+            try:
+                pid, _ = os.wait()
+            except ChildProcessError:
+                break
+            pids.discard(pid)
+            if stopping:
+                continue
+
+            now = time.monotonic()
+            restarts.append(now)
+            while restarts[0] < now - RESTART_WINDOW:
+                restarts.popleft()
+            if len(restarts) > max_restarts:
+                # Replacing them would only crash-loop; wait for the rest to stop
+                stopping = gave_up = True
+                _terminate(pids)
+                continue
+
+            time.sleep(restart_delay)
+            if not stopping:
+                pids.add(_fork_worker(app, listener, threaded))
+                if stopping:
+                    # stop() ran between the fork and the add
+                    _terminate(pids)
+    finally:
+        listener.close()
+        signal.signal(signal.SIGTERM, previous_handlers[0])
+        signal.signal(signal.SIGINT, previous_handlers[1])
+
+    if gave_up:
+        raise WorkersKeepDying(f"{len(restarts)} workers died within {RESTART_WINDOW:.0f}s")
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve the allocation API from pre-forked workers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000, help="0 picks a free port")
+    parser.add_argument("--workers", type=int, default=config.get_web_workers())
+    parser.add_argument(
+        "--no-threads", dest="threaded", action="store_false", help="one request at a time per worker"
+    )
+    args = parser.parse_args(argv)
+
+    # Imported here, so that importing this module doesn't build the app
+    from src.allocation.entrypoints.flask_app import app
+
+    bootstrap.bootstrap()
+    try:
+        serve(
+            app,
+            args.host,
+            args.port,
+            args.workers,
+            threaded=args.threaded,
+            ready=lambda port: print(f"Serving on http://{args.host}:{port} with {args.workers} workers", flush=True),
+        )
+    except WorkersKeepDying as e:
+        print(f"Stopping: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
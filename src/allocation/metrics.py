@@ -0,0 +1,295 @@
+"""
+In-process metrics, rendered in the Prometheus text exposition format.
+
+Recording is a dict update under a lock, so it is cheap enough to leave on and safe
+to call from any thread. Per-request SQL statement and loaded-row counts are kept in
+a context variable, so concurrent requests (threads or asyncio tasks) don't mix.
+"""
+import bisect
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from typing import Callable, Iterable, Optional, TypeVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+Labels = tuple[str, ...]
+Samples = Iterable[tuple[str, dict[str, str], float]]
+# What a GaugeCallback's ``collect`` yields: (labels, value), the name being the gauge's
+LabelledValues = Iterable[tuple[dict[str, str], float]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_sample(name: str, labels: dict[str, str], value: float) -> str:
+    if labels:
+        label_text = ",".join(f'{key}="{_escape(str(v))}"' for key, v in labels.items())
+        name = f"{name}{{{label_text}}}"
+    return f"{name} {value}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Labels = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> Labels:
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self) -> Samples:
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(_format_sample(*sample) for sample in self.samples())
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Labels = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Samples:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Labels = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        # Per label set: [count per bucket (the last is +Inf), sum]
+        self._values: dict[Labels, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            counts, total = self._values[key]
+            counts[position] += 1
+            total[0] += value
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], [0.0]))
+            return sum(counts)
+
+    def samples(self) -> Samples:
+        with self._lock:
+            values = sorted(
+                (key, (list(counts), total[0])) for key, (counts, total) in self._values.items()
+            )
+        for key, (counts, total) in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                yield f"{self.name}_bucket", dict(labels, le=le), cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class GaugeCallback(Metric):
+    """
+    A gauge read from ``collect`` at scrape time, for state kept elsewhere
+    (pool and cache statistics)
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, collect: Callable[[], LabelledValues]):
+        super().__init__(name, help)
+        self.collect = collect
+
+    def samples(self) -> Samples:
+        for labels, value in self.collect():
+            yield self.name, labels, value
+
+
+M = TypeVar("M", bound=Metric)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: M) -> M:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+SERVICE_LATENCY = REGISTRY.register(Histogram(
+    "allocation_service_seconds", "Service layer call latency", labelnames=("service",)
+))
+SERVICE_ERRORS = REGISTRY.register(Counter(
+    "allocation_service_errors_total",
+    "Service layer failures (per line for bulk calls)",
+    labelnames=("service", "error"),
+))
+ALLOCATIONS_DEDUPLICATED = REGISTRY.register(Counter(
+    "allocation_deduplicated_total",
+    "allocate calls answered with an earlier allocation of the same line",
+))
+LINES_REBALANCED = REGISTRY.register(Counter(
+    "allocation_lines_rebalanced_total", "Allocated lines moved to a preferable batch"
+))
+UOW_COMMITS = REGISTRY.register(Counter(
+    "allocation_uow_commits_total", "Unit of work commits"
+))
+UOW_ROLLBACKS = REGISTRY.register(Counter(
+    "allocation_uow_rollbacks_total", "Unit of work rollbacks discarding changes"
+))
+UOW_CONFLICTS = REGISTRY.register(Counter(
+    "allocation_uow_conflicts_total", "Commits that lost an optimistic concurrency race"
+))
+SQL_STATEMENTS = REGISTRY.register(Counter(
+    "allocation_sql_statements_total", "SQL statements executed"
+))
+ROWS_LOADED = REGISTRY.register(Counter(
+    "allocation_rows_loaded_total", "Domain objects loaded from the database"
+))
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    "allocation_request_seconds", "HTTP request latency", labelnames=("endpoint",)
+))
+REQUEST_STATEMENTS = REGISTRY.register(Histogram(
+    "allocation_request_sql_statements",
+    "SQL statements executed per HTTP request",
+    labelnames=("endpoint",),
+    buckets=COUNT_BUCKETS,
+))
+REQUEST_ROWS_LOADED = REGISTRY.register(Histogram(
+    "allocation_request_rows_loaded",
+    "Domain objects loaded from the database per HTTP request",
+    labelnames=("endpoint",),
+    buckets=COUNT_BUCKETS,
+))
+
+
+class RequestStats:
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.rows_loaded = 0
+
+
+_current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "current_request", default=None
+)
+
+
+def start_request(endpoint: str) -> contextvars.Token:
+    return _current_request.set(RequestStats(endpoint))
+
+
+def finish_request(token: contextvars.Token) -> None:
+    stats = _current_request.get()
+    _current_request.reset(token)
+    if stats is None:
+        return
+    REQUEST_LATENCY.observe(time.perf_counter() - stats.started, endpoint=stats.endpoint)
+    REQUEST_STATEMENTS.observe(stats.statements, endpoint=stats.endpoint)
+    REQUEST_ROWS_LOADED.observe(stats.rows_loaded, endpoint=stats.endpoint)
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    SQL_STATEMENTS.inc()
+    stats = _current_request.get()
+    if stats is not None:
+        stats.statements += 1
+
+
+def _count_loaded_row(session, instance):
+    ROWS_LOADED.inc()
+    stats = _current_request.get()
+    if stats is not None:
+        stats.rows_loaded += 1
+
+
+def instrument_sqlalchemy() -> None:
+    """
+    Counts statements on every engine and objects loaded by every session.
+    Idempotent.
+    """
+
+    if not event.contains(Engine, "before_cursor_execute", _count_statement):
+        event.listen(Engine, "before_cursor_execute", _count_statement)
+    if not event.contains(Session, "loaded_as_persistent", _count_loaded_row):
+        event.listen(Session, "loaded_as_persistent", _count_loaded_row)
+
+
+def timed(fn):
+    """
+    Records each call of a service function (sync or async) in SERVICE_LATENCY, and
+    the type of any exception it raises in SERVICE_ERRORS
+    """
+
+    service = fn.__name__
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                SERVICE_ERRORS.inc(service=service, error=type(e).__name__)
+                raise
+            finally:
+                SERVICE_LATENCY.observe(time.perf_counter() - started, service=service)
+
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            SERVICE_ERRORS.inc(service=service, error=type(e).__name__)
+            raise
+        finally:
+            SERVICE_LATENCY.observe(time.perf_counter() - started, service=service)
+
+    return wrapper
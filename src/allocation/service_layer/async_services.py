@@ -0,0 +1,213 @@
+"""
+asyncio versions of the functions in services, for the ASGI entrypoint. They
+only load and commit, leaving the work on the loaded aggregates to services'
+helpers, and share services' exceptions, result types and retry settings.
+"""
+import asyncio
+import functools
+import random
+from collections import defaultdict
+from datetime import date
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from src.allocation import metrics
+from src.allocation.domain import model
+from src.allocation.service_layer import unit_of_work
+from src.allocation.service_layer.services import (
+    MAX_ATTEMPTS,
+    RETRY_BASE_DELAY,
+    AllocationResult,
+    BatchNotFound,
+    InvalidSku,
+    NotAllocated,
+    add_batch_to,
+    allocate_loaded,
+    count_outcomes,
+    deallocate_loaded,
+    rebalance_loaded,
+    retire_and_reallocate,
+)
+
+T = TypeVar("T")
+
+
+async def retry_on_conflict(operation: Callable[[], Awaitable[T]]) -> T:
+    """
+    :raises unit_of_work.ConcurrentModification: once MAX_ATTEMPTS have failed
+    """
+
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return await operation()
+        except unit_of_work.ConcurrentModification:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(random.uniform(0, RETRY_BASE_DELAY * 2 ** attempt))
+    raise AssertionError("unreachable")
+
+
+@metrics.timed
+async def add_batch(
+    ref: str,
+    sku: str,
+    qty: int,
+    eta: Optional[date],
+    uow: unit_of_work.AbstractAsyncUnitOfWork,
+    rebalance: bool = False,
+) -> None:
+    async def add_and_rebalance() -> int:
+        async with uow:
+            product = await uow.products.get(sku=sku)
+            if product is None:
+                product = model.Product(sku, batches=[])
+                uow.products.add(product)
+
+            moved = add_batch_to(product, model.Batch(ref=ref, sku=sku, qty=qty, eta=eta), rebalance)
+            await uow.commit()
+
+        return moved
+
+    metrics.LINES_REBALANCED.inc(await retry_on_conflict(add_and_rebalance))
+
+
+@metrics.timed
+async def rebalance(sku: str, uow: unit_of_work.AbstractAsyncUnitOfWork) -> list[AllocationResult]:
+    """
+    :raises InvalidSku
+    """
+
+    async def rebalance_product() -> list[AllocationResult]:
+        async with uow:
+            product = await uow.products.get(sku=sku)
+            if product is None:
+                raise InvalidSku(f"Invalid sku {sku}")
+
+            results = rebalance_loaded(product)
+            if results:
+                await uow.commit()
+
+        metrics.LINES_REBALANCED.inc(len(results))
+        return results
+
+    return await retry_on_conflict(rebalance_product)
+
+
+@metrics.timed
+async def delete_batch(ref: str, sku: str, uow: unit_of_work.AbstractAsyncUnitOfWork) -> list[AllocationResult]:
+    """
+    :raises InvalidSku
+    :raises BatchNotFound
+    """
+
+    async def delete_and_reallocate() -> tuple[list[AllocationResult], dict[str, int]]:
+        async with uow:
+            product = await uow.products.get(sku=sku)
+            if product is None:
+                raise InvalidSku(f"Invalid sku {sku}")
+
+            results, errors = retire_and_reallocate(product, ref)
+            await uow.commit()
+
+        return results, errors
+
+    results, errors = await retry_on_conflict(delete_and_reallocate)
+    count_outcomes("delete_batch", 0, errors)
+    return results
+
+
+@metrics.timed
+async def allocate(orderid: str, sku: str, qty: int, uow: unit_of_work.AbstractAsyncUnitOfWork) -> str:
+    """
+    Idempotent, like services.allocate
+
+    :raises InvalidSku
+    """
+
+    line = model.OrderLine(orderid, sku, qty)
+
+    async def allocate_line() -> str:
+        async with uow:
+            batchref = await uow.products.get_batchref(line)
+            if batchref is not None:
+                metrics.ALLOCATIONS_DEDUPLICATED.inc()
+                return batchref
+
+            product = await uow.products.get(sku=line.sku)
+
+            if product is None:
+                raise InvalidSku(f"Invalid sku {sku}")
+
+            batchref = product.allocate(line)
+            await uow.commit()
+
+        return batchref
+
+    return await retry_on_conflict(allocate_line)
+
+
+@metrics.timed
+async def deallocate(orderid: str, sku: str, uow: unit_of_work.AbstractAsyncUnitOfWork) -> str:
+    """
+    :raises NotAllocated
+    """
+
+    async def deallocate_line() -> str:
+        async with uow:
+            allocation = await uow.products.get_allocation(orderid, sku)
+            product = await uow.products.get(sku=sku) if allocation is not None else None
+            deallocated_from = deallocate_loaded(orderid, sku, allocation, product)
+            await uow.commit()
+
+        return deallocated_from
+
+    return await retry_on_conflict(deallocate_line)
+
+
+@metrics.timed
+async def allocate_many(
+    lines: list[tuple[str, str, int]], uow: unit_of_work.AbstractAsyncUnitOfWork
+) -> list[AllocationResult]:
+    results = [AllocationResult(orderid, sku, qty) for orderid, sku, qty in lines]
+    results_by_sku: dict[str, list[AllocationResult]] = defaultdict(list)
+    for result in results:
+        results_by_sku[result.sku].append(result)
+
+    async def allocate_group(sku: str, group: list[AllocationResult]) -> None:
+        async with uow:
+            product = await uow.products.get(sku=sku)
+            products = {} if product is None else {sku: product}
+            group_lines = [result.line for result in group]
+            allocated = await uow.products.get_batchrefs(group_lines) if products else {}
+            deduplicated = len(allocated)
+            errors = allocate_loaded(group_lines, group, products, allocated)
+            if products:
+                await uow.commit()
+
+        count_outcomes("allocate_many", deduplicated, errors)
+
+    for sku, group in results_by_sku.items():
+        await retry_on_conflict(functools.partial(allocate_group, sku, group))
+
+    return results
+
+
+@metrics.timed
+async def allocate_order(
+    orderid: str, lines: list[tuple[str, int]], uow: unit_of_work.AbstractAsyncUnitOfWork
+) -> list[AllocationResult]:
+    results = [AllocationResult(orderid, sku, qty) for sku, qty in lines]
+
+    async def allocate_lines() -> tuple[int, dict[str, int]]:
+        async with uow:
+            skus = sorted({result.sku for result in results})
+            products = {product.sku: product for product in await uow.products.get_many(skus)}
+            order_lines = [result.line for result in results]
+            allocated = await uow.products.get_batchrefs([l for l in order_lines if l.sku in products])
+            deduplicated = len(allocated)
+            errors = allocate_loaded(order_lines, results, products, allocated)
+            await uow.commit()
+
+        return deduplicated, errors
+
+    count_outcomes("allocate_order", *await retry_on_conflict(allocate_lines))
+    return results
@@ -1,9 +1,20 @@
+import functools
+import random
+import time
+from collections import defaultdict
+from dataclasses import dataclass
 from datetime import date
-from typing import Optional
+from typing import Callable, Optional, TypeVar
 
+from src.allocation import metrics
 from src.allocation.domain import model
 from src.allocation.service_layer import unit_of_work
 
+T = TypeVar("T")
+
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.005  # seconds, doubled on each attempt
+
 
 class InvalidSku(Exception):
     pass
@@ -13,56 +24,370 @@ class BatchNotFound(Exception):
     pass
 
 
+class NotAllocated(Exception):
+    pass
+
+
+@dataclass
+class AllocationResult:
+    orderid: str
+    sku: str
+    qty: int
+    batchref: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def line(self) -> model.OrderLine:
+        return model.OrderLine(self.orderid, self.sku, self.qty)
+
+
 def is_valid_sku(sku: str, batches: list[model.Batch]):
     return sku in {b.sku for b in batches}
 
 
-def add_batch(ref: str, sku: str, qty: int, eta: Optional[date], uow: unit_of_work.AbstractUnitOfWork) -> None:
-    with uow:
-        product = uow.products.get(sku=sku)
+def retry_on_conflict(operation: Callable[[], T]) -> T:
+    """
+    Runs ``operation``, re-running it with jittered exponential backoff when its
+    commit loses an optimistic concurrency race
+
+    :raises unit_of_work.ConcurrentModification: once MAX_ATTEMPTS have failed
+    """
+
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return operation()
+        except unit_of_work.ConcurrentModification:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            time.sleep(random.uniform(0, RETRY_BASE_DELAY * 2 ** attempt))
+    raise AssertionError("unreachable")
+
+
+# Helpers working on already-loaded aggregates, shared with async_services, so
+# the sync and async services differ only in how they load and commit
+
+
+def add_batch_to(product: model.Product, batch: model.Batch, rebalance: bool) -> int:
+    """
+    Returns how many lines moved to preferable batches, with ``rebalance``
+    """
+
+    product.add_batch(batch)
+    return len(product.rebalance()) if rebalance else 0
+
+
+def rebalance_loaded(product: model.Product) -> list[AllocationResult]:
+    return [
+        AllocationResult(line.orderid, line.sku, line.qty, batchref=batchref)
+        for line, batchref in product.rebalance()
+    ]
+
+
+def retire_and_reallocate(product: model.Product, ref: str) -> tuple[list[AllocationResult], dict[str, int]]:
+    """
+    Returns a result per line the batch held, in order id order, and the number
+    of errors of each kind
+
+    :raises BatchNotFound
+    """
+
+    lines = product.retire_batch(ref)
+    if lines is None:
+        raise BatchNotFound(f"Batch {ref} not found")
+
+    # The lines themselves are allocated again, not equal copies, which would be
+    # new rows
+    results = [AllocationResult(line.orderid, line.sku, line.qty) for line in lines]
+    return results, allocate_loaded(lines, results, {product.sku: product}, {})
+
+
+def deallocate_loaded(
+    orderid: str,
+    sku: str,
+    allocation: Optional[tuple[model.OrderLine, str]],
+    product: Optional[model.Product],
+) -> str:
+    """
+    Deallocates the line found by the repository's get_allocation
+
+    :raises NotAllocated
+    """
+
+    if allocation is None or product is None:
+        raise NotAllocated(f"Order {orderid} has no allocation for sku {sku}")
+
+    # Only the line's own batch is looked in, so only its lines are loaded.
+    # The line may have moved (a rebalance) between the lookup and the load.
+    line, batchref = allocation
+    deallocated_from = product.deallocate(line, batchref) or product.deallocate(line)
+    if deallocated_from is None:
+        raise NotAllocated(f"Order {orderid} has no allocation for sku {sku}")
+    return deallocated_from
+
+
+def allocate_loaded(
+    lines: list[model.OrderLine],
+    results: list[AllocationResult],
+    products: dict[str, model.Product],
+    allocated: dict[model.OrderLine, str],
+) -> dict[str, int]:
+    """
+    Allocates each line, filling in its result's batch or error. Lines in
+    ``allocated`` (already allocated, by an earlier attempt or earlier in the
+    request) get the batch they went to, and newly allocated ones are added to
+    it. Returns the number of errors of each kind.
+    """
+
+    errors: dict[str, int] = defaultdict(int)
+    for line, result in zip(lines, results):
+        result.batchref, result.error = None, None
+        product = products.get(line.sku)
         if product is None:
-            product = model.Product(sku, batches=[])
-            uow.products.add(product)
+            result.error = f"Invalid sku {line.sku}"
+            errors["InvalidSku"] += 1
+        elif line in allocated:
+            result.batchref = allocated[line]
+        else:
+            try:
+                result.batchref = allocated[line] = product.allocate(line)
+            except model.OutOfStock as e:
+                result.error = str(e)
+                errors["OutOfStock"] += 1
+    return errors
 
-        product.batches.append(model.Batch(ref=ref, sku=sku, qty=qty, eta=eta))
 
-        uow.commit()
+def count_outcomes(service: str, deduplicated: int, errors: dict[str, int]) -> None:
+    # Only called once the commit has stuck, not for attempts that get retried
+    if deduplicated:
+        metrics.ALLOCATIONS_DEDUPLICATED.inc(deduplicated)
+    for error, count in errors.items():
+        metrics.SERVICE_ERRORS.inc(count, service=service, error=error)
 
 
-def delete_batch(ref: str, sku: str, uow: unit_of_work.AbstractUnitOfWork) -> None:
+@metrics.timed
+def add_batch(
+    ref: str,
+    sku: str,
+    qty: int,
+    eta: Optional[date],
+    uow: unit_of_work.AbstractUnitOfWork,
+    rebalance: bool = False,
+) -> None:
+    """
+    With ``rebalance``, lines already allocated to later batches move to the new
+    one (and any others it frees room in) in the same transaction
     """
+
+    def add_and_rebalance() -> int:
+        with uow:
+            product = uow.products.get(sku=sku)
+            if product is None:
+                product = model.Product(sku, batches=[])
+                uow.products.add(product)
+
+            moved = add_batch_to(product, model.Batch(ref=ref, sku=sku, qty=qty, eta=eta), rebalance)
+            uow.commit()
+
+        return moved
+
+    metrics.LINES_REBALANCED.inc(retry_on_conflict(add_and_rebalance))
+
+
+@metrics.timed
+def rebalance(sku: str, uow: unit_of_work.AbstractUnitOfWork) -> list[AllocationResult]:
+    """
+    Moves the product's allocated lines to preferable batches that have room for
+    them, returning a result per moved line with the batch it moved to. For
+    running in the background, after batches were added without ``rebalance``.
+
+    :raises InvalidSku
+    """
+
+    def rebalance_product() -> list[AllocationResult]:
+        with uow:
+            product = uow.products.get(sku=sku)
+            if product is None:
+                raise InvalidSku(f"Invalid sku {sku}")
+
+            results = rebalance_loaded(product)
+            if results:
+                uow.commit()
+
+        metrics.LINES_REBALANCED.inc(len(results))
+        return results
+
+    return retry_on_conflict(rebalance_product)
+
+
+@metrics.timed
+def delete_batch(ref: str, sku: str, uow: unit_of_work.AbstractUnitOfWork) -> list[AllocationResult]:
+    """
+    Deletes the batch and reallocates the lines it held to the product's other
+    batches, in the same transaction. Returns a result per line, in order id order,
+    with either the batch it moved to or why it couldn't be moved.
+
     :raises InvalidSku
     :raises BatchNotFound
     """
 
-    with uow:
-        product = uow.products.get(sku=sku)
-        if product is None:
-            raise InvalidSku(f"Invalid sku {sku}")
+    def delete_and_reallocate() -> tuple[list[AllocationResult], dict[str, int]]:
+        with uow:
+            # Only the retired batch's lines, and those of the batches they move to,
+            # are loaded
+            product = uow.products.get_summary(sku=sku)
+            if product is None:
+                raise InvalidSku(f"Invalid sku {sku}")
 
-        try:
-            next(b for b in product.batches if b.reference == ref)
-        except StopIteration:
-            raise BatchNotFound(f"Batch {ref} not found")
+            results, errors = retire_and_reallocate(product, ref)
+            uow.commit()
 
-        product.batches = [b for b in product.batches if b.reference is not ref]
+        return results, errors
 
-        uow.commit()
+    results, errors = retry_on_conflict(delete_and_reallocate)
+    count_outcomes("delete_batch", 0, errors)
+    return results
 
 
+@metrics.timed
 def allocate(orderid: str, sku: str, qty: int, uow: unit_of_work.AbstractUnitOfWork) -> str:
     """
+    Idempotent: repeating a request for a line that is already allocated returns
+    the batch it went to, without loading the product
+
     :raises InvalidSku
     """
 
     line = model.OrderLine(orderid, sku, qty)
-    with uow:
-        product = uow.products.get(sku=line.sku)
 
-        if product is None:
-            raise InvalidSku(f"Invalid sku {sku}")
+    def allocate_line() -> str:
+        with uow:
+            # Checked on every attempt, as a conflicting commit may be this same
+            # request arriving twice
+            batchref = uow.products.get_batchref(line)
+            if batchref is not None:
+                metrics.ALLOCATIONS_DEDUPLICATED.inc()
+                return batchref
+
+            product = uow.products.get(sku=line.sku)
+
+            if product is None:
+                raise InvalidSku(f"Invalid sku {sku}")
+
+            batchref = product.allocate(line)
+            uow.commit()
+
+        return batchref
+
+    return retry_on_conflict(allocate_line)
+
+
+@metrics.timed
+def allocate_direct(orderid: str, sku: str, qty: int, uow: unit_of_work.AbstractUnitOfWork) -> str:
+    """
+    allocate, but with the repository choosing and filling the batch, which
+    SqlAlchemyRepository does in the database without loading the product
+
+    :raises InvalidSku
+    """
+
+    line = model.OrderLine(orderid, sku, qty)
+
+    def allocate_line() -> str:
+        with uow:
+            batchref = uow.products.get_batchref(line)
+            if batchref is not None:
+                metrics.ALLOCATIONS_DEDUPLICATED.inc()
+                return batchref
+
+            batchref = uow.products.allocate_line(line)
+
+            if batchref is None:
+                raise InvalidSku(f"Invalid sku {sku}")
+
+            uow.commit()
+
+        return batchref
+
+    return retry_on_conflict(allocate_line)
+
+
+@metrics.timed
+def deallocate(orderid: str, sku: str, uow: unit_of_work.AbstractUnitOfWork) -> str:
+    """
+    Returns the reference of the batch the line was deallocated from
+
+    :raises NotAllocated
+    """
+
+    def deallocate_line() -> str:
+        with uow:
+            allocation = uow.products.get_allocation(orderid, sku)
+            product = uow.products.get(sku=sku) if allocation is not None else None
+            deallocated_from = deallocate_loaded(orderid, sku, allocation, product)
+            uow.commit()
+
+        return deallocated_from
+
+    return retry_on_conflict(deallocate_line)
+
+
+@metrics.timed
+def allocate_many(lines: list[tuple[str, str, int]], uow: unit_of_work.AbstractUnitOfWork) -> list[AllocationResult]:
+    """
+    Allocates (orderid, sku, qty) lines, loading each product once and committing
+    each SKU's lines together. Results are returned in input order.
+    """
+
+    results = [AllocationResult(orderid, sku, qty) for orderid, sku, qty in lines]
+    results_by_sku: dict[str, list[AllocationResult]] = defaultdict(list)
+    for result in results:
+        results_by_sku[result.sku].append(result)
+
+    def allocate_group(sku: str, group: list[AllocationResult]) -> None:
+        with uow:
+            product = uow.products.get(sku=sku)
+            products = {} if product is None else {sku: product}
+            # Like allocate_order: lines already allocated, earlier in the request or
+            # by an earlier attempt at it, return the batch they went to
+            group_lines = [result.line for result in group]
+            allocated = uow.products.get_batchrefs(group_lines) if products else {}
+            deduplicated = len(allocated)
+            errors = allocate_loaded(group_lines, group, products, allocated)
+            if products:
+                uow.commit()
+
+        count_outcomes("allocate_many", deduplicated, errors)
+
+    for sku, group in results_by_sku.items():
+        retry_on_conflict(functools.partial(allocate_group, sku, group))
+
+    return results
+
+
+@metrics.timed
+def allocate_order(orderid: str, lines: list[tuple[str, int]], uow: unit_of_work.AbstractUnitOfWork) -> list[AllocationResult]:
+    """
+    Allocates an order's (sku, qty) lines in one transaction, loading all their
+    products together and committing once. Results are returned in input order;
+    a line that can't be allocated doesn't stop the others. Like allocate, lines
+    already allocated (by an earlier attempt at the same order) return the batch
+    they went to.
+    """
+
+    results = [AllocationResult(orderid, sku, qty) for sku, qty in lines]
+
+    def allocate_lines() -> tuple[int, dict[str, int]]:
+        with uow:
+            skus = sorted({result.sku for result in results})
+            products = {product.sku: product for product in uow.products.get_many(skus)}
+            # Looked up before anything is allocated, so the lookup doesn't flush
+            order_lines = [result.line for result in results]
+            allocated = uow.products.get_batchrefs([l for l in order_lines if l.sku in products])
+            deduplicated = len(allocated)
+            errors = allocate_loaded(order_lines, results, products, allocated)
+            uow.commit()
 
-        batchref = product.allocate(line)
-        uow.commit()
+        return deduplicated, errors
 
-    return batchref
+    count_outcomes("allocate_order", *retry_on_conflict(allocate_lines))
+    return results
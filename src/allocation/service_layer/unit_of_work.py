@@ -1,14 +1,37 @@
 import abc
+from typing import Optional
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 
-from src.allocation import config
-from src.allocation.adapters import repository
+from src.allocation import bootstrap, config, metrics
+from src.allocation.adapters import cache, memory, orm, repository
+from src.allocation.domain import model
 
-DEFAULT_SESSION_FACTORY = sessionmaker(bind=create_engine(
-    config.get_postgres_uri()
-))
+
+class ConcurrentModification(Exception):
+    """
+    Another transaction changed the same aggregate since it was loaded
+    """
+
+
+def _is_duplicate_allocation(error: IntegrityError) -> bool:
+    """
+    Whether ``error`` is allocations_view's unique index turning away a line that
+    another transaction allocated after this one checked for it. The view row is
+    written before the product's version is checked, so this is how losing that
+    race usually shows up.
+    """
+    return orm.allocations_view.name in str(error.orig)
+
+
+def _has_changes(session) -> bool:
+    """
+    Whether the session's transaction has flushed changes or has changes pending,
+    so rolling it back discards work rather than just ending a read
+    """
+    return orm.VIEW_CHANGES in session.info or bool(session.new or session.dirty or session.deleted)
 
 
 class AbstractUnitOfWork(abc.ABC):
@@ -31,19 +54,164 @@ class AbstractUnitOfWork(abc.ABC):
 
 
 class SqlAlchemyUnitOfWork(AbstractUnitOfWork):
-    def __init__(self, session_factory=DEFAULT_SESSION_FACTORY):
+    def __init__(
+        self,
+        session_factory=None,
+        product_cache: Optional[cache.ProductCache] = None,
+        load_strategy: Optional[str] = None,
+        allocation_cache: Optional[cache.AllocationCache] = None,
+    ):
         self.session_factory = session_factory
+        self.product_cache = product_cache
+        self.load_strategy = load_strategy or config.get_product_load_strategy()
+        self.allocation_cache = allocation_cache
 
     def __enter__(self):
+        if self.session_factory is None:
+            self.session_factory = bootstrap.bootstrap()
         self.session = self.session_factory()
-        self.products = repository.SqlAlchemyRepository(self.session)
+        self.products: repository.SqlAlchemyRepository = repository.SqlAlchemyRepository(
+            self.session,
+            load_strategy=self.load_strategy,
+            cache=self.product_cache,
+            allocation_cache=self.allocation_cache,
+        )
 
     def __exit__(self, *args):
         super().__exit__(*args)
         self.session.close()
 
     def commit(self):
-        self.session.commit()
+        snapshots = []
+        try:
+            self.session.flush()
+            if self.product_cache is not None:
+                # Flushed products match what is about to be committed, so their
+                # cached copies can be taken now and published once it succeeds
+                snapshots = [
+                    cache.detached_copy(p) for p in self.products.seen if inspect(p).persistent
+                ]
+            self.session.commit()
+        except StaleDataError as e:
+            metrics.UOW_CONFLICTS.inc()
+            raise ConcurrentModification(str(e)) from e
+        except IntegrityError as e:
+            if not _is_duplicate_allocation(e):
+                raise
+            metrics.UOW_CONFLICTS.inc()
+            raise ConcurrentModification(str(e)) from e
+        finally:
+            if self.product_cache is not None:
+                for product in self.products.seen:
+                    self.product_cache.invalidate(product.sku)
+            view_changes = self.session.info.pop(orm.VIEW_CHANGES, None)
+
+        metrics.UOW_COMMITS.inc()
+        if self.product_cache is not None:
+            for snapshot in snapshots:
+                self.product_cache.put(snapshot)
+        if self.allocation_cache is not None and view_changes is not None:
+            self._update_allocation_cache(self.allocation_cache, view_changes)
+
+    @staticmethod
+    def _update_allocation_cache(allocation_cache: cache.AllocationCache, changes: orm.ViewChanges) -> None:
+        for row in changes.removed:
+            allocation_cache.invalidate(model.OrderLine(row["orderid"], row["sku"], row["qty"]))
+        if changes.removed_batchrefs:
+            allocation_cache.invalidate_batches(changes.removed_batchrefs)
+        for row in changes.added:
+            line = model.OrderLine(row["orderid"], row["sku"], row["qty"])
+            allocation_cache.put(line, row["batchref"])
 
     def rollback(self):
+        if _has_changes(self.session):
+            metrics.UOW_ROLLBACKS.inc()
         self.session.rollback()
+        self.session.info.pop(orm.VIEW_CHANGES, None)
+
+
+class InMemoryUnitOfWork(AbstractUnitOfWork):
+    """
+    Unit of work over products resident in a memory.ProductStore. Each SKU it
+    touches stays locked until it exits, so commits never conflict; ``commit``
+    returns once the changes are journalled and fsync'd.
+    """
+
+    def __init__(self, store: memory.ProductStore):
+        self.store = store
+
+    def __enter__(self):
+        self.products: memory.InMemoryRepository = memory.InMemoryRepository(self.store)
+
+    def __exit__(self, *args):
+        try:
+            super().__exit__(*args)
+        finally:
+            self.products.release()
+        # Taken with no SKUs locked, so it doesn't wait on this unit of work's own locks
+        if self.store.snapshot_due():
+            self.store.snapshot()
+
+    def commit(self):
+        self.products.commit()
+        metrics.UOW_COMMITS.inc()
+
+    def rollback(self):
+        if self.products.rollback():
+            metrics.UOW_ROLLBACKS.inc()
+
+
+class AbstractAsyncUnitOfWork(abc.ABC):
+    products: repository.AbstractAsyncProductRepository
+
+    @abc.abstractmethod
+    async def __aenter__(self):
+        raise NotImplementedError
+
+    async def __aexit__(self, *args):
+        await self.rollback()
+
+    @abc.abstractmethod
+    async def commit(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def rollback(self):
+        raise NotImplementedError
+
+
+class AsyncSqlAlchemyUnitOfWork(AbstractAsyncUnitOfWork):
+    def __init__(self, session_factory=None):
+        self.session_factory = session_factory
+
+    async def __aenter__(self):
+        if self.session_factory is None:
+            self.session_factory = bootstrap.bootstrap_async()
+        self.session = self.session_factory()
+        self.products = repository.AsyncSqlAlchemyRepository(self.session)
+
+    async def __aexit__(self, *args):
+        await super().__aexit__(*args)
+        await self.session.close()
+
+    async def commit(self):
+        try:
+            await self.session.commit()
+        except StaleDataError as e:
+            metrics.UOW_CONFLICTS.inc()
+            raise ConcurrentModification(str(e)) from e
+        except IntegrityError as e:
+            if not _is_duplicate_allocation(e):
+                raise
+            metrics.UOW_CONFLICTS.inc()
+            raise ConcurrentModification(str(e)) from e
+        finally:
+            # Nothing here caches allocations; only needed to tell rollbacks apart
+            self.session.info.pop(orm.VIEW_CHANGES, None)
+        metrics.UOW_COMMITS.inc()
+
+    async def rollback(self):
+        if _has_changes(self.session):
+            metrics.UOW_ROLLBACKS.inc()
+        await self.session.rollback()
+        self.session.info.pop(orm.VIEW_CHANGES, None)
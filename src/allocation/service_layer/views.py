@@ -0,0 +1,25 @@
+from sqlalchemy import text
+
+from src.allocation.service_layer import unit_of_work
+
+
+def allocations(orderid: str, uow: unit_of_work.SqlAlchemyUnitOfWork) -> list[dict]:
+    """
+    Reads straight from the denormalised allocations_view; never loads the domain model
+    """
+
+    with uow:
+        results = uow.session.execute(
+            text("SELECT sku, batchref FROM allocations_view WHERE orderid = :orderid"),
+            dict(orderid=orderid),
+        )
+        return [{"sku": sku, "batchref": batchref} for sku, batchref in results]
+
+
+async def allocations_async(orderid: str, uow: unit_of_work.AsyncSqlAlchemyUnitOfWork) -> list[dict]:
+    async with uow:
+        results = await uow.session.execute(
+            text("SELECT sku, batchref FROM allocations_view WHERE orderid = :orderid"),
+            dict(orderid=orderid),
+        )
+        return [{"sku": sku, "batchref": batchref} for sku, batchref in results]
@@ -1,17 +1,51 @@
+import asyncio
 import time
 from pathlib import Path
 
 import pytest
 import requests
 from requests.exceptions import ConnectionError
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, clear_mappers, configure_mappers
 
 from src.allocation import config
 from src.allocation.adapters.orm import metadata, start_mappers
 
 
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmarks")
+    group.addoption(
+        "--benchmark",
+        action="store_true",
+        help="run tests/perf's benchmarks, which are skipped otherwise (implied by the options below)",
+    )
+    group.addoption("--benchmark-json", help="save tests/perf timings to this JSON file")
+    group.addoption("--benchmark-baseline", help="fail if tests/perf timings regress against this JSON file")
+    group.addoption(
+        "--benchmark-tolerance",
+        type=float,
+        default=0.2,
+        help="slowdown allowed against --benchmark-baseline (default 0.2, i.e. 20%%)",
+    )
+    group.addoption(
+        "--benchmark-memory-tolerance",
+        type=float,
+        default=0.05,
+        help="growth in memory use allowed against --benchmark-baseline (default 0.05, i.e. 5%%)",
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    if any(config.getoption(option) for option in ("benchmark", "benchmark_json", "benchmark_baseline")):
+        return
+    skip = pytest.mark.skip(reason="benchmark, run with --benchmark")
+    for item in items:
+        if "benchmark" in getattr(item, "fixturenames", ()):
+            item.add_marker(skip)
+
+
 @pytest.fixture
 def in_memory_db():
     engine = create_engine("sqlite:///:memory:")
@@ -27,11 +61,59 @@ def session_factory(in_memory_db):
     clear_mappers()
 
 
+@pytest.fixture
+def file_session_factory(tmp_path):
+    """
+    Like session_factory, but on a SQLite file so separate connections (e.g. from
+    different threads) share the same database
+    """
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'allocation.db'}")
+    metadata.create_all(engine)
+    start_mappers()
+    configure_mappers()
+    yield sessionmaker(bind=engine)
+    clear_mappers()
+
+
+@pytest.fixture
+def async_session_factory(tmp_path):
+    """
+    AsyncSession factory on a SQLite file (through aiosqlite)
+    """
+
+    path = tmp_path / "allocation.db"
+    metadata.create_all(create_engine(f"sqlite:///{path}"))
+    start_mappers()
+    configure_mappers()
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    yield sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    asyncio.run(engine.dispose())
+    clear_mappers()
+
+
 @pytest.fixture
 def session(session_factory):
     return session_factory()
 
 
+@pytest.fixture
+def queries(session_factory):
+    """
+    SQL statements run through ``session_factory`` sessions while the test runs
+    """
+
+    engine = session_factory.kw["bind"]
+    statements: list[str] = []
+
+    def record_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record_statement)
+    yield statements
+    event.remove(engine, "before_cursor_execute", record_statement)
+
+
 def wait_for_postgres_to_come_up(engine):
     deadline = time.time() + 10
     while time.time() < deadline:
@@ -62,3 +62,103 @@ def test_unhappy_path_returns_400_and_error_message():
 
     assert r.status_code == HTTPStatus.BAD_REQUEST
     assert r.json()["message"] == f"Invalid sku {unknown_sku}"
+
+
+@pytest.mark.usefixtures("postgres_db")
+@pytest.mark.usefixtures("restart_api")
+def test_bulk_allocate_returns_a_result_per_line():
+    sku, unknown_sku = random_sku(), random_sku("unknown")
+    batch = random_batchref()
+    api_add_batch(ref=batch, sku=sku, qty=10, eta=None)
+    order1, order2, order3 = random_orderid(1), random_orderid(2), random_orderid(3)
+    data = {"lines": [
+        {"orderid": order1, "sku": sku, "qty": 6},
+        {"orderid": order2, "sku": sku, "qty": 6},
+        {"orderid": order3, "sku": unknown_sku, "qty": 1},
+    ]}
+    url = config.get_api_url()
+
+    r = requests.post(f"{url}/allocate/bulk", json=data)
+
+    api_delete_batch(batch, sku)
+
+    assert r.status_code == HTTPStatus.OK
+    assert r.json()["results"] == [
+        {"orderid": order1, "sku": sku, "batchref": batch},
+        {"orderid": order2, "sku": sku, "message": f"Out of stock for sku {sku}"},
+        {"orderid": order3, "sku": unknown_sku, "message": f"Invalid sku {unknown_sku}"},
+    ]
+
+
+@pytest.mark.usefixtures("postgres_db")
+@pytest.mark.usefixtures("restart_api")
+def test_order_allocation_returns_a_result_per_line():
+    sku1, sku2, unknown_sku = random_sku(1), random_sku(2), random_sku("unknown")
+    batch1, batch2 = random_batchref(1), random_batchref(2)
+    api_add_batch(ref=batch1, sku=sku1, qty=10, eta=None)
+    api_add_batch(ref=batch2, sku=sku2, qty=10, eta=None)
+    orderid = random_orderid()
+    data = {"orderid": orderid, "lines": [
+        {"sku": sku2, "qty": 4},
+        {"sku": sku1, "qty": 4},
+        {"sku": unknown_sku, "qty": 1},
+    ]}
+    url = config.get_api_url()
+
+    r = requests.post(f"{url}/allocate/order", json=data)
+    again = requests.post(f"{url}/allocate/order", json=data)
+
+    api_delete_batch(batch1, sku1)
+    api_delete_batch(batch2, sku2)
+
+    assert r.status_code == HTTPStatus.OK
+    assert r.json()["results"] == [
+        {"orderid": orderid, "sku": sku2, "batchref": batch2},
+        {"orderid": orderid, "sku": sku1, "batchref": batch1},
+        {"orderid": orderid, "sku": unknown_sku, "message": f"Invalid sku {unknown_sku}"},
+    ]
+    assert again.json() == r.json()
+
+
+@pytest.mark.usefixtures("postgres_db")
+@pytest.mark.usefixtures("restart_api")
+def test_allocations_can_be_looked_up_by_order():
+    sku, batch, orderid = random_sku(), random_batchref(), random_orderid()
+    api_add_batch(ref=batch, sku=sku, qty=100, eta=None)
+    url = config.get_api_url()
+    requests.post(f"{url}/allocate", json={"orderid": orderid, "sku": sku, "qty": 3})
+
+    r = requests.get(f"{url}/allocations/{orderid}")
+
+    api_delete_batch(batch, sku)
+
+    assert r.status_code == HTTPStatus.OK
+    assert r.json() == [{"sku": sku, "batchref": batch}]
+
+
+@pytest.mark.usefixtures("postgres_db")
+@pytest.mark.usefixtures("restart_api")
+def test_unknown_order_returns_404():
+    url = config.get_api_url()
+
+    r = requests.get(f"{url}/allocations/{random_orderid()}")
+
+    assert r.status_code == HTTPStatus.NOT_FOUND
+
+
+@pytest.mark.usefixtures("postgres_db")
+@pytest.mark.usefixtures("restart_api")
+def test_deallocate_frees_the_line():
+    sku, batch, orderid = random_sku(), random_batchref(), random_orderid()
+    api_add_batch(ref=batch, sku=sku, qty=100, eta=None)
+    url = config.get_api_url()
+    requests.post(f"{url}/allocate", json={"orderid": orderid, "sku": sku, "qty": 3})
+
+    r = requests.delete(f"{url}/allocations/{orderid}/{sku}")
+    again = requests.delete(f"{url}/allocations/{orderid}/{sku}")
+
+    api_delete_batch(batch, sku)
+
+    assert r.status_code == HTTPStatus.OK
+    assert r.json() == {"batchref": batch}
+    assert again.status_code == HTTPStatus.NOT_FOUND
@@ -0,0 +1,150 @@
+import asyncio
+import json
+from datetime import date
+from http import HTTPStatus
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import clear_mappers
+
+from src.allocation.adapters.orm import metadata
+from src.allocation.domain import model
+from src.allocation.entrypoints import asgi_app
+from src.allocation.service_layer import async_services, unit_of_work
+
+
+# Helpers
+
+async def asgi_request(method: str, path: str, payload=None) -> tuple[int, bytes]:
+    body = payload if isinstance(payload, bytes) else json.dumps(payload).encode() if payload else b""
+    messages = [{"type": "http.request", "body": body}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi_app.app({"type": "http", "method": method, "path": path}, receive, send)
+    return sent[0]["status"], sent[1]["body"]
+
+
+# Tests
+
+def test_async_services_allocate_and_commit(async_session_factory):
+    async def scenario():
+        uow = unit_of_work.AsyncSqlAlchemyUnitOfWork(async_session_factory)
+        await async_services.add_batch("warehouse", "ASYNC-LAMP", 10, None, uow)
+        await async_services.add_batch("shipment", "ASYNC-LAMP", 10, date.today(), uow)
+        first = await async_services.allocate("o1", "ASYNC-LAMP", 8, uow)
+        second = await async_services.allocate("o2", "ASYNC-LAMP", 8, uow)
+
+        async with uow:
+            product = await uow.products.get("ASYNC-LAMP")
+            assert product is not None
+            available = {b.reference: b.available_quantity for b in product.batches}
+        return first, second, available
+
+    first, second, available = asyncio.run(scenario())
+
+    assert (first, second) == ("warehouse", "shipment")
+    assert available == {"warehouse": 2, "shipment": 2}
+
+
+def test_async_allocate_order_is_idempotent(async_session_factory):
+    async def scenario():
+        uow = unit_of_work.AsyncSqlAlchemyUnitOfWork(async_session_factory)
+        await async_services.add_batch("b1", "ASYNC-RUG", 10, None, uow)
+        await async_services.add_batch("b2", "ASYNC-VASE", 10, None, uow)
+        lines = [("ASYNC-RUG", 4), ("ASYNC-VASE", 4), ("ASYNC-UNKNOWN", 1)]
+        first = await async_services.allocate_order("o1", lines, uow)
+        repeated = await async_services.allocate_order("o1", lines, uow)
+
+        async with uow:
+            products = await uow.products.get_many(["ASYNC-RUG", "ASYNC-VASE"])
+            available = [b.available_quantity for p in products for b in p.batches]
+        return first, repeated, available
+
+    first, repeated, available = asyncio.run(scenario())
+
+    assert [(r.batchref, r.error) for r in first] == [
+        ("b1", None), ("b2", None), (None, "Invalid sku ASYNC-UNKNOWN")
+    ]
+    assert [r.batchref for r in repeated] == ["b1", "b2", None]
+    assert available == [6, 6]
+
+
+def test_async_allocate_errors_for_invalid_sku(async_session_factory):
+    uow = unit_of_work.AsyncSqlAlchemyUnitOfWork(async_session_factory)
+
+    with pytest.raises(async_services.InvalidSku, match="Invalid sku NONEXISTENTSKU"):
+        asyncio.run(async_services.allocate("o1", "NONEXISTENTSKU", 10, uow))
+
+
+def test_async_uow_rolls_back_uncommitted_work(async_session_factory):
+    async def scenario():
+        uow = unit_of_work.AsyncSqlAlchemyUnitOfWork(async_session_factory)
+        async with uow:
+            uow.products.add(model.Product("UNSAVED-SKU", batches=[]))
+
+        async with uow:
+            return await uow.products.get("UNSAVED-SKU")
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_asgi_app_serves_the_flask_routes(tmp_path, monkeypatch):
+    db_path = tmp_path / "asgi.db"
+    metadata.create_all(create_engine(f"sqlite:///{db_path}"))
+    monkeypatch.setenv("DB_URI", f"sqlite:///{db_path}")
+
+    async def scenario():
+        responses = [
+            await asgi_request("POST", "/add_batch", {"ref": "b1", "sku": "ASGI-SKU", "qty": 10, "eta": None}),
+            await asgi_request("POST", "/allocate", {"orderid": "o1", "sku": "ASGI-SKU", "qty": 3}),
+            await asgi_request("POST", "/allocate", {"orderid": "o2", "sku": "NOPE", "qty": 3}),
+            await asgi_request("POST", "/allocate/order", {"orderid": "o3", "lines": [{"sku": "ASGI-SKU", "qty": 1}]}),
+            await asgi_request("GET", "/allocations/o1"),
+            await asgi_request("DELETE", "/allocations/o1/ASGI-SKU"),
+            await asgi_request("DELETE", "/products/ASGI-SKU/batches/b1"),
+        ]
+        return [(status, body.decode()) for status, body in responses]
+
+    try:
+        responses = asyncio.run(scenario())
+    finally:
+        clear_mappers()
+
+    assert responses == [
+        (HTTPStatus.CREATED, "OK"),
+        (HTTPStatus.CREATED, json.dumps({"batchref": "b1"})),
+        (HTTPStatus.BAD_REQUEST, json.dumps({"message": "Invalid sku NOPE"})),
+        (HTTPStatus.OK, json.dumps({"results": [{"orderid": "o3", "sku": "ASGI-SKU", "batchref": "b1"}]})),
+        (HTTPStatus.OK, json.dumps([{"sku": "ASGI-SKU", "batchref": "b1"}])),
+        (HTTPStatus.OK, json.dumps({"batchref": "b1"})),
+        (HTTPStatus.OK, json.dumps({"reallocated": [
+            {"orderid": "o3", "sku": "ASGI-SKU", "message": "Out of stock for sku ASGI-SKU"}
+        ]})),
+    ]
+
+
+def test_asgi_app_rejects_malformed_json():
+    status, body = asyncio.run(asgi_request("POST", "/allocate", b'{"orderid": '))
+
+    assert status == HTTPStatus.BAD_REQUEST
+    assert json.loads(body) == {"message": "Invalid format"}
+
+
+def test_asgi_app_returns_conflict_once_retries_run_out(monkeypatch):
+    async def always_conflicting(**kwargs):
+        raise unit_of_work.ConcurrentModification("product was modified concurrently")
+
+    monkeypatch.setattr(async_services, "allocate", always_conflicting)
+
+    status, body = asyncio.run(
+        asgi_request("POST", "/allocate", {"orderid": "o1", "sku": "ASGI-SKU", "qty": 1})
+    )
+
+    assert status == HTTPStatus.CONFLICT
+    assert json.loads(body) == {"message": "product was modified concurrently"}
@@ -0,0 +1,105 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from src.allocation.adapters import orm
+from src.allocation.adapters.cache import AllocationCache, ProductCache
+from src.allocation.domain import model
+from src.allocation.service_layer import services, unit_of_work
+from tests.integration.test_uow import get_allocated_batch_ref
+
+
+def test_hot_product_is_served_from_cache_after_commit(session_factory, queries):
+    cache = ProductCache()
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory, cache)
+    services.add_batch("b1", "HOT-SKU", 100, None, uow)
+    services.allocate("o1", "HOT-SKU", 10, uow)
+    queries.clear()
+
+    with uow:
+        product = uow.products.get("HOT-SKU")
+        assert product is not None
+        assert [b.available_quantity for b in product.batches] == [90]
+
+    assert len(queries) == 1, queries
+    assert cache.stats()["hits"] == 2
+
+
+def test_cached_product_is_reloaded_when_changed_elsewhere(session_factory):
+    cache = ProductCache()
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory, cache)
+    services.add_batch("b1", "SHARED-SKU", 100, None, uow)
+
+    # Another process, with no view of this cache
+    services.allocate("o1", "SHARED-SKU", 10, unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+
+    with uow:
+        product = uow.products.get("SHARED-SKU")
+        assert product is not None
+        [batch] = product.batches
+        assert batch.available_quantity == 90
+    assert cache.stats()["misses"] == 1
+
+
+def test_allocations_through_cached_products_are_persisted(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory, ProductCache())
+    services.add_batch("b1", "CACHED-SKU", 10, None, uow)
+    services.allocate("o1", "CACHED-SKU", 6, uow)
+    services.add_batch("b2", "CACHED-SKU", 10, None, uow)
+    services.allocate("o2", "CACHED-SKU", 6, uow)
+
+    session = session_factory()
+    assert get_allocated_batch_ref(session, "o1", "CACHED-SKU") == "b1"
+    assert get_allocated_batch_ref(session, "o2", "CACHED-SKU") == "b2"
+
+
+def test_repeated_allocation_is_answered_from_the_allocation_cache(session_factory, queries):
+    cache = AllocationCache()
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory, allocation_cache=cache)
+    services.add_batch("b1", "RETRIED-SKU", 10, None, uow)
+    services.allocate("o1", "RETRIED-SKU", 6, uow)
+    queries.clear()
+
+    assert services.allocate("o1", "RETRIED-SKU", 6, uow) == "b1"
+
+    assert queries == []
+    [[allocated]] = session_factory().execute(
+        "SELECT COUNT(*) FROM allocations_view WHERE orderid = 'o1'"
+    )
+    assert allocated == 1
+
+
+def test_allocation_cache_follows_deallocation_and_batch_deletion(session_factory):
+    cache = AllocationCache()
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory, allocation_cache=cache)
+    services.add_batch("b1", "MOVING-SKU", 10, None, uow)
+    services.add_batch("b2", "MOVING-SKU", 10, None, uow)
+    services.allocate("o1", "MOVING-SKU", 5, uow)
+    services.allocate("o2", "MOVING-SKU", 5, uow)
+
+    services.deallocate("o1", "MOVING-SKU", uow)
+    services.delete_batch("b1", "MOVING-SKU", uow)
+
+    assert cache.get(model.OrderLine("o1", "MOVING-SKU", 5)) is None
+    assert cache.get(model.OrderLine("o2", "MOVING-SKU", 5)) == "b2"
+
+
+def test_uncommitted_allocations_are_not_remembered(session_factory):
+    cache = AllocationCache()
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory, allocation_cache=cache)
+    services.add_batch("b1", "ABANDONED-SKU", 10, None, uow)
+
+    with uow:
+        product = uow.products.get("ABANDONED-SKU")
+        assert product is not None
+        product.allocate(model.OrderLine("o1", "ABANDONED-SKU", 5))
+        uow.session.flush()
+
+    assert cache.stats()["size"] == 0
+
+
+def test_a_line_can_only_be_in_the_allocations_view_once(session):
+    row = dict(orderid="o1", sku="UNIQUE-SKU", qty=1, batchref="b1")
+    session.execute(orm.allocations_view.insert(), row)
+
+    with pytest.raises(IntegrityError):
+        session.execute(orm.allocations_view.insert(), dict(row, batchref="b2"))
@@ -0,0 +1,62 @@
+import threading
+import time
+
+from src.allocation.domain import model
+from src.allocation.service_layer import services, unit_of_work
+
+THREADS = 16
+BATCH_QTY = 40
+
+
+class CountingUnitOfWork(unit_of_work.SqlAlchemyUnitOfWork):
+    conflicts = 0
+    lock = threading.Lock()
+
+    def commit(self):
+        try:
+            super().commit()
+        except unit_of_work.ConcurrentModification:
+            with CountingUnitOfWork.lock:
+                CountingUnitOfWork.conflicts += 1
+            raise
+
+
+def test_concurrent_allocations_never_over_allocate(file_session_factory):
+    sku = "OVERSOLD-GADGET"
+    uow = unit_of_work.SqlAlchemyUnitOfWork(file_session_factory)
+    services.add_batch("batch1", sku, qty=BATCH_QTY, eta=None, uow=uow)
+    outcomes: list[str] = []
+    start_line = threading.Barrier(THREADS)
+
+    def place_orders(thread_number: int):
+        start_line.wait()
+        for i in range(5):
+            try:
+                services.allocate(f"order-{thread_number}-{i}", sku, 1, CountingUnitOfWork(file_session_factory))
+                outcomes.append("allocated")
+            except model.OutOfStock:
+                outcomes.append("out of stock")
+            except unit_of_work.ConcurrentModification:
+                outcomes.append("gave up")
+
+    threads = [threading.Thread(target=place_orders, args=(n,)) for n in range(THREADS)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    session = file_session_factory()
+    [[allocated]] = session.execute(
+        "SELECT COALESCE(SUM(ol.qty), 0) FROM allocations a JOIN order_lines ol ON a.orderline_id = ol.id"
+    )
+    [[version]] = session.execute("SELECT version_number FROM products WHERE sku=:sku", dict(sku=sku))
+    print(
+        f"\n{len(outcomes)} requests in {elapsed:.2f}s ({len(outcomes) / elapsed:.0f}/s),"
+        f" {CountingUnitOfWork.conflicts} retried conflicts, outcomes:"
+        f" { {o: outcomes.count(o) for o in set(outcomes)} }"
+    )
+    assert allocated == outcomes.count("allocated")
+    assert allocated <= BATCH_QTY
+    assert version == 1 + allocated
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine, exc
+
+from src.allocation import config
+from src.allocation.adapters import database
+
+
+def test_engines_are_shared_per_database(tmp_path):
+    uri = f"sqlite:///{tmp_path / 'shared.db'}"
+
+    assert database.get_engine(uri) is database.get_engine(uri)
+    assert database.get_session_factory(uri) is database.get_session_factory(uri)
+    assert database.get_engine(uri) is not database.get_engine(f"sqlite:///{tmp_path / 'other.db'}")
+
+
+def test_engine_options_come_from_the_environment(monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "20")
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "0")
+    monkeypatch.setenv("DB_POOL_PRE_PING", "true")
+
+    options = config.get_engine_options()
+
+    assert options["pool_size"] == 20
+    assert options["max_overflow"] == 0
+    assert options["pool_pre_ping"] is True
+
+
+def test_pool_records_checkout_waits_and_saturation(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=database.InstrumentedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.01,
+    )
+
+    with engine.connect():
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+
+    stats = engine.pool.stats.as_dict()
+    assert stats["checkouts"] == 1
+    assert stats["timeouts"] == 1
+    assert stats["peak_saturation"] == 1.0
+
+
+def test_forked_processes_get_their_own_pools(tmp_path):
+    engine = database.get_engine(f"sqlite:///{tmp_path / 'forked.db'}")
+    engine.execute("SELECT 1")
+    parent_pool = engine.pool
+    read, write = os.pipe()
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            [[one]] = engine.execute("SELECT 1")
+            os.write(write, b"new pool" if engine.pool is not parent_pool and one == 1 else b"shared")
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+    assert os.read(read, 100) == b"new pool"
+    assert engine.pool is parent_pool
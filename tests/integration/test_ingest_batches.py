@@ -0,0 +1,66 @@
+import json
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from src.allocation.adapters.orm import metadata
+from src.allocation.entrypoints import ingest_batches
+
+
+# Helpers
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'ingest.db'}")
+    metadata.create_all(engine)
+    return engine
+
+
+def write_csv(path, rows: list[tuple]) -> str:
+    path.write_text("ref,sku,qty,eta\n" + "".join(",".join(map(str, row)) + "\n" for row in rows))
+    return str(path)
+
+
+# Tests
+
+def test_ingests_csv_and_jsonl(engine, tmp_path):
+    csv_path = write_csv(tmp_path / "batches.csv", [
+        ("b1", "LAMP", 10, "2030-01-02"), ("b2", "DESK", 5, ""),
+    ])
+    jsonl_path = tmp_path / "batches.jsonl"
+    jsonl_path.write_text(json.dumps({"ref": "b3", "sku": "LAMP", "qty": 7, "eta": None}) + "\n")
+
+    assert ingest_batches.main([csv_path, str(jsonl_path), "--db-uri", str(engine.url)]) == 0
+
+    with engine.connect() as conn:
+        batches = list(conn.execute(text(
+            "SELECT reference, sku, _purchased_quantity, eta FROM batches ORDER BY reference"
+        )))
+        products = list(conn.execute(text("SELECT sku, version_number FROM products ORDER BY sku")))
+    assert batches == [
+        ("b1", "LAMP", 10, str(date(2030, 1, 2))), ("b2", "DESK", 5, None), ("b3", "LAMP", 7, None),
+    ]
+    # Bumped once per chunk that touched the product
+    assert products == [("DESK", 1), ("LAMP", 1)]
+
+
+def test_failed_chunk_rolls_back_alone(engine, tmp_path):
+    # b1 appears twice; the unique reference index rejects the second chunk
+    path = write_csv(tmp_path / "batches.csv", [
+        ("b1", "LAMP", 10, ""), ("b2", "LAMP", 10, ""), ("b3", "LAMP", 10, ""), ("b1", "LAMP", 10, ""),
+    ])
+    progress = []
+
+    with pytest.raises(Exception):
+        ingest_batches.ingest(
+            ingest_batches.read_records(path),
+            engine,
+            chunk_size=2,
+            progress=lambda rows, seconds: progress.append(rows),
+        )
+
+    with engine.connect() as conn:
+        batches = list(conn.execute(text("SELECT reference FROM batches ORDER BY reference")))
+    assert batches == [("b1",), ("b2",)]
+    assert progress == [2]
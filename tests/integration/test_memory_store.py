@@ -0,0 +1,201 @@
+import subprocess
+import sys
+import threading
+from datetime import date
+
+import pytest
+
+from src.allocation.adapters import journal, memory
+from src.allocation.domain import model
+from src.allocation.service_layer import services, unit_of_work
+
+
+# Helpers
+
+def reopen(store: memory.ProductStore, **kwargs) -> memory.ProductStore:
+    store.close()
+    return memory.ProductStore(store.directory, **kwargs)
+
+
+def allocations(store: memory.ProductStore, sku: str) -> dict[str, set[str]]:
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    with uow:
+        product = uow.products.get(sku)
+        assert product is not None
+        return {b.reference: {line.orderid for line in b._allocations} for b in product.batches}
+
+
+# Tests
+
+def test_committed_changes_survive_a_restart(tmp_path):
+    store = memory.ProductStore(tmp_path)
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    services.add_batch("batch1", "LAMP", 10, None, uow)
+    services.add_batch("batch2", "LAMP", 10, date(2030, 1, 1), uow)
+    services.allocate("order1", "LAMP", 4, uow)
+    services.allocate("order2", "LAMP", 8, uow)
+    services.deallocate("order1", "LAMP", uow)
+
+    store = reopen(store)
+
+    assert allocations(store, "LAMP") == {"batch1": set(), "batch2": {"order2"}}
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    with uow:
+        product = uow.products.get("LAMP")
+        assert product is not None
+        assert product.version_number == 5
+        assert [b.available_quantity for b in product.batches] == [10, 2]
+
+
+def test_uncommitted_changes_are_rolled_back_and_not_journalled(tmp_path):
+    store = memory.ProductStore(tmp_path)
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    services.add_batch("batch1", "RUG", 10, None, uow)
+
+    with uow:
+        product = uow.products.get("RUG")
+        assert product is not None
+        product.allocate(model.OrderLine("order1", "RUG", 3))
+        product.add_batch(model.Batch("batch2", "RUG", 5, None))
+        product.retire_batch("batch1")
+
+    assert allocations(store, "RUG") == {"batch1": set()}
+    assert allocations(reopen(store), "RUG") == {"batch1": set()}
+
+
+def test_a_failed_service_call_leaves_the_product_as_it_was(tmp_path):
+    store = memory.ProductStore(tmp_path)
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    services.add_batch("batch1", "CHAIR", 2, None, uow)
+    services.allocate("order1", "CHAIR", 2, uow)
+
+    with pytest.raises(model.OutOfStock):
+        services.allocate("order2", "CHAIR", 1, uow)
+
+    with uow:
+        product = uow.products.get("CHAIR")
+        assert product is not None
+        assert product.version_number == 2
+
+
+def test_deleting_a_batch_reallocates_its_lines_durably(tmp_path):
+    store = memory.ProductStore(tmp_path)
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    services.add_batch("batch1", "TABLE", 10, None, uow)
+    services.add_batch("batch2", "TABLE", 10, date(2030, 1, 1), uow)
+    services.allocate("order1", "TABLE", 5, uow)
+
+    [result] = services.delete_batch("batch1", "TABLE", uow)
+
+    assert result.batchref == "batch2"
+    assert allocations(reopen(store), "TABLE") == {"batch2": {"order1"}}
+
+
+def test_a_torn_journal_record_is_ignored(tmp_path):
+    store = memory.ProductStore(tmp_path)
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    services.add_batch("batch1", "VASE", 10, None, uow)
+    store.close()
+    [segment] = journal.segments(tmp_path)
+    with open(segment, "a") as f:
+        f.write('{"changes":[{"sku":"VASE","version":2,"ops":[["allo')
+
+    store = memory.ProductStore(tmp_path)
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    services.allocate("order1", "VASE", 1, uow)
+
+    assert allocations(reopen(store), "VASE") == {"batch1": {"order1"}}
+
+
+def test_restart_loads_the_snapshot_and_replays_the_rest(tmp_path):
+    store = memory.ProductStore(tmp_path, snapshot_every=3)
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    services.add_batch("batch1", "SOFA", 10, None, uow)
+    for i in range(4):
+        services.allocate(f"order{i}", "SOFA", 1, uow)
+
+    assert (tmp_path / memory.SNAPSHOT_FILE).exists()
+    assert len(journal.segments(tmp_path)) == 1
+    assert allocations(reopen(store), "SOFA") == {"batch1": {"order0", "order1", "order2", "order3"}}
+
+
+def test_changes_survive_a_process_that_dies_without_closing(tmp_path):
+    script = (
+        "import os, sys\n"
+        "from src.allocation.adapters import memory\n"
+        "from src.allocation.service_layer import services, unit_of_work\n"
+        "uow = unit_of_work.InMemoryUnitOfWork(memory.ProductStore(sys.argv[1], snapshot_every=5))\n"
+        "services.add_batch('batch1', 'DESK', 100, None, uow)\n"
+        "for i in range(12):\n"
+        "    services.allocate(f'order{i}', 'DESK', 1, uow)\n"
+        "os._exit(0)\n"
+    )
+    subprocess.run([sys.executable, "-c", script, str(tmp_path)], check=True)
+
+    store = memory.ProductStore(tmp_path)
+
+    assert allocations(store, "DESK") == {"batch1": {f"order{i}" for i in range(12)}}
+
+
+def test_concurrent_allocations_never_over_allocate(tmp_path):
+    store = memory.ProductStore(tmp_path, snapshot_every=20)
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    services.add_batch("batch1", "GADGET", 40, None, uow)
+    outcomes: list[str] = []
+
+    def place_orders(thread_number: int):
+        for i in range(5):
+            try:
+                services.allocate(f"order-{thread_number}-{i}", "GADGET", 1, unit_of_work.InMemoryUnitOfWork(store))
+                outcomes.append("allocated")
+            except model.OutOfStock:
+                outcomes.append("out of stock")
+
+    threads = [threading.Thread(target=place_orders, args=(n,)) for n in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert outcomes.count("allocated") == 40
+    [lines] = allocations(reopen(store), "GADGET").values()
+    assert len(lines) == 40
+
+
+def test_concurrent_orders_sharing_skus_dont_deadlock(tmp_path):
+    store = memory.ProductStore(tmp_path)
+    skus = [f"SHARED-{i}" for i in range(5)]
+    for sku in skus:
+        services.add_batch(f"batch-{sku}", sku, 1_000, None, unit_of_work.InMemoryUnitOfWork(store))
+
+    def place_orders(thread_number: int):
+        # Each thread lists the SKUs in a different order
+        order_skus = skus[thread_number % 5:] + skus[:thread_number % 5]
+        for i in range(20):
+            lines = [(sku, 1) for sku in order_skus]
+            services.allocate_order(f"order-{thread_number}-{i}", lines, unit_of_work.InMemoryUnitOfWork(store))
+
+    threads = [threading.Thread(target=place_orders, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    assert not any(thread.is_alive() for thread in threads)
+    for sku in skus:
+        [lines] = allocations(reopen(store), sku).values()
+        assert len(lines) == 8 * 20
+
+
+def test_rebalanced_lines_stay_moved_after_a_restart(tmp_path):
+    store = memory.ProductStore(tmp_path)
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    services.add_batch("batch1", "BENCH", 10, date(2030, 1, 1), uow)
+    services.allocate("order1", "BENCH", 4, uow)
+    services.allocate("order2", "BENCH", 4, uow)
+    services.add_batch("batch2", "BENCH", 4, None, uow)
+
+    [result] = services.rebalance("BENCH", uow)
+
+    assert result.batchref == "batch2"
+    assert allocations(reopen(store), "BENCH") == {"batch1": {"order2"}, "batch2": {"order1"}}
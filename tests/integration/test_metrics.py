@@ -0,0 +1,76 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import clear_mappers
+
+from src.allocation import metrics
+from src.allocation.adapters.orm import metadata
+from src.allocation.domain import model
+from src.allocation.entrypoints.flask_app import app
+from src.allocation.service_layer import services, unit_of_work, views
+
+
+def test_counts_statements_and_rows_per_request(session_factory):
+    metrics.instrument_sqlalchemy()
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    services.add_batch("b1", "METRIC-SKU", 10, None, uow)
+    services.add_batch("b2", "METRIC-SKU", 10, None, uow)
+    commits = metrics.UOW_COMMITS.value()
+
+    token = metrics.start_request("test_request")
+    services.allocate("o1", "METRIC-SKU", 1, uow)
+    metrics.finish_request(token)
+
+    assert metrics.UOW_COMMITS.value() == commits + 1
+    assert metrics.REQUEST_STATEMENTS.count(endpoint="test_request") == 1
+    rendered = metrics.REGISTRY.render()
+    assert 'allocation_request_rows_loaded_bucket{endpoint="test_request",le="2"} 0' in rendered
+    assert 'allocation_request_rows_loaded_bucket{endpoint="test_request",le="5"} 1' in rendered
+
+
+def test_counts_out_of_stock_and_invalid_sku(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    services.add_batch("b1", "SCARCE-SKU", 1, None, uow)
+    out_of_stock = metrics.SERVICE_ERRORS.value(service="allocate_many", error="OutOfStock")
+    invalid_sku = metrics.SERVICE_ERRORS.value(service="allocate_many", error="InvalidSku")
+
+    services.allocate_many([("o1", "SCARCE-SKU", 1), ("o2", "SCARCE-SKU", 1), ("o3", "NOPE", 1)], uow)
+
+    assert metrics.SERVICE_ERRORS.value(service="allocate_many", error="OutOfStock") == out_of_stock + 1
+    assert metrics.SERVICE_ERRORS.value(service="allocate_many", error="InvalidSku") == invalid_sku + 1
+
+
+def test_counts_rollbacks_only_of_uncommitted_changes(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    services.add_batch("b1", "ROLLBACK-SKU", 10, None, uow)
+    services.allocate("o1", "ROLLBACK-SKU", 1, uow)
+    rollbacks = metrics.UOW_ROLLBACKS.value()
+
+    views.allocations("o1", uow)
+    services.allocate("o1", "ROLLBACK-SKU", 1, uow)
+    assert metrics.UOW_ROLLBACKS.value() == rollbacks
+
+    with uow:
+        product = uow.products.get("ROLLBACK-SKU")
+        assert product is not None
+        product.allocate(model.OrderLine("o2", "ROLLBACK-SKU", 1))
+    assert metrics.UOW_ROLLBACKS.value() == rollbacks + 1
+
+
+def test_flask_app_serves_metrics(tmp_path, monkeypatch):
+    db_uri = f"sqlite:///{tmp_path / 'metrics.db'}"
+    metadata.create_all(create_engine(db_uri))
+    monkeypatch.setenv("DB_URI", db_uri)
+    client = app.test_client()
+
+    try:
+        client.post("/add_batch", json={"ref": "b1", "sku": "HTTP-SKU", "qty": 10, "eta": None})
+        client.post("/allocate", json={"orderid": "o1", "sku": "NOPE", "qty": 1})
+        response = client.get("/metrics")
+    finally:
+        clear_mappers()
+
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    body = response.get_data(as_text=True)
+    assert 'allocation_service_errors_total{service="allocate",error="InvalidSku"}' in body
+    assert 'allocation_request_sql_statements_count{endpoint="add_batch"}' in body
+    assert "# TYPE allocation_service_seconds histogram" in body
@@ -1,6 +1,7 @@
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 
+from src.allocation.adapters.orm import start_mappers
 from src.allocation.domain import model
 
 
@@ -26,3 +27,12 @@ def test_orderline_mapper_can_save_lines(session: Session):
 
     rows = list(session.execute(text('SELECT orderid, sku, qty FROM "order_lines"')))
     assert rows == [("order1", "DECORATIVE-WIDGET", 12)]
+
+
+def test_starting_mappers_again_is_a_no_op(session: Session):
+    start_mappers()
+
+    session.add(model.OrderLine("order1", "SLEEPY-CAT", 3))
+    session.commit()
+
+    assert session.query(model.OrderLine).count() == 1
@@ -0,0 +1,35 @@
+import pstats
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import clear_mappers
+
+from src.allocation.adapters.orm import metadata
+from src.allocation.entrypoints.flask_app import app
+from src.allocation.entrypoints.profiling import ProfilingMiddleware
+
+
+def test_profiles_a_flask_request_down_to_the_database(tmp_path, monkeypatch):
+    db_uri = f"sqlite:///{tmp_path / 'profiling.db'}"
+    metadata.create_all(create_engine(db_uri))
+    monkeypatch.setenv("DB_URI", db_uri)
+    profiles = tmp_path / "profiles"
+    monkeypatch.setattr(app, "wsgi_app", ProfilingMiddleware(app.wsgi_app, profiles))
+    client = app.test_client()
+
+    try:
+        client.post("/add_batch", json={"ref": "b1", "sku": "PROFILED-SKU", "qty": 10, "eta": None})
+        response = client.post(
+            "/allocate", json={"orderid": "o1", "sku": "PROFILED-SKU", "qty": 1}, headers={"X-Profile": "1"}
+        )
+    finally:
+        clear_mappers()
+
+    assert response.status_code == 201
+    profile_id = response.headers["X-Profile-Id"]
+    report = (profiles / f"{profile_id}.txt").read_text()
+    assert report.startswith("POST /allocate: ")
+    assert "SQLAlchemy and database driver: " in report
+    # Stats.stats, the raw profile entries, is missing from typeshed's stubs
+    stats = getattr(pstats.Stats(str(profiles / f"{profile_id}.pstats")), "stats")
+    functions = {name for _, _, name in stats}
+    assert {"allocate", "_execute_context", "<method 'execute' of 'sqlite3.Cursor' objects>"} <= functions
@@ -0,0 +1,143 @@
+import pytest
+
+from src.allocation.adapters import repository
+from src.allocation.service_layer import services, unit_of_work
+from tests.integration.test_uow import get_allocated_batch_ref
+
+BATCH_COUNT = 50
+
+
+@pytest.fixture
+def busy_product(session_factory) -> str:
+    sku = "POPULAR-CUSHION"
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    for i in range(BATCH_COUNT):
+        services.add_batch(f"batch-{i}", sku, qty=10, eta=None, uow=uow)
+    services.allocate_many([(f"order-{i}", sku, 2) for i in range(BATCH_COUNT * 4)], uow)
+    return sku
+
+
+def test_allocate_query_budget(session_factory, busy_product, queries):
+    queries.clear()
+
+    services.allocate("new-order", busy_product, 2, unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+
+    # Includes the lookup for an earlier allocation of the same line
+    assert len(queries) <= 8, queries
+
+
+def test_repeated_allocate_only_looks_up_the_earlier_allocation(session_factory, busy_product, queries):
+    queries.clear()
+
+    batchref = services.allocate("order-0", busy_product, 2, unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+
+    assert batchref == "batch-0"
+    assert len(queries) == 1, queries
+    assert "allocations_view" in queries[0]
+
+
+def test_allocate_direct_query_budget(session_factory, busy_product, queries):
+    queries.clear()
+
+    batchref = services.allocate_direct(
+        "new-order", busy_product, 2, unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    )
+
+    # The earlier-allocation lookup, the version bump, its repeat under the lock,
+    # then on SQLite one statement each to pick the batch and write the line, its
+    # allocation and its view row (on Postgres those four are one statement)
+    assert batchref == "batch-40"
+    assert len(queries) <= 7, queries
+    assert not any("FROM products" in q and "batches" in q for q in queries), queries
+
+
+def test_deallocate_query_budget(session_factory, busy_product, queries):
+    queries.clear()
+
+    batchref = services.deallocate(
+        "order-0", busy_product, unit_of_work.SqlAlchemyUnitOfWork(session_factory, load_strategy="summary")
+    )
+
+    # The line and its batch are found through the indexes; of the product's
+    # batches, only that one's lines are loaded
+    assert batchref == "batch-0"
+    assert len(queries) <= 7, queries
+    batch_line_loads = [q for q in queries if q.startswith("SELECT order_lines.id")]
+    assert len(batch_line_loads) == 1, queries
+
+
+def test_allocate_order_query_budget(session_factory, busy_product, queries):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    skus = [f"ORDERED-{i}" for i in range(10)]
+    for sku in skus:
+        services.add_batch(f"batch-{sku}", sku, qty=10, eta=None, uow=uow)
+    queries.clear()
+
+    results = services.allocate_order("big-order", [(sku, 1) for sku in skus + [busy_product]], uow)
+
+    # Every product and earlier allocation is read in the same few queries however
+    # many SKUs the order has; the ORM still writes versions and lines a row at a time
+    assert all(r.batchref is not None for r in results)
+    reads = [q for q in queries if q.startswith("SELECT")]
+    assert len(reads) <= 4, reads
+
+
+def test_add_batch_query_budget(session_factory, busy_product, queries):
+    queries.clear()
+
+    services.add_batch("new-batch", busy_product, 10, None, unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+
+    assert len(queries) <= 5, queries
+
+
+def test_delete_batch_query_budget(session_factory, busy_product, queries):
+    queries.clear()
+
+    results = services.delete_batch("batch-0", busy_product, unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+
+    # Moving the batch's lines costs the same handful of executemany statements
+    # however many lines it held, and of the other batches only the one they
+    # move to has its lines loaded
+    assert len(results) == 5
+    assert len(queries) <= 10, queries
+    line_loads = [q for q in queries if q.startswith("SELECT order_lines")]
+    assert len(line_loads) == 2, queries
+
+
+@pytest.mark.parametrize("strategy", ["selectin", "joined"])
+def test_repository_loads_whole_aggregate_up_front(session_factory, busy_product, queries, strategy):
+    session = session_factory()
+    repo = repository.SqlAlchemyRepository(session, load_strategy=strategy)
+    queries.clear()
+
+    product = repo.get(busy_product)
+    assert product is not None
+    total_allocated = sum(b.allocated_quantity for b in product.batches)
+
+    assert total_allocated == BATCH_COUNT * 4 * 2
+    assert len(queries) <= 3, queries
+
+
+def test_summary_strategy_loads_quantities_without_lines(session_factory, busy_product, queries):
+    session = session_factory()
+    repo = repository.SqlAlchemyRepository(session, load_strategy="summary")
+    queries.clear()
+
+    product = repo.get(busy_product)
+    assert product is not None
+    total_allocated = sum(b.allocated_quantity for b in product.batches)
+
+    assert total_allocated == BATCH_COUNT * 4 * 2
+    assert all("_allocations" not in batch.__dict__ for batch in product.batches)
+    assert len(queries) <= 2, queries
+
+
+def test_summary_allocate_loads_only_the_chosen_batch(session_factory, busy_product, queries):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory, load_strategy="summary")
+    queries.clear()
+
+    batchref = services.allocate("new-order", busy_product, 2, uow)
+
+    line_loads = [q for q in queries if q.lstrip().startswith("SELECT order_lines")]
+    assert len(line_loads) == 1, queries
+    assert get_allocated_batch_ref(session_factory(), "new-order", busy_product) == batchref
@@ -0,0 +1,19 @@
+from datetime import date
+
+from src.allocation.entrypoints import rebalance
+from src.allocation.service_layer import services, unit_of_work
+
+
+def test_rebalances_every_product_by_default(file_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(file_session_factory)
+    for sku in ["LAMP", "DESK"]:
+        services.add_batch(f"{sku}-shipment", sku, 10, date(2030, 1, 1), uow)
+        services.allocate("o1", sku, 5, uow)
+        services.add_batch(f"{sku}-warehouse", sku, 10, None, uow)
+    db_uri = str(file_session_factory.kw["bind"].url)
+
+    assert rebalance.main(["--db-uri", db_uri]) == 0
+
+    assert services.allocate("o1", "LAMP", 5, uow) == "LAMP-warehouse"
+    assert services.allocate("o1", "DESK", 5, uow) == "DESK-warehouse"
+    assert rebalance.main(["--db-uri", db_uri, "NO-SUCH-SKU"]) == 1
@@ -1,6 +1,8 @@
+import random
 from datetime import date, timedelta
 
 from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import Session
 
 from src.allocation.adapters import repository
@@ -77,3 +79,99 @@ def test_repository_can_retrieve_a_product_with_batches_and_allocations(session:
     assert retrieved_product.batches[0]._allocations == {
         model.OrderLine("order1", "GENERIC-SOFA", 12)
     }
+
+
+def test_retrieved_batches_rebuild_allocated_quantity(session: Session):
+    orderline_id = insert_order_line(session)
+    batch_id = insert_batch(session, "batch1")
+    insert_product(session)
+    insert_allocation(session, orderline_id, batch_id)
+    session.commit()
+    repo = repository.SqlAlchemyRepository(session)
+
+    product = repo.get("GENERIC-SOFA")
+    assert product is not None
+    [batch] = product.batches
+    assert batch.allocated_quantity == 12
+
+    batch.allocate(model.OrderLine("order2", "GENERIC-SOFA", 10))
+    assert batch.available_quantity == 78
+
+    session.rollback()
+    assert batch.available_quantity == 88
+
+
+def test_repository_finds_allocated_line_through_indexes(session: Session):
+    orderline_id = insert_order_line(session)
+    batch_id = insert_batch(session, "batch1")
+    insert_product(session)
+    insert_allocation(session, orderline_id, batch_id)
+    repo = repository.SqlAlchemyRepository(session)
+
+    assert repo.get_allocation("order1", "GENERIC-SOFA") == (
+        model.OrderLine("order1", "GENERIC-SOFA", 12), "batch1"
+    )
+    assert repo.get_allocation("order2", "GENERIC-SOFA") is None
+
+    query = repository._allocation_query("order1", "GENERIC-SOFA").compile(
+        compile_kwargs={"literal_binds": True}
+    )
+    plan = " ".join(row[-1] for row in session.execute(text(f"EXPLAIN QUERY PLAN {query}")))
+    assert "ix_order_lines_orderid_sku" in plan
+    assert "SCAN" not in plan
+
+
+def test_repository_gets_many_products_in_sku_order(session: Session):
+    repo = repository.SqlAlchemyRepository(session)
+    for sku in ["SKU-C", "SKU-A", "SKU-B"]:
+        repo.add(model.Product(sku, [model.Batch(f"batch-{sku}", sku, 10, None)]))
+    session.commit()
+
+    products = repository.SqlAlchemyRepository(session).get_many(["SKU-C", "SKU-A", "SKU-MISSING"])
+
+    assert [p.sku for p in products] == ["SKU-A", "SKU-C"]
+    assert [b.reference for b in products[1].batches] == ["batch-SKU-C"]
+
+
+def test_repository_allocates_in_sql_as_the_product_would(session: Session):
+    rng = random.Random(23)
+    etas = [None, date(2030, 1, 1), date(2030, 1, 2)]
+    batches = [(f"batch{i}", rng.choice(etas), rng.randint(1, 20)) for i in range(8)]
+    repo = repository.SqlAlchemyRepository(session)
+    repo.add(model.Product("GENERIC-SOFA", [model.Batch(ref, "GENERIC-SOFA", qty, eta) for ref, eta, qty in batches]))
+    session.commit()
+    expected = model.Product("GENERIC-SOFA", [model.Batch(ref, "GENERIC-SOFA", qty, eta) for ref, eta, qty in batches])
+
+    allocated = 0
+    for i in range(40):
+        line = model.OrderLine(f"order{i}", "GENERIC-SOFA", rng.randint(1, 8))
+        try:
+            batchref = expected.allocate(line)
+        except model.OutOfStock:
+            batchref = None
+        try:
+            assert repository.SqlAlchemyRepository(session).allocate_line(line) == batchref
+            session.commit()
+            allocated += 1
+        except model.OutOfStock:
+            assert batchref is None
+            session.rollback()
+
+    product = repository.SqlAlchemyRepository(session).get("GENERIC-SOFA")
+    assert product is not None
+    assert {b.reference: b.available_quantity for b in product.batches} == {
+        b.reference: b.available_quantity for b in expected.batches
+    }
+    assert 0 < allocated < 40
+    assert product.version_number == allocated
+    assert repository.SqlAlchemyRepository(session).allocate_line(model.OrderLine("o", "NO-SUCH-SKU", 1)) is None
+
+
+def test_repository_allocates_in_one_postgres_statement():
+    query = repository._allocate_in_one_statement(model.OrderLine("order1", "GENERIC-SOFA", 12))
+
+    sql = str(query.compile(dialect=postgresql.dialect()))
+
+    assert "FOR UPDATE SKIP LOCKED" in sql
+    assert "NULLS FIRST" in sql
+    assert sql.count("INSERT INTO") == 3
@@ -0,0 +1,59 @@
+import json
+import signal
+import subprocess
+import sys
+import urllib.request
+
+import pytest
+from sqlalchemy import create_engine
+
+from src.allocation.adapters.orm import metadata
+from src.allocation.entrypoints import serve
+
+
+# Helpers
+
+def post(url: str, payload: dict) -> str:
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode(), headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request) as response:
+        return response.read().decode()
+
+
+# Tests
+
+def test_prefork_server_serves_requests_and_stops_cleanly(tmp_path, monkeypatch):
+    db_uri = f"sqlite:///{tmp_path / 'serve.db'}"
+    metadata.create_all(create_engine(db_uri))
+    monkeypatch.setenv("DB_URI", db_uri)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "src.allocation.entrypoints.serve", "--port", "0", "--workers", "3"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    assert server.stdout is not None
+    try:
+        url = server.stdout.readline().split()[2]
+        post(f"{url}/add_batch", {"ref": "b1", "sku": "SERVED-LAMP", "qty": 100, "eta": None})
+        batchrefs = {
+            json.loads(post(f"{url}/allocate", {"orderid": f"o{i}", "sku": "SERVED-LAMP", "qty": 1}))["batchref"]
+            for i in range(30)
+        }
+    finally:
+        server.send_signal(signal.SIGTERM)
+        returncode = server.wait(timeout=10)
+
+    assert batchrefs == {"b1"}
+    assert returncode == 0
+
+
+def test_prefork_server_gives_up_when_workers_keep_dying(monkeypatch):
+    def crash(app, listener, threaded):
+        raise RuntimeError("worker failed to start")
+
+    monkeypatch.setattr(serve, "_serve_worker", crash)
+
+    with pytest.raises(serve.WorkersKeepDying):
+        serve.serve(lambda environ, start_response: [], "127.0.0.1", 0, 2, restart_delay=0, max_restarts=3)
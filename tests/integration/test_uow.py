@@ -4,7 +4,7 @@ import pytest
 from sqlalchemy.orm import Session
 
 from src.allocation.domain import model
-from src.allocation.service_layer import unit_of_work
+from src.allocation.service_layer import services, unit_of_work, views
 
 
 # Helpers
@@ -77,3 +77,117 @@ def test_rolls_back_on_error(session_factory):
     new_session = session_factory()
     rows = list(new_session.execute("SELECT * FROM batches"))
     assert rows == []
+
+
+def test_allocate_many_commits_each_sku_group(session_factory):
+    session = session_factory()
+    insert_batch(session, "batch1", "SPINDLY-CHAIR", 10, None)
+    insert_batch(session, "batch2", "SQUAT-CHAIR", 10, None)
+    session.commit()
+
+    results = services.allocate_many(
+        [("o1", "SPINDLY-CHAIR", 4), ("o2", "SQUAT-CHAIR", 4), ("o3", "SPINDLY-CHAIR", 4)],
+        unit_of_work.SqlAlchemyUnitOfWork(session_factory),
+    )
+
+    assert [r.batchref for r in results] == ["batch1", "batch2", "batch1"]
+    assert get_allocated_batch_ref(session, "o2", "SQUAT-CHAIR") == "batch2"
+    assert get_allocated_batch_ref(session, "o3", "SPINDLY-CHAIR") == "batch1"
+
+
+def test_a_duplicate_committed_first_makes_allocate_return_its_batch(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    services.add_batch("batch1", "WOBBLY-STOOL", 100, None, uow)
+
+    class DuplicateCommittingFirst(unit_of_work.SqlAlchemyUnitOfWork):
+        duplicated = False
+
+        def commit(self):
+            # The same request, arriving again, gets in between this one's load and commit
+            if not self.duplicated:
+                self.duplicated = True
+                services.allocate("o1", "WOBBLY-STOOL", 2, unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+            super().commit()
+
+    batchref = services.allocate("o1", "WOBBLY-STOOL", 2, DuplicateCommittingFirst(session_factory))
+
+    assert batchref == "batch1"
+    [[allocations]] = session_factory().execute("SELECT COUNT(*) FROM allocations")
+    assert allocations == 1
+
+
+def test_resent_bulk_allocation_returns_the_original_batches(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    services.add_batch("b1", "WOBBLY-STOOL", 5, None, uow)
+    services.add_batch("b2", "WOBBLY-STOOL", 10, None, uow)
+
+    first = services.allocate_many([("o1", "WOBBLY-STOOL", 4), ("o1", "WOBBLY-STOOL", 4)], uow)
+    resent = services.allocate_many([("o1", "WOBBLY-STOOL", 4)], uow)
+
+    assert [r.batchref for r in first + resent] == ["b1", "b1", "b1"]
+    assert get_allocated_batch_ref(session_factory(), "o1", "WOBBLY-STOOL") == "b1"
+
+
+def test_stale_product_version_fails_commit(session_factory):
+    session = session_factory()
+    insert_batch(session, "batch1", "FLIMSY-SHELF", 100, None)
+    session.commit()
+
+    uow1 = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    uow2 = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    with uow1, uow2:
+        product1 = uow1.products.get(sku="FLIMSY-SHELF")
+        product2 = uow2.products.get(sku="FLIMSY-SHELF")
+        assert product1 is not None and product2 is not None
+        product1.allocate(model.OrderLine("o1", "FLIMSY-SHELF", 10))
+        product2.allocate(model.OrderLine("o2", "FLIMSY-SHELF", 10))
+        uow1.commit()
+
+        with pytest.raises(unit_of_work.ConcurrentModification):
+            uow2.commit()
+
+    [[version]] = session.execute("SELECT version_number FROM products WHERE sku='FLIMSY-SHELF'")
+    assert version == 1
+
+
+def test_deallocate_frees_stock_and_removes_the_allocation(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    services.add_batch("b1", "SMALL-TABLE", 10, None, uow)
+    services.allocate("o1", "SMALL-TABLE", 10, uow)
+
+    assert services.deallocate("o1", "SMALL-TABLE", uow) == "b1"
+
+    with pytest.raises(services.NotAllocated):
+        services.deallocate("o1", "SMALL-TABLE", uow)
+    assert services.allocate("o2", "SMALL-TABLE", 10, uow) == "b1"
+    assert get_allocated_batch_ref(session_factory(), "o2", "SMALL-TABLE") == "b1"
+
+
+def test_delete_batch_moves_lines_to_remaining_batches(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    services.add_batch("b1", "SMALL-TABLE", 10, None, uow)
+    services.add_batch("b2", "SMALL-TABLE", 10, datetime.date(2099, 1, 1), uow)
+    services.allocate("o1", "SMALL-TABLE", 6, uow)
+    services.allocate("o2", "SMALL-TABLE", 4, uow)
+
+    results = services.delete_batch("b1", "SMALL-TABLE", uow)
+
+    assert [(r.orderid, r.batchref) for r in results] == [("o1", "b2"), ("o2", "b2")]
+    session = session_factory()
+    assert get_allocated_batch_ref(session, "o1", "SMALL-TABLE") == "b2"
+    assert list(session.execute("SELECT reference FROM batches")) == [("b2",)]
+
+
+def test_rebalancing_moves_allocations_and_their_view_rows(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    services.add_batch("shipment", "SMALL-TABLE", 10, datetime.date(2099, 1, 1), uow)
+    services.allocate("o1", "SMALL-TABLE", 6, uow)
+    services.allocate("o2", "SMALL-TABLE", 4, uow)
+
+    services.add_batch("warehouse", "SMALL-TABLE", 7, None, uow, rebalance=True)
+
+    session = session_factory()
+    assert get_allocated_batch_ref(session, "o1", "SMALL-TABLE") == "warehouse"
+    assert get_allocated_batch_ref(session, "o2", "SMALL-TABLE") == "shipment"
+    assert views.allocations("o1", uow) == [{"sku": "SMALL-TABLE", "batchref": "warehouse"}]
+    assert services.allocate("o1", "SMALL-TABLE", 6, uow) == "warehouse"
@@ -0,0 +1,33 @@
+from src.allocation.domain import model
+from src.allocation.service_layer import services, unit_of_work, views
+
+
+def test_allocations_view(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    services.add_batch("sku1batch", "sku1", 50, None, uow)
+    services.add_batch("sku2batch", "sku2", 50, None, uow)
+    services.allocate("order1", "sku1", 20, uow)
+    services.allocate("order1", "sku2", 20, uow)
+    services.allocate("otherorder", "sku1", 30, uow)
+
+    assert views.allocations("order1", uow) == [
+        {"sku": "sku1", "batchref": "sku1batch"},
+        {"sku": "sku2", "batchref": "sku2batch"},
+    ]
+
+
+def test_allocations_view_follows_deallocation_and_batch_deletion(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    services.add_batch("b1", "sku1", 50, None, uow)
+    services.add_batch("b2", "sku2", 50, None, uow)
+    services.allocate("order1", "sku1", 20, uow)
+    services.allocate("order1", "sku2", 20, uow)
+
+    services.delete_batch("b1", "sku1", uow)
+    with uow:
+        product = uow.products.get("sku2")
+        assert product is not None
+        product.batches[0].deallocate(model.OrderLine("order1", "sku2", 20))
+        uow.commit()
+
+    assert views.allocations("order1", uow) == []
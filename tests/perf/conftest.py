@@ -0,0 +1,65 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import clear_mappers
+
+from src.allocation.adapters.orm import metadata, start_mappers
+from tests.perf.results import BenchmarkResults, compare, format_value, load, measurement
+
+RESULTS = BenchmarkResults()
+REGRESSIONS: list[str] = []
+
+
+@pytest.fixture
+def benchmark() -> BenchmarkResults:
+    """
+    Where perf tests record their timings, for --benchmark-json and --benchmark-baseline
+    """
+
+    return RESULTS
+
+
+@pytest.fixture
+def bench_db_uri(tmp_path, monkeypatch):
+    # Point BENCH_DB_URI at a local Postgres for representative numbers; SQLite
+    # serialises writes, which hides most of what concurrency buys
+    db_uri = os.environ.get("BENCH_DB_URI") or f"sqlite:///{tmp_path / 'bench.db'}"
+    monkeypatch.setenv("DB_URI", db_uri)
+    engine = create_engine(db_uri)
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    engine.dispose()
+    start_mappers()
+    yield db_uri
+    clear_mappers()
+
+
+def pytest_sessionfinish(session):
+    if not RESULTS.results:
+        return
+    config = session.config
+    if config.getoption("benchmark_json"):
+        RESULTS.save(config.getoption("benchmark_json"))
+    if config.getoption("benchmark_baseline"):
+        baseline = load(config.getoption("benchmark_baseline"))
+        REGRESSIONS.extend(compare(
+            baseline,
+            RESULTS.as_dict(),
+            config.getoption("benchmark_tolerance"),
+            config.getoption("benchmark_memory_tolerance"),
+        ))
+        if REGRESSIONS:
+            session.exitstatus = pytest.ExitCode.TESTS_FAILED
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not RESULTS.results:
+        return
+    terminalreporter.section("benchmarks")
+    for name, result in sorted(RESULTS.results.items()):
+        terminalreporter.write_line(f"{name:<60} {format_value(*measurement(result)):>12}")
+    if REGRESSIONS:
+        terminalreporter.section("benchmark regressions", red=True)
+        for regression in REGRESSIONS:
+            terminalreporter.write_line(regression)
@@ -0,0 +1,126 @@
+"""
+Benchmark results: recorded by the perf tests, saved as JSON and compared against a
+baseline, either at the end of a pytest run or with
+
+    python -m tests.perf.results baseline.json current.json [--tolerance 0.2] [--memory-tolerance 0.05]
+"""
+
+import argparse
+import json
+import platform
+import sys
+from pathlib import Path
+from typing import Optional
+
+DEFAULT_TOLERANCE = 0.2
+# Memory use barely varies between runs, so a smaller growth is a regression
+DEFAULT_MEMORY_TOLERANCE = 0.05
+UNITS = ("seconds", "bytes")
+
+
+class BenchmarkResults:
+    def __init__(self):
+        self.results: dict[str, dict] = {}
+
+    def record(self, name: str, value: float, unit: str = "seconds", **details) -> None:
+        """
+        ``value`` is the time per operation in seconds, or with ``unit="bytes"`` the
+        memory used; lower is better. ``details`` (sizes, throughputs, percentiles)
+        are saved alongside it but not compared
+        """
+
+        if unit not in UNITS:
+            raise ValueError(f"unit must be one of {UNITS}, not {unit!r}")
+        self.results[name] = {unit: value, **details}
+
+    def as_dict(self) -> dict:
+        return {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": dict(sorted(self.results.items())),
+        }
+
+    def save(self, path: str) -> None:
+        Path(path).write_text(json.dumps(self.as_dict(), indent=2) + "\n")
+
+
+def load(path: str) -> dict:
+    return json.loads(Path(path).read_text())
+
+
+def measurement(result: dict) -> tuple[str, float]:
+    """
+    A recorded result's unit and value
+    """
+
+    unit = next(unit for unit in UNITS if unit in result)
+    return unit, result[unit]
+
+
+def compare(
+    baseline: dict,
+    current: dict,
+    tolerance: float = DEFAULT_TOLERANCE,
+    memory_tolerance: float = DEFAULT_MEMORY_TOLERANCE,
+) -> list[str]:
+    """
+    One line per benchmark present in both runs that got more than ``tolerance``
+    slower, or used more than ``memory_tolerance`` more memory
+    """
+
+    tolerances = {"seconds": tolerance, "bytes": memory_tolerance}
+    regressions = []
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        unit, value = measurement(result)
+        before_unit, before_value = measurement(before)
+        if unit != before_unit or before_value <= 0:
+            continue
+        change = value / before_value - 1
+        if change > tolerances[unit]:
+            regressions.append(
+                f"{name}: {format_value(unit, before_value)} -> {format_value(unit, value)} (+{change:.0%})"
+            )
+    return regressions
+
+
+def format_value(unit: str, value: float) -> str:
+    return format_bytes(value) if unit == "bytes" else format_seconds(value)
+
+
+def format_bytes(size: float) -> str:
+    if size < 1024:
+        return f"{size:.0f}B"
+    if size < 1024 ** 2:
+        return f"{size / 1024:.1f}KiB"
+    return f"{size / 1024 ** 2:.1f}MiB"
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.2f}us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds:.2f}s"
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Flag benchmark regressions")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=DEFAULT_MEMORY_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    regressions = compare(load(args.baseline), load(args.current), args.tolerance, args.memory_tolerance)
+    for regression in regressions:
+        print(regression)
+    if not regressions:
+        print(f"no regressions beyond {args.tolerance:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from src.allocation import config
+from src.allocation.service_layer import async_services, services, unit_of_work
+
+CLIENTS = 500
+SKUS = 100
+SYNC_WORKERS = 15  # a sync worker can serve about as many requests at once as its pool has connections
+
+
+def report(name: str, latencies: list[float], elapsed: float) -> str:
+    p50, p99 = percentiles(latencies)
+    return f"{name}: {len(latencies) / elapsed:,.0f} req/s, p50 {p50 * 1e3:.1f}ms, p99 {p99 * 1e3:.1f}ms"
+
+
+def percentiles(latencies: list[float]) -> tuple[float, float]:
+    latencies = sorted(latencies)
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99) - 1]
+
+
+def test_sync_vs_async_under_500_clients(benchmark, bench_db_uri):
+    engine = create_engine(bench_db_uri)
+    session_factory = sessionmaker(bind=engine)
+    for i in range(SKUS):
+        uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+        services.add_batch(f"batch-{i}", f"sku-{i}", 1_000_000, None, uow)
+
+    # All clients arrive at once, so each latency runs from the start, queueing included
+    def sync_client(n: int) -> float:
+        uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+        services.allocate(f"sync-{n}", f"sku-{n % SKUS}", 1, uow)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(SYNC_WORKERS) as pool:
+        sync_latencies = list(pool.map(sync_client, range(CLIENTS)))
+    sync_elapsed = time.perf_counter() - started
+
+    async def run_async_clients() -> tuple[list[float], float]:
+        # Same connection budget as the sync workers get
+        async_engine = create_async_engine(
+            config.get_async_database_uri(),
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=SYNC_WORKERS,
+            max_overflow=0,
+        )
+        async_session_factory = sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False)
+
+        async def async_client(n: int) -> float:
+            uow = unit_of_work.AsyncSqlAlchemyUnitOfWork(async_session_factory)
+            await async_services.allocate(f"async-{n}", f"sku-{n % SKUS}", 1, uow)
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(async_client(n) for n in range(CLIENTS)))
+        elapsed = time.perf_counter() - started
+        await async_engine.dispose()
+        return list(latencies), elapsed
+
+    async_latencies, async_elapsed = asyncio.run(run_async_clients())
+
+    print(f"\n{CLIENTS} clients on {engine.url.get_backend_name()}:")
+    print(report(f"  sync ({SYNC_WORKERS} worker threads)", sync_latencies, sync_elapsed))
+    print(report("  asyncio", async_latencies, async_elapsed))
+    backend = engine.url.get_backend_name()
+    for name, latencies, elapsed in [
+        ("sync", sync_latencies, sync_elapsed),
+        ("async", async_latencies, async_elapsed),
+    ]:
+        p50, p99 = percentiles(latencies)
+        benchmark.record(
+            f"concurrency.{name}_allocate[{CLIENTS}_clients,{backend}]",
+            elapsed / CLIENTS,
+            p50=p50,
+            p99=p99,
+        )
+    [[allocated]] = engine.execute("SELECT COUNT(*) FROM allocations")
+    assert allocated == 2 * CLIENTS
@@ -0,0 +1,30 @@
+from src.allocation.adapters.cache import ProductCache
+from src.allocation.service_layer import services, unit_of_work
+from tests.perf.timing import best_of
+
+
+def read_hot_product(uow: unit_of_work.SqlAlchemyUnitOfWork) -> None:
+    with uow:
+        product = uow.products.get("HOT-SKU")
+        assert product is not None
+        assert sum(b.available_quantity for b in product.batches) > 0
+
+
+def test_hot_sku_latency_with_and_without_cache(benchmark, file_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(file_session_factory)
+    for i in range(20):
+        services.add_batch(f"batch-{i}", "HOT-SKU", qty=100, eta=None, uow=uow)
+    services.allocate_many([(f"order-{i}", "HOT-SKU", 1) for i in range(200)], uow)
+
+    cache = ProductCache()
+    cached_uow = unit_of_work.SqlAlchemyUnitOfWork(file_session_factory, cache)
+    uncached = best_of(lambda: read_hot_product(uow), number=20)
+    cached = best_of(lambda: read_hot_product(cached_uow), number=20)
+
+    print(
+        f"\nhot SKU get (20 batches, 200 lines):"
+        f" {uncached * 1e3:.2f}ms uncached, {cached * 1e3:.2f}ms cached"
+    )
+    benchmark.record("repository.get[uncached]", uncached)
+    benchmark.record("repository.get[cached]", cached)
+    assert cache.stats()["hits"] > 0
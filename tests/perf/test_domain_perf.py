@@ -0,0 +1,88 @@
+import random
+import time
+from datetime import date, timedelta
+
+import pytest
+
+from src.allocation.domain.model import Batch, OrderLine, OutOfStock, Product
+from tests.perf.timing import best_of
+
+
+def batch_with_allocations(count: int) -> Batch:
+    batch = Batch("batch-001", "BUSY-SKU", qty=count + 1_000_000, eta=None)
+    for i in range(count):
+        batch.allocate(OrderLine(f"order-{i}", "BUSY-SKU", 1))
+    return batch
+
+
+def cost_of_allocate_and_deallocate(batch: Batch) -> float:
+    line = OrderLine("order-probe", "BUSY-SKU", 1)
+
+    def allocate_and_deallocate():
+        batch.allocate(line)
+        batch.deallocate(line)
+
+    return best_of(allocate_and_deallocate)
+
+
+@pytest.mark.parametrize("allocations", [100, 1_000, 10_000])
+def test_batch_allocate_by_allocation_count(benchmark, allocations):
+    seconds = cost_of_allocate_and_deallocate(batch_with_allocations(allocations))
+    benchmark.record(f"domain.batch.allocate_deallocate[{allocations}_lines]", seconds)
+
+
+def product_with_exhausted_batches(count: int) -> Product:
+    # Every batch but the last is full, so a linear scan has to walk past all of them
+    batches = [
+        Batch(f"batch-{i}", "BUSY-SKU", qty=1, eta=date(2020, 1, 1) + timedelta(days=i))
+        for i in range(count)
+    ]
+    batches[-1] = Batch("last-batch", "BUSY-SKU", qty=10_000_000, eta=date(2099, 1, 1))
+    product = Product("BUSY-SKU", batches)
+    for i in range(count - 1):
+        product.allocate(OrderLine(f"filler-{i}", "BUSY-SKU", 1))
+    return product
+
+
+def cost_of_product_allocate(product: Product) -> float:
+    lines = (OrderLine(f"order-{i}", "BUSY-SKU", 1) for i in range(10_000_000))
+    return best_of(lambda: product.allocate(next(lines)))
+
+
+@pytest.mark.parametrize("batches", [10, 100, 1_000, 10_000])
+def test_product_allocate_by_batch_count(benchmark, batches):
+    seconds = cost_of_product_allocate(product_with_exhausted_batches(batches))
+    benchmark.record(f"domain.product.allocate[{batches}_batches]", seconds)
+
+
+def wave(batch_count: int, line_count: int) -> tuple[Product, list[OrderLine]]:
+    rng = random.Random(42)
+    batches = [
+        Batch(
+            f"batch-{i}",
+            "WAVE-SKU",
+            qty=rng.randint(1, 200),
+            eta=date(2020, 1, 1) + timedelta(days=rng.randint(0, 365)),
+        )
+        for i in range(batch_count)
+    ]
+    lines = [OrderLine(f"order-{i}", "WAVE-SKU", rng.randint(1, 20)) for i in range(line_count)]
+    return Product("WAVE-SKU", batches), lines
+
+
+def test_wave_allocation_throughput(benchmark):
+    product, lines = wave(batch_count=2_000, line_count=20_000)
+
+    start = time.perf_counter()
+    allocated = 0
+    for line in lines:
+        try:
+            product.allocate(line)
+            allocated += 1
+        except OutOfStock:
+            pass
+    scalar = time.perf_counter() - start
+
+    print(f"\nwave of {len(lines)} lines x 2k batches: Product.allocate loop {len(lines) / scalar:,.0f} lines/s")
+    benchmark.record("domain.product.allocate_loop[2k_batches]", scalar / len(lines))
+    assert allocated > 0
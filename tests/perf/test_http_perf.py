@@ -0,0 +1,41 @@
+import statistics
+import time
+
+from sqlalchemy import create_engine
+
+from src.allocation.entrypoints.flask_app import app
+
+REQUESTS = 200
+
+
+def latencies_of(send_request, count: int = REQUESTS) -> list[float]:
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        response = send_request(i)
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code < 300, response.json
+    return sorted(latencies)
+
+
+def test_http_latency(benchmark, bench_db_uri):
+    backend = create_engine(bench_db_uri).url.get_backend_name()
+    client = app.test_client()
+
+    endpoints = {
+        "POST /add_batch": lambda i: client.post(
+            "/add_batch", json={"ref": f"batch-{i}", "sku": f"sku-{i % 10}", "qty": 1_000, "eta": None}
+        ),
+        "POST /allocate": lambda i: client.post(
+            "/allocate", json={"orderid": f"order-{i}", "sku": f"sku-{i % 10}", "qty": 1}
+        ),
+        "GET /allocations": lambda i: client.get(f"/allocations/order-{i}"),
+    }
+
+    print(f"\nFlask test client on {backend}:")
+    for endpoint, send_request in endpoints.items():
+        latencies = latencies_of(send_request)
+        p50 = statistics.median(latencies)
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        print(f"  {endpoint}: p50 {p50 * 1e3:.2f}ms, p99 {p99 * 1e3:.2f}ms")
+        benchmark.record(f"http.{endpoint}[{backend}]", p50, p99=p99)
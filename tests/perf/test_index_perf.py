@@ -0,0 +1,53 @@
+import os
+
+from sqlalchemy import create_engine, text
+
+from src.allocation.adapters import orm, repository
+from tests.perf.timing import best_of
+
+# The request sized this at 10M order lines; that takes minutes to load, so the
+# default is smaller. Set BENCH_ORDER_LINES=10000000 for the full run.
+ORDER_LINES = int(os.environ.get("BENCH_ORDER_LINES", 200_000))
+BATCHES = 1_000
+
+
+def load_order_lines(engine) -> None:
+    with engine.begin() as conn:
+        conn.execute(orm.products_table.insert(), [{"sku": f"sku-{i}"} for i in range(BATCHES)])
+        conn.execute(orm.batch_table.insert(), [
+            {"id": i + 1, "reference": f"batch-{i}", "sku": f"sku-{i}", "_purchased_quantity": 10 ** 9}
+            for i in range(BATCHES)
+        ])
+        chunk = 100_000
+        for start in range(0, ORDER_LINES, chunk):
+            ids = range(start + 1, min(start + chunk, ORDER_LINES) + 1)
+            conn.execute(orm.orderline_table.insert(), [
+                {"id": i, "orderid": f"order-{i}", "sku": f"sku-{i % BATCHES}", "qty": 1} for i in ids
+            ])
+            conn.execute(orm.allocations_table.insert(), [
+                {"orderline_id": i, "batch_id": i % BATCHES + 1} for i in ids
+            ])
+
+
+def test_allocated_line_lookup_with_and_without_index(benchmark, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'lines.db'}")
+    orm.metadata.create_all(engine)
+    load_order_lines(engine)
+    target = ORDER_LINES // 2
+    query = repository._allocation_query(f"order-{target}", f"sku-{target % BATCHES}")
+
+    with engine.connect() as conn:
+        plan = " ".join(row[-1] for row in conn.execute(
+            text(f"EXPLAIN QUERY PLAN {query.compile(compile_kwargs={'literal_binds': True})}")
+        ))
+        indexed = best_of(lambda: conn.execute(query).scalar(), number=100)
+        conn.execute(text("DROP INDEX ix_order_lines_orderid_sku"))
+        unindexed = best_of(lambda: conn.execute(query).scalar(), repeat=3, number=3)
+
+    print(
+        f"\nallocated line lookup in {ORDER_LINES:,} order lines:"
+        f" {indexed * 1e6:.0f}us indexed, {unindexed * 1e3:.1f}ms without the index\n  plan: {plan}"
+    )
+    benchmark.record(f"db.allocated_line_lookup[{ORDER_LINES}_lines,indexed]", indexed)
+    benchmark.record(f"db.allocated_line_lookup[{ORDER_LINES}_lines,unindexed]", unindexed)
+    assert "ix_order_lines_orderid_sku" in plan
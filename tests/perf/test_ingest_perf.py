@@ -0,0 +1,31 @@
+import os
+
+from sqlalchemy import create_engine
+
+from src.allocation.entrypoints import ingest_batches
+
+# Daily files run to 200k+ batches; BENCH_INGEST_ROWS=200000 for the full size
+ROWS = int(os.environ.get("BENCH_INGEST_ROWS", 50_000))
+
+
+def test_ingest_throughput(benchmark, bench_db_uri, tmp_path):
+    path = tmp_path / "batches.csv"
+    with open(path, "w") as f:
+        f.write("ref,sku,qty,eta\n")
+        for i in range(ROWS):
+            f.write(f"batch-{i},sku-{i % 5_000},100,2030-01-{i % 28 + 1:02}\n")
+    engine = create_engine(bench_db_uri)
+    backend = engine.url.get_backend_name()
+    elapsed = []
+
+    written = ingest_batches.ingest(
+        ingest_batches.read_records(str(path)),
+        engine,
+        progress=lambda rows, seconds: elapsed.append(seconds),
+    )
+
+    print(f"\ningested {written:,} batches on {backend}: {written / elapsed[-1]:,.0f} rows/s")
+    benchmark.record(
+        f"ingest.batches[{backend}]", elapsed[-1] / written, rows_per_second=written / elapsed[-1]
+    )
+    assert written == ROWS
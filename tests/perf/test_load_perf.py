@@ -0,0 +1,40 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.allocation.adapters import orm
+from src.allocation.service_layer import services, unit_of_work
+from tests.perf.timing import best_of
+
+BATCHES = 100
+LINES_PER_BATCH = 200
+
+
+def test_allocate_on_a_busy_sku_by_load_strategy(benchmark, bench_db_uri):
+    engine = create_engine(bench_db_uri)
+    backend = engine.url.get_backend_name()
+    with engine.begin() as conn:
+        conn.execute(orm.products_table.insert(), {"sku": "BUSY-SKU"})
+        conn.execute(orm.batch_table.insert(), [
+            {"id": i + 1, "reference": f"batch-{i}", "sku": "BUSY-SKU", "_purchased_quantity": 10 ** 9}
+            for i in range(BATCHES)
+        ])
+        conn.execute(orm.orderline_table.insert(), [
+            {"id": i + 1, "orderid": f"order-{i}", "sku": "BUSY-SKU", "qty": 1}
+            for i in range(BATCHES * LINES_PER_BATCH)
+        ])
+        conn.execute(orm.allocations_table.insert(), [
+            {"orderline_id": i + 1, "batch_id": i % BATCHES + 1}
+            for i in range(BATCHES * LINES_PER_BATCH)
+        ])
+    session_factory = sessionmaker(bind=engine)
+
+    print(f"\nallocate on {BATCHES} batches x {LINES_PER_BATCH} lines ({backend}):")
+    orders = iter(range(10 ** 9))
+    for strategy in ["selectin", "summary"]:
+        def allocate():
+            uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory, load_strategy=strategy)
+            services.allocate(f"new-{next(orders)}", "BUSY-SKU", 1, uow)
+
+        seconds = best_of(allocate, repeat=3, number=3)
+        print(f"  {strategy}: {seconds * 1e3:.1f}ms")
+        benchmark.record(f"services.allocate[busy_sku,{strategy},{backend}]", seconds)
@@ -0,0 +1,79 @@
+import gc
+import os
+import tracemalloc
+from typing import Callable, TypeVar
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from src.allocation.adapters import orm, repository
+from src.allocation.domain.model import Batch, OrderLine, Product
+
+# The request sized this at 1M allocations (BENCH_ALLOCATIONS=1000000); loading
+# that many through the ORM takes the best part of a minute
+ALLOCATIONS = int(os.environ.get("BENCH_ALLOCATIONS", 50_000))
+BATCHES = 100
+
+T = TypeVar("T")
+
+
+def bytes_allocated(build: Callable[[], T]) -> tuple[T, int]:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        gc.collect()
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def domain_product() -> Product:
+    batches = [Batch(f"batch-{i}", "BUSY-SKU", 10 ** 9, None) for i in range(BATCHES)]
+    for i in range(ALLOCATIONS):
+        batches[i % BATCHES].allocate(OrderLine(f"order-{i}", "BUSY-SKU", 1))
+    return Product("BUSY-SKU", batches)
+
+
+def test_bytes_per_line_and_batch(benchmark, tmp_path):
+    _, empty_batches = bytes_allocated(
+        lambda: [Batch(f"batch-{i}", "BUSY-SKU", 10 ** 9, None) for i in range(ALLOCATIONS)]
+    )
+    _, in_memory = bytes_allocated(domain_product)
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'memory.db'}")
+    orm.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(orm.products_table.insert(), {"sku": "BUSY-SKU"})
+        conn.execute(orm.batch_table.insert(), [
+            {"id": i + 1, "reference": f"batch-{i}", "sku": "BUSY-SKU", "_purchased_quantity": 10 ** 9}
+            for i in range(BATCHES)
+        ])
+        conn.execute(orm.orderline_table.insert(), [
+            {"id": i + 1, "orderid": f"order-{i}", "sku": "BUSY-SKU", "qty": 1}
+            for i in range(ALLOCATIONS)
+        ])
+        conn.execute(orm.allocations_table.insert(), [
+            {"orderline_id": i + 1, "batch_id": i % BATCHES + 1} for i in range(ALLOCATIONS)
+        ])
+    orm.start_mappers()
+    try:
+        session = sessionmaker(bind=engine)()
+        repo = repository.SqlAlchemyRepository(session)
+        product, loaded = bytes_allocated(lambda: repo.get("BUSY-SKU"))
+        assert product is not None
+        skus = {id(line.sku) for batch in product.batches for line in batch._allocations}
+        session.close()
+    finally:
+        clear_mappers()
+
+    print(
+        f"\n{ALLOCATIONS:,} allocations: {empty_batches / ALLOCATIONS:.0f} bytes per batch,"
+        f" {in_memory / ALLOCATIONS:.0f} bytes per line in memory,"
+        f" {loaded / ALLOCATIONS:.0f} bytes per line loaded through the ORM"
+    )
+    benchmark.record("memory.bytes_per_batch", empty_batches / ALLOCATIONS, unit="bytes")
+    benchmark.record("memory.bytes_per_line[domain]", in_memory / ALLOCATIONS, unit="bytes")
+    benchmark.record("memory.bytes_per_line[orm]", loaded / ALLOCATIONS, unit="bytes")
+    # Every loaded line shares one SKU string
+    assert len(skus) == 1
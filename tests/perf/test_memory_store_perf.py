@@ -0,0 +1,56 @@
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from src.allocation.adapters import memory
+from src.allocation.service_layer import services, unit_of_work
+
+SKUS = 10
+ALLOCATIONS = 1_000
+THREADS = 8
+
+
+def allocations_per_second(uow_factory, threads: int = 1) -> float:
+    """
+    Allocates ALLOCATIONS lines across SKUS products from ``threads`` threads
+    """
+
+    for i in range(SKUS):
+        services.add_batch(f"batch-{i}", f"sku-{i}", ALLOCATIONS, None, uow_factory())
+
+    def place_orders(thread_number: int):
+        for i in range(thread_number, ALLOCATIONS, threads):
+            services.allocate(f"order-{i}", f"sku-{i % SKUS}", 1, uow_factory())
+
+    workers = [threading.Thread(target=place_orders, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return ALLOCATIONS / (time.perf_counter() - start)
+
+
+def test_in_memory_store_against_the_database(benchmark, bench_db_uri, tmp_path):
+    engine = create_engine(bench_db_uri)
+    backend = engine.url.get_backend_name()
+    session_factory = sessionmaker(bind=engine)
+    database = allocations_per_second(lambda: unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+    # The store tracks changes through its own collections, which the mapped
+    # classes would replace with the ORM's
+    clear_mappers()
+
+    store = memory.ProductStore(tmp_path / "sequential")
+    in_memory = allocations_per_second(lambda: unit_of_work.InMemoryUnitOfWork(store))
+    store = memory.ProductStore(tmp_path / "threaded")
+    threaded = allocations_per_second(lambda: unit_of_work.InMemoryUnitOfWork(store), THREADS)
+
+    print(
+        f"\nallocate on {backend}: {database:,.0f}/s, in memory: {in_memory:,.0f}/s,"
+        f" in memory from {THREADS} threads (group committed): {threaded:,.0f}/s"
+    )
+    benchmark.record(f"memory_store.baseline_allocate[{backend}]", 1 / database)
+    benchmark.record("memory_store.allocate", 1 / in_memory)
+    benchmark.record(f"memory_store.allocate[{THREADS}_threads]", 1 / threaded)
@@ -0,0 +1,15 @@
+from src.allocation import metrics
+from tests.perf.timing import best_of
+
+
+def test_instrumentation_overhead(benchmark):
+    def service():
+        pass
+
+    bare = best_of(service, number=10_000)
+    timed = best_of(metrics.timed(service), number=10_000)
+    counter = best_of(lambda: metrics.SQL_STATEMENTS.inc(), number=10_000)
+
+    print(f"\n@timed adds {(timed - bare) * 1e6:.2f}us per call, Counter.inc {counter * 1e6:.2f}us")
+    benchmark.record("metrics.timed_overhead", timed - bare)
+    benchmark.record("metrics.counter_inc", counter)
@@ -0,0 +1,26 @@
+from werkzeug.test import EnvironBuilder
+
+from src.allocation.entrypoints.profiling import ProfilingMiddleware
+from tests.perf.timing import best_of
+
+
+def test_profiling_overhead_when_not_sampled(benchmark, tmp_path):
+    def app(environ, start_response):
+        start_response("200 OK", [])
+        return [b"ok"]
+
+    environ = EnvironBuilder(path="/allocate", method="POST").get_environ()
+    unsampled = ProfilingMiddleware(app, tmp_path)
+    sampled_rarely = ProfilingMiddleware(app, tmp_path, sample_rate=0.001, sample=lambda: 0.5)
+
+    bare = best_of(lambda: app(environ, lambda *args: None), number=10_000)
+    header_only = best_of(lambda: unsampled(environ, lambda *args: None), number=10_000)
+    sampling = best_of(lambda: sampled_rarely(environ, lambda *args: None), number=10_000)
+
+    print(
+        f"\nprofiling middleware adds {(header_only - bare) * 1e6:.2f}us per unprofiled request,"
+        f" {(sampling - bare) * 1e6:.2f}us with sampling on"
+    )
+    benchmark.record("profiling.unprofiled_overhead", header_only - bare)
+    benchmark.record("profiling.unprofiled_overhead[sampling]", sampling - bare)
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,60 @@
+import time
+from datetime import date, timedelta
+
+from src.allocation.domain.model import Batch, OrderLine, Product
+
+LINES = 100_000
+BATCHES = 1_000
+WAREHOUSE_QTY = 5_000
+
+
+def product_with_full_shipments() -> Product:
+    """
+    LINES one-unit lines filling BATCHES shipments, latest ETA last
+    """
+
+    per_batch = LINES // BATCHES
+    product = Product("BUSY-SKU", [
+        Batch(f"shipment-{i}", "BUSY-SKU", qty=per_batch, eta=date(2030, 1, 1) + timedelta(days=i))
+        for i in range(BATCHES)
+    ])
+    for i in range(LINES):
+        product.allocate(OrderLine(f"order-{i:06}", "BUSY-SKU", 1))
+    return product
+
+
+def seconds_to(operation) -> float:
+    start = time.perf_counter()
+    operation()
+    return time.perf_counter() - start
+
+
+def reallocate_every_line(product: Product) -> None:
+    lines = [line for batch in product.batches for line in batch.deallocate_all()]
+    product._index = None
+    for line in sorted(lines, key=lambda line: line.orderid):
+        product.allocate(line)
+
+
+def test_rebalancing_onto_a_new_warehouse_batch(benchmark):
+    product = product_with_full_shipments()
+    nothing_to_move = seconds_to(product.rebalance)
+    product.add_batch(Batch("warehouse", "BUSY-SKU", qty=WAREHOUSE_QTY, eta=None))
+    moved = []
+    rebalance = seconds_to(lambda: moved.extend(product.rebalance()))
+
+    product = product_with_full_shipments()
+    product.add_batch(Batch("warehouse", "BUSY-SKU", qty=WAREHOUSE_QTY, eta=None))
+    reallocate = seconds_to(lambda: reallocate_every_line(product))
+
+    print(
+        f"\n{LINES:,} lines in {BATCHES:,} batches, {WAREHOUSE_QTY:,} units arriving in the warehouse:"
+        f" rebalance {rebalance * 1e3:.1f}ms, reallocating every line {reallocate * 1e3:.1f}ms,"
+        f" rebalance with nothing to move {nothing_to_move * 1e6:.0f}us"
+    )
+    benchmark.record(f"domain.product.rebalance[{LINES // 1000}k_lines]", rebalance)
+    benchmark.record(f"domain.product.rebalance[{LINES // 1000}k_lines,nothing_to_move]", nothing_to_move)
+    benchmark.record(f"domain.product.reallocate_all[{LINES // 1000}k_lines]", reallocate)
+    # Only the lines of the latest shipments move
+    assert len(moved) == WAREHOUSE_QTY
+    assert {batchref for _, batchref in moved} == {"warehouse"}
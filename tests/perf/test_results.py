@@ -0,0 +1,37 @@
+from tests.perf.results import BenchmarkResults, compare
+
+
+# Helpers
+
+
+def run(**timings: float) -> dict:
+    results = BenchmarkResults()
+    for name, seconds in timings.items():
+        results.record(name, seconds)
+    return results.as_dict()
+
+
+# Tests
+
+
+def test_flags_benchmarks_slower_than_tolerance():
+    regressions = compare(run(fast=1.0, slow=1.0), run(fast=1.1, slow=1.5), tolerance=0.2)
+
+    assert len(regressions) == 1
+    assert regressions[0].startswith("slow: 1.00s -> 1.50s")
+
+
+def test_ignores_benchmarks_missing_from_baseline():
+    assert compare(run(old=1.0), run(old=1.0, new=10.0)) == []
+
+
+def test_compares_memory_in_bytes_against_its_own_tolerance():
+    baseline, current = BenchmarkResults(), BenchmarkResults()
+    baseline.record("small", 400, unit="bytes")
+    baseline.record("large", 400, unit="bytes")
+    current.record("small", 404, unit="bytes")
+    current.record("large", 440, unit="bytes")
+
+    regressions = compare(baseline.as_dict(), current.as_dict(), tolerance=0.2, memory_tolerance=0.05)
+
+    assert regressions == ["large: 400B -> 440B (+10%)"]
@@ -0,0 +1,75 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import create_engine
+
+from src.allocation.service_layer import services, unit_of_work
+
+CLIENTS = max(2, os.cpu_count() or 1) * 2
+REQUESTS_PER_CLIENT = 100
+ORDERS = 100
+
+
+def worker_counts() -> list[int]:
+    cores = os.cpu_count() or 1
+    counts = {cores}
+    count = 1
+    while count < cores:
+        counts.add(count)
+        count *= 2
+    return sorted(counts)
+
+
+def send_requests(url: str, client: int) -> int:
+    for i in range(REQUESTS_PER_CLIENT):
+        with urllib.request.urlopen(f"{url}/allocations/order-{(client + i) % ORDERS}") as response:
+            response.read()
+    return REQUESTS_PER_CLIENT
+
+
+def requests_per_second(workers: int) -> float:
+    """
+    Starts the pre-forked server with ``workers`` workers and has CLIENTS client
+    processes send REQUESTS_PER_CLIENT requests each to it
+    """
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "src.allocation.entrypoints.serve", "--port", "0", "--workers", str(workers)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    assert server.stdout is not None
+    try:
+        url = server.stdout.readline().split()[2]
+        with ProcessPoolExecutor(CLIENTS) as clients:
+            # Warms up every worker's imports and pools before timing
+            list(clients.map(send_requests, [url] * CLIENTS, range(CLIENTS)))
+            start = time.perf_counter()
+            sent = sum(clients.map(send_requests, [url] * CLIENTS, range(CLIENTS)))
+            return sent / (time.perf_counter() - start)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=10)
+
+
+def test_requests_per_second_as_workers_are_added(benchmark, bench_db_uri):
+    backend = create_engine(bench_db_uri).url.get_backend_name()
+    uow = unit_of_work.SqlAlchemyUnitOfWork()
+    services.add_batch("batch", "SERVED-SKU", ORDERS, None, uow)
+    services.allocate_many([(f"order-{i}", "SERVED-SKU", 1) for i in range(ORDERS)], uow)
+
+    rates = {workers: requests_per_second(workers) for workers in worker_counts()}
+
+    print(
+        f"\nGET /allocations on {backend}, {CLIENTS} clients on {os.cpu_count()} CPUs: "
+        + ", ".join(f"{workers} workers {rate:,.0f}/s" for workers, rate in rates.items())
+    )
+    for workers, rate in rates.items():
+        benchmark.record(f"serve.get_allocations[{workers}_workers,{backend}]", 1 / rate)
+    assert all(rate > 0 for rate in rates.values())
@@ -0,0 +1,106 @@
+import time
+from datetime import date
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.allocation.service_layer import services, unit_of_work
+
+OPERATIONS = 200
+
+
+def seconds_per_operation(operation, count: int = OPERATIONS) -> float:
+    start = time.perf_counter()
+    for i in range(count):
+        operation(i)
+    return (time.perf_counter() - start) / count
+
+
+def test_service_throughput(benchmark, bench_db_uri):
+    engine = create_engine(bench_db_uri)
+    backend = engine.url.get_backend_name()
+    session_factory = sessionmaker(bind=engine)
+
+    def uow():
+        return unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+
+    add_batch = seconds_per_operation(
+        lambda i: services.add_batch(f"batch-{i}", f"sku-{i % 10}", 1_000, None, uow())
+    )
+    allocate = seconds_per_operation(lambda i: services.allocate(f"order-{i}", f"sku-{i % 10}", 1, uow()))
+    delete_batch = seconds_per_operation(
+        lambda i: services.delete_batch(f"batch-{i}", f"sku-{i % 10}", uow())
+    )
+
+    print(
+        f"\nservices on {backend}: add_batch {1 / add_batch:,.0f}/s,"
+        f" allocate {1 / allocate:,.0f}/s, delete_batch {1 / delete_batch:,.0f}/s"
+    )
+    benchmark.record(f"services.add_batch[{backend}]", add_batch)
+    benchmark.record(f"services.allocate[{backend}]", allocate)
+    benchmark.record(f"services.delete_batch[{backend}]", delete_batch)
+    [[batches]] = engine.execute("SELECT COUNT(*) FROM batches")
+    assert batches == 0
+
+
+def test_retiring_a_busy_batch(benchmark, bench_db_uri):
+    engine = create_engine(bench_db_uri)
+    backend = engine.url.get_backend_name()
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sessionmaker(bind=engine))
+    services.add_batch("busy", "BUSY-SKU", 5_000, None, uow)
+    for i in range(100):
+        services.add_batch(f"spare-{i}", "BUSY-SKU", 40, date(2030, 1, 1), uow)
+    services.allocate_many([(f"order-{i}", "BUSY-SKU", 1) for i in range(5_000)], uow)
+
+    start = time.perf_counter()
+    results = services.delete_batch("busy", "BUSY-SKU", uow)
+    elapsed = time.perf_counter() - start
+
+    print(f"\ndelete_batch moving 5k lines on {backend}: {elapsed * 1e3:.0f}ms")
+    benchmark.record(f"services.delete_batch[5k_lines,{backend}]", elapsed)
+    assert sum(r.batchref is not None for r in results) == 4_000
+
+
+def test_retiring_a_quiet_batch_of_a_busy_product(benchmark, bench_db_uri):
+    engine = create_engine(bench_db_uri)
+    backend = engine.url.get_backend_name()
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sessionmaker(bind=engine))
+    services.add_batch("busy", "BUSY-SKU", 5_000, None, uow)
+    services.add_batch("quiet", "BUSY-SKU", 10, date(2030, 1, 1), uow)
+    services.add_batch("spare", "BUSY-SKU", 10, date(2031, 1, 1), uow)
+    services.allocate_many([(f"order-{i}", "BUSY-SKU", 1) for i in range(5_005)], uow)
+
+    start = time.perf_counter()
+    results = services.delete_batch("quiet", "BUSY-SKU", uow)
+    elapsed = time.perf_counter() - start
+
+    print(f"\ndelete_batch moving 5 lines beside 5k others on {backend}: {elapsed * 1e3:.0f}ms")
+    benchmark.record(f"services.delete_batch[5_lines,5k_others,{backend}]", elapsed)
+    assert [r.batchref for r in results] == ["spare"] * 5
+
+
+def test_order_allocation_against_a_call_per_line(benchmark, bench_db_uri):
+    engine = create_engine(bench_db_uri)
+    backend = engine.url.get_backend_name()
+    session_factory = sessionmaker(bind=engine)
+    skus = [f"order-sku-{i}" for i in range(20)]
+    for sku in skus:
+        services.add_batch(f"batch-{sku}", sku, 1_000, None, unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+
+    def allocate_per_line(i):
+        for sku in skus:
+            services.allocate(f"line-order-{i}", sku, 1, unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+
+    def allocate_order(i):
+        lines = [(sku, 1) for sku in skus]
+        services.allocate_order(f"order-{i}", lines, unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+
+    per_line = seconds_per_operation(allocate_per_line, count=10)
+    per_order = seconds_per_operation(allocate_order, count=10)
+
+    print(
+        f"\n20-line order on {backend}: {per_line * 1e3:.1f}ms a line at a time,"
+        f" {per_order * 1e3:.1f}ms with allocate_order"
+    )
+    benchmark.record(f"services.allocate[20_line_order,per_line,{backend}]", per_line)
+    benchmark.record(f"services.allocate_order[20_lines,{backend}]", per_order)
@@ -0,0 +1,72 @@
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.allocation.service_layer import services, unit_of_work
+
+SKUS = 4
+BATCHES = 50  # per SKU
+EXISTING_LINES = 500  # per SKU, which the aggregate path loads on every allocation
+ALLOCATIONS = 200
+THREADS = 8
+
+
+def allocations_per_second(allocate, uow_factory, prefix: str, threads: int = 1) -> tuple[float, int]:
+    """
+    Allocates ALLOCATIONS new lines across the SKUS products from ``threads``
+    threads, returning the rate and how many gave up on conflicts
+    """
+
+    conflicts = []
+
+    def place_orders(thread_number: int):
+        for i in range(thread_number, ALLOCATIONS, threads):
+            try:
+                allocate(f"{prefix}-{i}", f"sku-{i % SKUS}", 1, uow_factory())
+            except unit_of_work.ConcurrentModification:
+                conflicts.append(i)
+
+    workers = [threading.Thread(target=place_orders, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return ALLOCATIONS / (time.perf_counter() - start), len(conflicts)
+
+
+def test_sql_allocation_against_the_aggregate(benchmark, bench_db_uri):
+    engine = create_engine(bench_db_uri)
+    backend = engine.url.get_backend_name()
+    session_factory = sessionmaker(bind=engine)
+
+    def uow():
+        return unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+
+    for sku in range(SKUS):
+        for i in range(BATCHES):
+            services.add_batch(f"batch-{sku}-{i}", f"sku-{sku}", 1_000, None, uow())
+        services.allocate_many([(f"existing-{i}", f"sku-{sku}", 1) for i in range(EXISTING_LINES)], uow())
+
+    aggregate, _ = allocations_per_second(services.allocate, uow, "aggregate")
+    direct, _ = allocations_per_second(services.allocate_direct, uow, "direct")
+    aggregate_threaded, aggregate_conflicts = allocations_per_second(
+        services.allocate, uow, "aggregate-threaded", THREADS
+    )
+    direct_threaded, direct_conflicts = allocations_per_second(
+        services.allocate_direct, uow, "direct-threaded", THREADS
+    )
+
+    print(
+        f"\nallocate on {backend}: {aggregate:,.0f}/s through the aggregate, {direct:,.0f}/s in SQL;"
+        f" from {THREADS} threads {aggregate_threaded:,.0f}/s ({aggregate_conflicts} gave up)"
+        f" and {direct_threaded:,.0f}/s ({direct_conflicts} gave up)"
+    )
+    benchmark.record(f"sql_allocation.baseline_allocate[{backend}]", 1 / aggregate)
+    benchmark.record(f"sql_allocation.allocate_direct[{backend}]", 1 / direct)
+    benchmark.record(f"sql_allocation.baseline_allocate[{THREADS}_threads,{backend}]", 1 / aggregate_threaded)
+    benchmark.record(f"sql_allocation.allocate_direct[{THREADS}_threads,{backend}]", 1 / direct_threaded)
+    # Allocating under the product's row lock, the SQL path never conflicts
+    assert direct_conflicts == 0
@@ -0,0 +1,59 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from sqlalchemy import create_engine
+
+from src.allocation.adapters.orm import metadata
+
+REPO_ROOT = Path(__file__).parents[2]
+
+COLD_START = """
+import json, time
+started = time.perf_counter()
+from src.allocation.entrypoints.flask_app import app
+imported = time.perf_counter()
+
+from sqlalchemy import inspect
+from src.allocation.adapters import database
+from src.allocation.domain import model
+lazy = not database._engines and inspect(model.Product, raiseerr=False) is None
+
+response = app.test_client().post(
+    "/add_batch", json={"ref": "b1", "sku": "COLD-SKU", "qty": 10, "eta": None}
+)
+first_request = time.perf_counter()
+print(json.dumps(dict(
+    import_seconds=imported - started,
+    first_request_seconds=first_request - imported,
+    lazy=lazy,
+    status=response.status_code,
+)))
+"""
+
+
+def test_cold_start(benchmark, tmp_path):
+    db_uri = f"sqlite:///{tmp_path / 'cold.db'}"
+    metadata.create_all(create_engine(db_uri))
+    env = dict(os.environ, DB_URI=db_uri, DB_HOST="unreachable.invalid")
+
+    output = subprocess.run(
+        [sys.executable, "-c", COLD_START],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    result = json.loads(output)
+
+    print(
+        f"\ncold start: import {result['import_seconds'] * 1e3:.0f}ms,"
+        f" first request {result['first_request_seconds'] * 1e3:.0f}ms"
+    )
+    benchmark.record("startup.import", result["import_seconds"])
+    benchmark.record("startup.first_request", result["first_request_seconds"])
+    assert result["lazy"]
+    assert result["status"] == 201
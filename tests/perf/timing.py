@@ -0,0 +1,15 @@
+import time
+from typing import Callable
+
+
+def best_of(fn: Callable[[], object], repeat: int = 5, number: int = 100) -> float:
+    """
+    Seconds per call of ``fn``, taking the fastest of ``repeat`` runs of ``number`` calls
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
@@ -61,3 +61,27 @@ def test_can_only_deallocate_allocated_lines():
     batch, unallocated_line = make_batch_and_line("DECORATIVE-TRINKET", 20, 2)
     batch.deallocate(unallocated_line)
     assert batch.available_quantity == 20
+
+
+def test_allocated_quantity_tracks_allocations_and_deallocations():
+    batch = Batch("batch-001", "TALL-BOOKCASE", qty=20, eta=None)
+    line1 = OrderLine("order-1", "TALL-BOOKCASE", 3)
+    line2 = OrderLine("order-2", "TALL-BOOKCASE", 5)
+
+    batch.allocate(line1)
+    batch.allocate(line2)
+    batch.deallocate(line1)
+
+    assert batch.allocated_quantity == 5
+    assert batch.available_quantity == 15
+
+
+def test_deallocate_all_empties_the_batch():
+    batch = Batch("batch-001", "TALL-BOOKCASE", qty=20, eta=None)
+    batch.allocate(OrderLine("order-2", "TALL-BOOKCASE", 5))
+    batch.allocate(OrderLine("order-1", "TALL-BOOKCASE", 3))
+
+    lines = batch.deallocate_all()
+
+    assert lines == [OrderLine("order-1", "TALL-BOOKCASE", 3), OrderLine("order-2", "TALL-BOOKCASE", 5)]
+    assert batch.available_quantity == 20
@@ -0,0 +1,61 @@
+from src.allocation.adapters.cache import AllocationCache, ProductCache
+from src.allocation.domain.model import OrderLine, Product
+
+
+def test_returns_cached_product_only_at_matching_version():
+    cache = ProductCache()
+    product = Product("FLUFFY-RUG", batches=[], version_number=3)
+    cache.put(product)
+
+    assert cache.get("FLUFFY-RUG", 3) is product
+    assert cache.get("FLUFFY-RUG", 4) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_evicts_least_recently_used_products():
+    cache = ProductCache(max_size=2)
+    cache.put(Product("sku1", batches=[]))
+    cache.put(Product("sku2", batches=[]))
+    cache.get("sku1", 0)
+
+    cache.put(Product("sku3", batches=[]))
+
+    assert cache.get("sku1", 0) is not None
+    assert cache.get("sku2", 0) is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidated_products_are_not_returned():
+    cache = ProductCache()
+    cache.put(Product("sku1", batches=[]))
+
+    cache.invalidate("sku1")
+
+    assert cache.get("sku1", 0) is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_remembered_allocations_expire():
+    now = [100.0]
+    cache = AllocationCache(ttl=30, clock=lambda: now[0])
+    cache.put(OrderLine("o1", "LAMP", 2), "b1")
+
+    assert cache.get(OrderLine("o1", "LAMP", 2)) == "b1"
+    assert cache.get(OrderLine("o1", "LAMP", 3)) is None
+    now[0] += 30
+    assert cache.get(OrderLine("o1", "LAMP", 2)) is None
+    assert cache.stats() == dict(size=0, hits=1, misses=2, evictions=0, invalidations=0)
+
+
+def test_forgets_allocations_to_deleted_batches():
+    cache = AllocationCache()
+    cache.put(OrderLine("o1", "LAMP", 2), "b1")
+    cache.put(OrderLine("o2", "LAMP", 2), "b2")
+    cache.put(OrderLine("o3", "LAMP", 2), "b1")
+
+    cache.invalidate_batches(["b1"])
+
+    assert cache.get(OrderLine("o1", "LAMP", 2)) is None
+    assert cache.get(OrderLine("o2", "LAMP", 2)) == "b2"
+    assert cache.stats()["invalidations"] == 2
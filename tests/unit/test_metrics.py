@@ -0,0 +1,62 @@
+import threading
+
+import pytest
+
+from src.allocation import metrics
+
+
+def test_counter_renders_in_prometheus_text_format():
+    counter = metrics.Counter("widgets_total", "Widgets made", labelnames=("colour",))
+    counter.inc(colour="red")
+    counter.inc(2, colour='sky "blue"')
+
+    assert counter.render() == [
+        "# HELP widgets_total Widgets made",
+        "# TYPE widgets_total counter",
+        'widgets_total{colour="red"} 1',
+        'widgets_total{colour="sky \\"blue\\""} 2',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value)
+
+    assert histogram.render()[2:] == [
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 6.05",
+        "latency_seconds_count 4",
+    ]
+
+
+def test_counter_is_safe_to_share_between_threads():
+    counter = metrics.Counter("hits_total", "Hits")
+
+    def hit():
+        for _ in range(10_000):
+            counter.inc()
+
+    threads = [threading.Thread(target=hit) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter.value() == 80_000
+
+
+def test_timed_records_latency_and_exception_types():
+    @metrics.timed
+    def flaky_service(fail: bool):
+        if fail:
+            raise KeyError("nope")
+
+    flaky_service(False)
+    with pytest.raises(KeyError):
+        flaky_service(True)
+
+    assert metrics.SERVICE_LATENCY.count(service="flaky_service") == 2
+    assert metrics.SERVICE_ERRORS.value(service="flaky_service", error="KeyError") == 1
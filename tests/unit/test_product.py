@@ -1,3 +1,4 @@
+import random
 from datetime import date, timedelta
 
 import pytest
@@ -54,3 +55,155 @@ def test_raises_out_of_stock_exception_if_cannot_allocate():
 
     with pytest.raises(OutOfStock, match="SMALL-FORK"):
         product.allocate(OrderLine("order2", "SMALL-FORK", 1))
+
+
+def test_skips_batches_without_enough_stock():
+    earliest = Batch("speedy-batch", "SHINY-KETTLE", qty=5, eta=today)
+    latest = Batch("slow-batch", "SHINY-KETTLE", qty=100, eta=later)
+    product = Product(sku="SHINY-KETTLE", batches=[latest, earliest])
+
+    assert product.allocate(OrderLine("order1", "SHINY-KETTLE", 4)) == "speedy-batch"
+    assert product.allocate(OrderLine("order2", "SHINY-KETTLE", 4)) == "slow-batch"
+    assert product.allocate(OrderLine("order3", "SHINY-KETTLE", 1)) == "speedy-batch"
+
+
+def test_allocates_to_batches_added_after_earlier_allocations():
+    shipment_batch = Batch("shipment-batch", "WOBBLY-STOOL", qty=100, eta=tomorrow)
+    product = Product(sku="WOBBLY-STOOL", batches=[shipment_batch])
+    product.allocate(OrderLine("order1", "WOBBLY-STOOL", 10))
+
+    product.add_batch(Batch("in-stock-batch", "WOBBLY-STOOL", qty=100, eta=None))
+
+    assert product.allocate(OrderLine("order2", "WOBBLY-STOOL", 10)) == "in-stock-batch"
+
+
+def test_does_not_allocate_to_removed_batches():
+    in_stock_batch = Batch("in-stock-batch", "FOLDING-TABLE", qty=100, eta=None)
+    shipment_batch = Batch("shipment-batch", "FOLDING-TABLE", qty=100, eta=tomorrow)
+    product = Product(sku="FOLDING-TABLE", batches=[in_stock_batch, shipment_batch])
+    product.allocate(OrderLine("order1", "FOLDING-TABLE", 10))
+
+    assert product.remove_batch("in-stock-batch") is in_stock_batch
+
+    assert product.allocate(OrderLine("order2", "FOLDING-TABLE", 10)) == "shipment-batch"
+    assert product.remove_batch("in-stock-batch") is None
+
+
+def test_raises_out_of_stock_when_line_is_larger_than_any_batch():
+    product = Product(sku="HUGE-SOFA", batches=[
+        Batch("batch1", "HUGE-SOFA", 10, eta=None),
+        Batch("batch2", "HUGE-SOFA", 10, eta=today),
+    ])
+
+    with pytest.raises(OutOfStock, match="HUGE-SOFA"):
+        product.allocate(OrderLine("order1", "HUGE-SOFA", 11))
+
+
+def test_increments_version_number():
+    line = OrderLine("oref", "SCANDI-PEN", 10)
+    product = Product(sku="SCANDI-PEN", batches=[Batch("b1", "SCANDI-PEN", 100, eta=None)], version_number=7)
+
+    product.allocate(line)
+
+    assert product.version_number == 8
+
+
+def test_retiring_a_batch_returns_its_lines():
+    in_stock_batch = Batch("in-stock-batch", "FOLDING-TABLE", qty=100, eta=None)
+    shipment_batch = Batch("shipment-batch", "FOLDING-TABLE", qty=100, eta=tomorrow)
+    product = Product(sku="FOLDING-TABLE", batches=[in_stock_batch, shipment_batch])
+    product.allocate(OrderLine("order1", "FOLDING-TABLE", 10))
+
+    assert product.retire_batch("in-stock-batch") == [OrderLine("order1", "FOLDING-TABLE", 10)]
+    assert product.batches == [shipment_batch]
+    assert product.retire_batch("in-stock-batch") is None
+
+
+def test_rebalancing_moves_lines_to_a_new_warehouse_batch():
+    shipment = Batch("shipment", "SMALL-FORK", qty=20, eta=tomorrow)
+    slow_shipment = Batch("slow-shipment", "SMALL-FORK", qty=20, eta=later)
+    product = Product(sku="SMALL-FORK", batches=[shipment, slow_shipment])
+    for orderid, qty in [("o1", 10), ("o2", 10), ("o3", 8), ("o4", 8)]:
+        product.allocate(OrderLine(orderid, "SMALL-FORK", qty))
+    product.add_batch(Batch("warehouse", "SMALL-FORK", qty=12, eta=None))
+    version = product.version_number
+
+    moved = product.rebalance()
+
+    # The latest lines move first; o4 then no longer fits anywhere better
+    assert moved == [(OrderLine("o3", "SMALL-FORK", 8), "warehouse")]
+    assert [b.available_quantity for b in product.batches] == [0, 12, 4]
+    assert product.version_number == version + 1
+    assert product.rebalance() == []
+    assert product.version_number == version + 1
+
+
+def test_rebalancing_uses_room_freed_by_lines_it_moved():
+    warehouse = Batch("warehouse", "BIG-FORK", qty=3, eta=None)
+    shipment = Batch("shipment", "BIG-FORK", qty=5, eta=tomorrow)
+    slow_shipment = Batch("slow-shipment", "BIG-FORK", qty=10, eta=later)
+    product = Product(sku="BIG-FORK", batches=[shipment, slow_shipment])
+    product.allocate(OrderLine("o1", "BIG-FORK", 3))
+    product.allocate(OrderLine("o2", "BIG-FORK", 4))
+    product.add_batch(warehouse)
+
+    moved = product.rebalance()
+
+    assert moved == [
+        (OrderLine("o1", "BIG-FORK", 3), "warehouse"),
+        (OrderLine("o2", "BIG-FORK", 4), "shipment"),
+    ]
+    assert [b.available_quantity for b in [warehouse, shipment, slow_shipment]] == [0, 1, 10]
+
+
+def test_rebalanced_allocations_match_allocating_afresh_when_there_is_room():
+    shipments = [Batch(f"shipment{i}", "LONG-FORK", qty=10, eta=later + timedelta(days=i)) for i in range(5)]
+    product = Product(sku="LONG-FORK", batches=list(shipments))
+    lines = [OrderLine(f"o{i}", "LONG-FORK", 1 + i % 3) for i in range(20)]
+    for line in lines:
+        product.allocate(line)
+    product.add_batch(Batch("warehouse", "LONG-FORK", qty=100, eta=None))
+
+    moved = product.rebalance()
+
+    assert sorted(moved, key=lambda move: move[0].orderid) == sorted(
+        [(line, "warehouse") for line in lines], key=lambda move: move[0].orderid
+    )
+    assert all(b.available_quantity == 10 for b in shipments)
+
+
+def test_allocates_to_room_freed_by_deallocating_a_batch_directly():
+    warehouse = Batch("warehouse", "DESK-FAN", qty=10, eta=None)
+    shipment = Batch("shipment", "DESK-FAN", qty=10, eta=tomorrow)
+    product = Product(sku="DESK-FAN", batches=[warehouse, shipment])
+    first = OrderLine("o1", "DESK-FAN", 10)
+    product.allocate(first)
+
+    warehouse.deallocate(first)
+
+    assert product.allocate(OrderLine("o2", "DESK-FAN", 5)) == "warehouse"
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_allocates_like_first_fit_when_batches_are_changed_directly(seed):
+    rng = random.Random(seed)
+    batches = [
+        Batch(f"b{i}", "DESK-FAN", qty=rng.randint(1, 20), eta=rng.choice([None, tomorrow, later]))
+        for i in range(10)
+    ]
+    product = Product(sku="DESK-FAN", batches=list(batches))
+    allocated: list[tuple[Batch, OrderLine]] = []
+
+    for i in range(200):
+        if allocated and rng.random() < 0.4:
+            batch, line = allocated.pop(rng.randrange(len(allocated)))
+            batch.deallocate(line)
+            continue
+        line = OrderLine(f"o{i}", "DESK-FAN", rng.randint(1, 8))
+        expected = next((b for b in sorted(batches) if b.can_allocate(line)), None)
+        if expected is None:
+            with pytest.raises(OutOfStock):
+                product.allocate(line)
+        else:
+            assert product.allocate(line) == expected.reference
+            allocated.append((expected, line))
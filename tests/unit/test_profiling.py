@@ -0,0 +1,38 @@
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from src.allocation.entrypoints.profiling import ProfilingMiddleware
+
+
+def hello_app(environ, start_response):
+    return Response("hello")(environ, start_response)
+
+
+def test_requests_without_the_header_are_not_profiled(tmp_path):
+    client = Client(ProfilingMiddleware(hello_app, tmp_path))
+
+    response = client.get("/")
+
+    assert response.get_data() == b"hello"
+    assert "X-Profile-Id" not in response.headers
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_requests_with_the_header_are_profiled(tmp_path):
+    client = Client(ProfilingMiddleware(hello_app, tmp_path, header="X-Debug-Profile"))
+
+    response = client.get("/some/path", headers={"X-Debug-Profile": "1"})
+
+    profile_id = response.headers["X-Profile-Id"]
+    assert response.get_data() == b"hello"
+    assert sorted(p.name for p in tmp_path.iterdir()) == [f"{profile_id}.pstats", f"{profile_id}.txt"]
+    assert (tmp_path / f"{profile_id}.txt").read_text().startswith("GET /some/path: ")
+
+
+def test_requests_are_sampled_at_the_configured_rate(tmp_path):
+    draws = iter([0.5, 0.05, 0.2])
+    client = Client(ProfilingMiddleware(hello_app, tmp_path, sample_rate=0.1, sample=lambda: next(draws)))
+
+    profiled = ["X-Profile-Id" in client.get("/").headers for _ in range(3)]
+
+    assert profiled == [False, True, False]
@@ -1,7 +1,10 @@
+import copy
 from datetime import date, timedelta
+from typing import Sequence
 
 import pytest
 
+from src.allocation import metrics
 from src.allocation.adapters import repository
 from src.allocation.domain import model
 from src.allocation.service_layer import services, unit_of_work
@@ -27,9 +30,29 @@ class FakeRepository(repository.AbstractProductRepository):
         except StopIteration:
             return None
 
+    def get_many(self, skus: list[str]) -> list[model.Product]:
+        return sorted((p for p in self._products if p.sku in skus), key=lambda p: p.sku)
+
     def list(self) -> list[model.Product]:
         return list(self._products)
 
+    def get_allocation(self, orderid: str, sku: str) -> tuple[model.OrderLine, str] | None:
+        product = self.get(sku)
+        for batch in product.batches if product else []:
+            for line in batch._allocations:
+                if line.orderid == orderid:
+                    return line, batch.reference
+        return None
+
+    def get_batchrefs(self, lines: Sequence[model.OrderLine]) -> dict[model.OrderLine, str]:
+        batchrefs = {}
+        for line in lines:
+            product = self.get(line.sku)
+            for batch in product.batches if product else []:
+                if batch.is_allocated(line):
+                    batchrefs[line] = batch.reference
+        return batchrefs
+
 
 class FakeSession:
     committed = False
@@ -40,7 +63,7 @@ class FakeSession:
 
 class FakeUnitOfWork(unit_of_work.AbstractUnitOfWork):
     def __init__(self):
-        self.products = FakeRepository([])
+        self.products: FakeRepository = FakeRepository([])
         self.committed = False
 
     def __enter__(self):
@@ -95,6 +118,50 @@ def test_remove_batch():
     assert retrieved_product.batches == []
 
 
+def test_delete_batch_reallocates_its_lines():
+    uow = FakeUnitOfWork()
+    services.add_batch("in-stock", "CRUNCHY-ARMCHAIR", qty=10, eta=None, uow=uow)
+    services.add_batch("shipment", "CRUNCHY-ARMCHAIR", qty=5, eta=tomorrow, uow=uow)
+    services.allocate("o1", "CRUNCHY-ARMCHAIR", 4, uow)
+    services.allocate("o2", "CRUNCHY-ARMCHAIR", 4, uow)
+
+    results = services.delete_batch(ref="in-stock", sku="CRUNCHY-ARMCHAIR", uow=uow)
+
+    assert [(r.orderid, r.batchref, r.error) for r in results] == [
+        ("o1", "shipment", None),
+        ("o2", None, "Out of stock for sku CRUNCHY-ARMCHAIR"),
+    ]
+    assert uow.committed
+
+
+def test_add_batch_can_rebalance_onto_the_new_batch():
+    uow = FakeUnitOfWork()
+    services.add_batch("shipment", "CRUNCHY-ARMCHAIR", qty=10, eta=tomorrow, uow=uow)
+    services.allocate("o1", "CRUNCHY-ARMCHAIR", 4, uow)
+    services.allocate("o2", "CRUNCHY-ARMCHAIR", 4, uow)
+
+    services.add_batch("in-stock", "CRUNCHY-ARMCHAIR", qty=5, eta=None, uow=uow, rebalance=True)
+
+    assert uow.products.get_batchref(model.OrderLine("o1", "CRUNCHY-ARMCHAIR", 4)) == "in-stock"
+    assert uow.products.get_batchref(model.OrderLine("o2", "CRUNCHY-ARMCHAIR", 4)) == "shipment"
+
+
+def test_rebalance_reports_the_lines_it_moved():
+    uow = FakeUnitOfWork()
+    services.add_batch("shipment", "CRUNCHY-ARMCHAIR", qty=10, eta=tomorrow, uow=uow)
+    services.allocate("o1", "CRUNCHY-ARMCHAIR", 4, uow)
+    services.add_batch("in-stock", "CRUNCHY-ARMCHAIR", qty=5, eta=None, uow=uow)
+    uow.committed = False
+
+    results = services.rebalance("CRUNCHY-ARMCHAIR", uow)
+
+    assert [(r.orderid, r.batchref) for r in results] == [("o1", "in-stock")]
+    assert uow.committed
+    assert services.rebalance("CRUNCHY-ARMCHAIR", uow) == []
+    with pytest.raises(services.InvalidSku):
+        services.rebalance("NONEXISTENTSKU", uow)
+
+
 def test_allocate_errors_for_invalid_sku():
     uow = FakeUnitOfWork()
     services.add_batch("b1", "AREALSKU", qty=100, eta=None, uow=uow)
@@ -128,3 +195,199 @@ def test_prefers_current_stock_batches_to_shipments():
     shipment_batch = next(b for b in retrieved_product_batches if b.reference == "shipment-batch")
     assert in_stock_batch.available_quantity == 90
     assert shipment_batch.available_quantity == 100
+
+
+def test_allocate_many_returns_results_in_input_order():
+    uow = FakeUnitOfWork()
+    services.add_batch("lamp-batch", "TALL-LAMP", qty=10, eta=None, uow=uow)
+    services.add_batch("rug-batch", "SHAGGY-RUG", qty=10, eta=None, uow=uow)
+
+    results = services.allocate_many([
+        ("o1", "TALL-LAMP", 5),
+        ("o2", "SHAGGY-RUG", 5),
+        ("o3", "TALL-LAMP", 5),
+    ], uow)
+
+    assert [(r.orderid, r.batchref) for r in results] == [
+        ("o1", "lamp-batch"),
+        ("o2", "rug-batch"),
+        ("o3", "lamp-batch"),
+    ]
+    assert uow.committed
+
+
+def test_allocate_many_reports_errors_per_line():
+    uow = FakeUnitOfWork()
+    services.add_batch("lamp-batch", "SHORT-LAMP", qty=10, eta=None, uow=uow)
+
+    results = services.allocate_many([
+        ("o1", "SHORT-LAMP", 8),
+        ("o2", "SHORT-LAMP", 8),
+        ("o3", "NONEXISTENTSKU", 1),
+    ], uow)
+
+    assert results[0].batchref == "lamp-batch"
+    assert results[1].batchref is None
+    assert results[1].error == "Out of stock for sku SHORT-LAMP"
+    assert results[2].error == "Invalid sku NONEXISTENTSKU"
+
+
+def test_allocate_many_allocates_a_repeated_line_once():
+    uow = FakeUnitOfWork()
+    services.add_batch("b1", "SMALL-LAMP", qty=5, eta=None, uow=uow)
+    services.add_batch("b2", "SMALL-LAMP", qty=10, eta=tomorrow, uow=uow)
+
+    first = services.allocate_many([("o1", "SMALL-LAMP", 4), ("o1", "SMALL-LAMP", 4)], uow)
+    resent = services.allocate_many([("o1", "SMALL-LAMP", 4)], uow)
+
+    assert [r.batchref for r in first] == ["b1", "b1"]
+    assert [r.batchref for r in resent] == ["b1"]
+    product = uow.products.get("SMALL-LAMP")
+    assert product is not None
+    assert [b.available_quantity for b in product.batches] == [1, 10]
+
+
+class CountingUnitOfWork(FakeUnitOfWork):
+    commits = 0
+
+    def commit(self):
+        self.commits += 1
+        super().commit()
+
+
+def test_allocate_order_commits_every_line_at_once():
+    uow = CountingUnitOfWork()
+    services.add_batch("lamp-batch", "ORDERED-LAMP", qty=10, eta=None, uow=uow)
+    services.add_batch("rug-batch", "ORDERED-RUG", qty=10, eta=None, uow=uow)
+    uow.commits = 0
+
+    results = services.allocate_order("o1", [
+        ("ORDERED-RUG", 5),
+        ("ORDERED-LAMP", 5),
+        ("ORDERED-LAMP", 8),
+        ("UNKNOWN-SKU", 1),
+    ], uow)
+
+    assert [(r.sku, r.batchref, r.error) for r in results] == [
+        ("ORDERED-RUG", "rug-batch", None),
+        ("ORDERED-LAMP", "lamp-batch", None),
+        ("ORDERED-LAMP", None, "Out of stock for sku ORDERED-LAMP"),
+        ("UNKNOWN-SKU", None, "Invalid sku UNKNOWN-SKU"),
+    ]
+    assert uow.commits == 1
+
+
+def test_repeated_order_allocates_each_line_once():
+    uow = FakeUnitOfWork()
+    services.add_batch("b1", "REORDERED-LAMP", qty=10, eta=None, uow=uow)
+    services.allocate_order("o1", [("REORDERED-LAMP", 3), ("REORDERED-LAMP", 3)], uow)
+
+    results = services.allocate_order("o1", [("REORDERED-LAMP", 3), ("REORDERED-LAMP", 4)], uow)
+
+    assert [r.batchref for r in results] == ["b1", "b1"]
+    product = uow.products.get("REORDERED-LAMP")
+    assert product is not None
+    [batch] = product.batches
+    assert batch.available_quantity == 3
+
+
+class ConflictingUnitOfWork(FakeUnitOfWork):
+    """
+    Fails the first ``conflicts`` commits as if another transaction got there
+    first, discarding that attempt's changes
+    """
+
+    def __init__(self, conflicts: int):
+        super().__init__()
+        self.conflicts = conflicts
+
+    def __enter__(self):
+        self.committed_products = copy.deepcopy(self.products._products)
+
+    def commit(self):
+        if self.conflicts:
+            self.conflicts -= 1
+            raise unit_of_work.ConcurrentModification()
+        super().commit()
+        self.committed_products = copy.deepcopy(self.products._products)
+
+    def rollback(self):
+        self.products._products = self.committed_products
+
+
+def test_allocate_retries_on_concurrent_modification():
+    uow = ConflictingUnitOfWork(conflicts=0)
+    services.add_batch("b1", "CONTESTED-LAMP", qty=100, eta=None, uow=uow)
+    uow.conflicts = 2
+
+    result = services.allocate("o1", "CONTESTED-LAMP", 10, uow)
+
+    assert result == "b1"
+    assert uow.committed
+
+
+def test_add_batch_retries_on_concurrent_modification():
+    uow = ConflictingUnitOfWork(conflicts=0)
+    services.add_batch("b1", "CONTESTED-LAMP", qty=100, eta=None, uow=uow)
+    uow.conflicts = 2
+
+    services.add_batch("b2", "CONTESTED-LAMP", qty=100, eta=None, uow=uow)
+
+    product = uow.products.get("CONTESTED-LAMP")
+    assert product is not None
+    assert [b.reference for b in product.batches] == ["b1", "b2"]
+
+
+def test_allocate_gives_up_after_max_attempts():
+    uow = ConflictingUnitOfWork(conflicts=0)
+    services.add_batch("b1", "HOTLY-CONTESTED-LAMP", qty=100, eta=None, uow=uow)
+    uow.conflicts = services.MAX_ATTEMPTS
+
+    with pytest.raises(unit_of_work.ConcurrentModification):
+        services.allocate("o1", "HOTLY-CONTESTED-LAMP", 10, uow)
+
+
+def test_repeated_allocation_returns_the_original_batch():
+    uow = FakeUnitOfWork()
+    services.add_batch("b1", "RETRIED-LAMP", 10, None, uow)
+    services.add_batch("b2", "RETRIED-LAMP", 10, None, uow)
+    services.allocate("o1", "RETRIED-LAMP", 6, uow)
+    deduplicated = metrics.ALLOCATIONS_DEDUPLICATED.value()
+
+    assert services.allocate("o1", "RETRIED-LAMP", 6, uow) == "b1"
+
+    product = uow.products.get("RETRIED-LAMP")
+    assert product is not None
+    assert [b.available_quantity for b in product.batches] == [4, 10]
+    assert metrics.ALLOCATIONS_DEDUPLICATED.value() == deduplicated + 1
+
+
+def test_allocate_direct_allocates_like_allocate():
+    uow = FakeUnitOfWork()
+    services.add_batch("in-stock-batch", "RETRO-CLOCK", 100, None, uow)
+    services.add_batch("shipment-batch", "RETRO-CLOCK", 100, tomorrow, uow)
+
+    first = services.allocate_direct("o1", "RETRO-CLOCK", 60, uow)
+    second = services.allocate_direct("o2", "RETRO-CLOCK", 60, uow)
+    repeated = services.allocate_direct("o1", "RETRO-CLOCK", 60, uow)
+
+    assert (first, second, repeated) == ("in-stock-batch", "shipment-batch", "in-stock-batch")
+    with pytest.raises(services.InvalidSku, match="Invalid sku NONEXISTENTSKU"):
+        services.allocate_direct("o3", "NONEXISTENTSKU", 1, uow)
+
+
+def test_deallocate_frees_the_batch():
+    uow = FakeUnitOfWork()
+    services.add_batch("b1", "BLUE-PLINTH", 10, None, uow)
+    services.allocate("o1", "BLUE-PLINTH", 10, uow)
+
+    assert services.deallocate("o1", "BLUE-PLINTH", uow) == "b1"
+    assert services.allocate("o2", "BLUE-PLINTH", 10, uow) == "b1"
+
+
+def test_deallocate_errors_for_unallocated_line():
+    uow = FakeUnitOfWork()
+    services.add_batch("b1", "BLUE-PLINTH", 10, None, uow)
+
+    with pytest.raises(services.NotAllocated, match="o1"):
+        services.deallocate("o1", "BLUE-PLINTH", uow)